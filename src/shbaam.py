@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+#*******************************************************************************
+#shbaam.py
+#*******************************************************************************
+
+#Purpose:
+#Run any of the SHBAAM tools from one unique command:
+#   shbaam.py twsa    GRACE anomalies for a shapefile (see shbaam_jobs.py)
+#   shbaam.py swe     LDAS snow water equivalent anomalies (shbaam_brian.py)
+#   shbaam.py conc    Concatenation of netCDF files (shbaam_conc.py)
+#   shbaam.py ldas    Download of LDAS files (shbaam_ldas.py)
+#   shbaam.py cache   Cell-major cache of a netCDF variable (shbaam_cmaj.py)
+#   shbaam.py compare Comparison of two CSV, netCDF or shapefiles (tst_cmp_*.py)
+#Only the Python standard library is imported at startup. The number of
+#arguments of the subcommand is checked first, and the script of the subcommand
+#is then run as if it was called directly, so that the heavy modules (netCDF4,
+#fiona, shapely, rtree, requests) are only imported by the tools that need them
+#and only once the command line is known to be valid.
+
+
+#*******************************************************************************
+#Import Python modules
+#*******************************************************************************
+import sys
+import os.path
+import runpy
+
+
+#*******************************************************************************
+#Declaration of variables (given as command line arguments)
+#*******************************************************************************
+# 1 - subcommand: twsa, swe, conc, ldas, cache or compare
+# 2+- arguments of the subcommand, see YD_sub_arg
+
+
+#*******************************************************************************
+#Subcommands
+#*******************************************************************************
+shb_src_dir=os.path.dirname(os.path.abspath(__file__))
+shb_tst_dir=os.path.join(shb_src_dir,'..','tst')
+
+YD_sub_arg={'twsa': (5,21,'shb_grc_ncf shb_fct_ncf shb_pol_shp shb_wsa_csv '   \
+                          +'shb_wsa_ncf [shb_cel_dir shb_cel_mod shb_fea_fld ' \
+                          +'IS_tim_chk shb_are_mod shb_sta_npz shb_dat_beg '   \
+                          +'shb_dat_end ZS_bas_beg ZS_bas_end shb_bas_dir '    \
+                          +'shb_ncf_fmt shb_ncf_chk shb_ncf_crp shb_prf_jsn '  \
+                          +'shb_prf_dmp]'),                                    \
+            'swe': (5,15,'gld_ncf pol_shp pnt_shp swe_csv swe_ncf [prf_jsn '   \
+                        +'prf_dmp bas_beg bas_end dat_beg dat_end cel_mod '    \
+                        +'ncf_fmt ncf_chk ncf_crp]'),                          \
+            'conc': (2,None,'ncf_1 [ncf_2 ...] ncf_out'),                      \
+            'ldas': (4,6,'lsm_mod iso_beg iso_end lsm_dir [IS_wrk lsm_url]'),  \
+            'cache': (2,3,'ncf_fil var [IS_tim_chk]'),                         \
+            'compare': (2,None,'file1 file2 [options of tst_cmp_*.py]')}
+#Minimum and maximum (None for no maximum) numbers of arguments, and usage
+
+YD_sub_scr={'swe': os.path.join(shb_src_dir,'shbaam_brian.py'),                \
+            'conc': os.path.join(shb_src_dir,'shbaam_conc.py'),                \
+            'ldas': os.path.join(shb_src_dir,'shbaam_ldas.py'),                \
+            'cache': os.path.join(shb_src_dir,'shbaam_cmaj.py'),               \
+            '.csv': os.path.join(shb_tst_dir,'tst_cmp_csv.py'),                \
+            '.shp': os.path.join(shb_tst_dir,'tst_cmp_shp.py'),                \
+            '.nc': os.path.join(shb_tst_dir,'tst_cmp_n3d.py')}
+#Scripts run by the subcommands, compare uses the extension of the first file
+
+
+#*******************************************************************************
+#Usage
+#*******************************************************************************
+def usage(YS_sub=None):
+     """Print the usage of one subcommand, or of all of them."""
+     for YS_nam in sorted(YD_sub_arg):
+          if YS_sub is None or YS_sub==YS_nam:
+               print('shbaam.py '+YS_nam+' '+YD_sub_arg[YS_nam][2])
+
+
+#*******************************************************************************
+#Run a script as if it was called directly
+#*******************************************************************************
+def run_script(shb_scr_py,YV_arg):
+     """Run shb_scr_py as __main__ with the command line arguments YV_arg."""
+     sys.argv=[shb_scr_py]+list(YV_arg)
+     sys.path.insert(0,os.path.dirname(shb_scr_py))
+     runpy.run_path(shb_scr_py,run_name='__main__')
+
+
+#*******************************************************************************
+#GRACE anomalies
+#*******************************************************************************
+def twsa(YV_arg):
+     """Compute the anomalies of one shapefile with a TWSAJob."""
+     import shbaam_jobs
+     import shbaam_prof
+
+     shb_grc_ncf,shb_fct_ncf,shb_pol_shp,shb_wsa_csv,shb_wsa_ncf=YV_arg[:5]
+     YV_opt=list(YV_arg[5:])+['']*(16-len(YV_arg[5:]))
+     shb_cel_dir=YV_opt[0]
+     shb_cel_mod=YV_opt[1] or 'center'
+     shb_fea_fld=YV_opt[2]
+     IS_tim_chk=int(YV_opt[3] or 0)
+     shb_are_mod=YV_opt[4] or 'sphere'
+     shb_sta_npz=YV_opt[5]
+     #With shb_sta_npz, only the time steps added since the previous run are
+     #computed and appended to the outputs
+     shb_dat_beg=YV_opt[6]
+     shb_dat_end=YV_opt[7]
+     #Dates as YYYY-MM-DD, only the time steps between them are read
+     ZS_bas_beg=float(YV_opt[8] or 0)
+     ZS_bas_end=float(YV_opt[9] or 0)
+     shb_bas_dir=YV_opt[10]
+     #Baseline period in decimal years, 0 and 0 for the mean of the whole
+     #record, see shbaam_base.py
+     shb_ncf_fmt=YV_opt[11] or 'NETCDF3_CLASSIC'
+     shb_ncf_chk=YV_opt[12] or 'time'
+     shb_ncf_crp=YV_opt[13]=='True'
+     #Format, chunks and crop of the map, as in shbaam_twsa.py
+     shb_prf=shbaam_prof.StageProfiler(YV_opt[14],YV_opt[15],'shbaam.py twsa')
+     #JSON report and cProfile statistics of the run, see shbaam_prof.py
+
+     if shb_sta_npz!='':
+          shb_prf.output(shb_wsa_csv)
+          shb_prf.output(shb_wsa_ncf)
+     #The time steps appended to the outputs are counted
+
+     try:
+          shb_prf.stage('read_grace')
+          with shbaam_jobs.TWSAJob(shb_grc_ncf,shb_fct_ncf,shb_cel_dir,       \
+                                   shb_cel_mod,shb_are_mod,                    \
+                                   IS_tim_chk,ZS_bas_beg=ZS_bas_beg,           \
+                                   ZS_bas_end=ZS_bas_end,                      \
+                                   shb_bas_dir=shb_bas_dir,                    \
+                                   YS_dat_beg=shb_dat_beg,                     \
+                                   YS_dat_end=shb_dat_end,                     \
+                                   YS_ncf_fmt=shb_ncf_fmt,                     \
+                                   YS_ncf_chk=shb_ncf_chk,                     \
+                                   ZB_ncf_crp=shb_ncf_crp) as shb_job:
+               shb_prf.watch(shb_job.f)
+               shb_prf.watch(shb_job.g)
+               if shb_sta_npz!='':
+                    shb_prf.stage('update')
+                    shb_res=shb_job.update(shb_pol_shp,shb_sta_npz,shb_wsa_csv,\
+                                           shb_wsa_ncf,shb_fea_fld)
+               else:
+                    shb_prf.stage('anomaly')
+                    shb_res=shb_job.run(shb_pol_shp,shb_fea_fld)
+                    shb_prf.stage('write_csv')
+                    open(shb_wsa_csv,'wb').close()
+                    shb_prf.output(shb_wsa_csv)
+                    shb_job.write_csv(shb_res,shb_wsa_csv)
+                    if shb_wsa_ncf!='':
+                         shb_prf.stage('write_netcdf')
+                         if os.path.isfile(shb_wsa_ncf):
+                              os.remove(shb_wsa_ncf)
+                         shb_prf.output(shb_wsa_ncf)
+                         shb_job.write_map(shb_res,shb_wsa_ncf)
+                    #The outputs are emptied first, so that all the bytes
+                    #written are counted
+               shb_prf.stop()
+               print(' - The number of grid cells found is: '                  \
+                     +str(len(shb_res['IV_dom_lon'])))
+               print(' - The number of time steps computed is: '               \
+                     +str(len(shb_res['ZM_wsa'])))
+     except (IOError,ValueError) as e:
+          print('ERROR - '+str(e))
+          raise SystemExit(22)
+
+     if shb_prf.enabled:
+          shb_prf.write()
+
+
+#*******************************************************************************
+#Main
+#*******************************************************************************
+def main():
+     if len(sys.argv) < 2 or sys.argv[1] not in YD_sub_arg:
+          print('ERROR - The first argument must be one of: '                  \
+                +', '.join(sorted(YD_sub_arg)))
+          usage()
+          raise SystemExit(22)
+
+     YS_sub=sys.argv[1]
+     YV_arg=sys.argv[2:]
+     IS_min,IS_max,YS_use=YD_sub_arg[YS_sub]
+     if len(YV_arg) < IS_min or (IS_max is not None and len(YV_arg) > IS_max):
+          print('ERROR - Invalid number of arguments for '+YS_sub)
+          usage(YS_sub)
+          raise SystemExit(22)
+
+     if YS_sub=='twsa':
+          twsa(YV_arg)
+     elif YS_sub=='compare':
+          YS_ext=os.path.splitext(YV_arg[0])[1].lower()
+          if YS_ext not in YD_sub_scr:
+               YS_ext='.nc'
+          #netCDF files have various extensions (.nc, .nc4, .nc.gz)
+          run_script(YD_sub_scr[YS_ext],YV_arg)
+     else:
+          run_script(YD_sub_scr[YS_sub],YV_arg)
+
+
+if __name__ == '__main__':
+     main()
+
+
+#*******************************************************************************
+#End
+#*******************************************************************************
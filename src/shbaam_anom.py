@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+#*******************************************************************************
+#shbaam_anom.py
+#*******************************************************************************
+
+#Purpose:
+#Compute the long-term mean and the anomalies of a (time,lat,lon) variable for
+#a set of grid cells, while walking the time dimension in chunks. Only one
+#chunk of time steps is read at once, so that the peak memory is bounded by the
+#chunk size rather than by the length of the record. The mean is computed in a
+#first pass over all chunks and the anomalies in a second pass, which gives the
+#same results as a computation made on the whole variable at once.
+#Only the smallest lat/lon window covering the grid cells is read, or two
+#windows when the cells straddle the first and last longitudes of the grid.
+
+
+#*******************************************************************************
+#Import Python modules
+#*******************************************************************************
+import numpy
+
+
+#*******************************************************************************
+#Chunks of the time dimension
+#*******************************************************************************
+def time_chunks(IS_time,IS_chk=0,JS_tim_beg=0):
+     """Return the list of (start,end) indices of the time chunks.
+
+     The chunks cover the time steps JS_tim_beg to IS_time. A chunk size
+     IS_chk of 0 gives one unique chunk for all these time steps.
+     """
+     if IS_chk<=0 or IS_chk>=IS_time-JS_tim_beg:
+          return [(JS_tim_beg,IS_time)]
+     return [(JS_time,min(JS_time+IS_chk,IS_time))                             \
+             for JS_time in range(JS_tim_beg,IS_time,IS_chk)]
+
+
+#*******************************************************************************
+#Windows covering grid cells
+#*******************************************************************************
+def cell_windows(IV_cel_lat,IV_cel_lon,IS_lon):
+     """Return the latitude window and the longitude windows of grid cells.
+
+     The latitude window is (JS_lat_beg,JS_lat_end) and the longitude windows
+     are a list of (JS_lon_beg,JS_lon_end). The longitudes are periodic with
+     IS_lon values: if the largest gap between the longitudes of the cells is
+     not the one across the end of the grid, the cells straddle it and are
+     covered by two windows, one at each end of the grid.
+     """
+     if len(IV_cel_lat)==0:
+          return (0,1),[(0,1)]
+     JS_lat_beg=int(numpy.min(IV_cel_lat))
+     JS_lat_end=int(numpy.max(IV_cel_lat))+1
+
+     IV_lon=numpy.unique(IV_cel_lon)
+     JS_lon_beg=int(IV_lon[0])
+     JS_lon_end=int(IV_lon[-1])+1
+     if len(IV_lon)>1:
+          IV_gap=numpy.diff(IV_lon)
+          JS_gap=int(numpy.argmax(IV_gap))
+          if IV_gap[JS_gap]>IS_lon-JS_lon_end+1+JS_lon_beg:
+               return (JS_lat_beg,JS_lat_end),                                 \
+                      [(int(IV_lon[JS_gap+1]),JS_lon_end),                     \
+                       (JS_lon_beg,int(IV_lon[JS_gap])+1)]
+     return (JS_lat_beg,JS_lat_end),[(JS_lon_beg,JS_lon_end)]
+
+
+#*******************************************************************************
+#Read the values of grid cells
+#*******************************************************************************
+def read_cells(ZV_var,IV_cel_lat,IV_cel_lon,YT_key=()):
+     """Return the values of the grid cells of a (...,lat,lon) variable.
+
+     YT_key indexes the dimensions before lat and lon, e.g. (slice(0,12),) for
+     the first 12 time steps of a (time,lat,lon) variable, and the values are
+     returned with these dimensions followed by one for the cells. Only the
+     window(s) of cell_windows() are read, one call to the netCDF library
+     each.
+     """
+     IV_cel_lat=numpy.asarray(IV_cel_lat,dtype=numpy.int64)
+     IV_cel_lon=numpy.asarray(IV_cel_lon,dtype=numpy.int64)
+     (JS_lat_beg,JS_lat_end),YV_lon_win=cell_windows(IV_cel_lat,IV_cel_lon,   \
+                                                     ZV_var.shape[-1])
+     ZM_cel_var=None
+     for JS_lon_beg,JS_lon_end in YV_lon_win:
+          ZM_win=ZV_var[tuple(YT_key)+(slice(JS_lat_beg,JS_lat_end),           \
+                                       slice(JS_lon_beg,JS_lon_end))]
+          if len(YV_lon_win)==1:
+               return ZM_win[...,IV_cel_lat-JS_lat_beg,IV_cel_lon-JS_lon_beg]
+          ZM_win=numpy.ma.asarray(ZM_win)
+          if ZM_cel_var is None:
+               ZM_cel_var=numpy.ma.masked_all(ZM_win.shape[:-2]               \
+                                              +(len(IV_cel_lat),),             \
+                                              dtype=ZM_win.dtype)
+          IV_sel=(IV_cel_lon>=JS_lon_beg)&(IV_cel_lon<JS_lon_end)
+          ZM_cel_var[...,IV_sel]=ZM_win[...,IV_cel_lat[IV_sel]-JS_lat_beg,     \
+                                           IV_cel_lon[IV_sel]-JS_lon_beg]
+     return ZM_cel_var
+
+
+#*******************************************************************************
+#Read a (time,cell) block
+#*******************************************************************************
+def read_block(ZV_var,JS_beg,JS_end,IV_cel_lat,IV_cel_lon):
+     """Return the (time,cell) block of ZV_var for time steps JS_beg:JS_end.
+
+     The time steps are read with one single call to the netCDF library per
+     window covering the grid cells, and the values of the grid cells are
+     extracted from them.
+     """
+     return read_cells(ZV_var,IV_cel_lat,IV_cel_lon,(slice(JS_beg,JS_end),))
+
+
+#*******************************************************************************
+#Long-term mean
+#*******************************************************************************
+def cell_mean(ZV_var,IV_cel_lat,IV_cel_lon,IS_chk=0):
+     """Return the mean over time of each cell, and the last block read.
+
+     The values are summed chunk by chunk in double precision, and masked
+     values are ignored as in numpy.ma.mean. The last block read is returned
+     so that it can be reused when there is only one chunk.
+     """
+     IS_time=ZV_var.shape[0]
+     ZV_cel_sum=numpy.zeros(len(IV_cel_lat),dtype=numpy.float64)
+     IV_cel_cnt=numpy.zeros(len(IV_cel_lat),dtype=numpy.int64)
+     ZM_cel_var=None
+     for JS_beg,JS_end in time_chunks(IS_time,IS_chk):
+          ZM_cel_var=read_block(ZV_var,JS_beg,JS_end,IV_cel_lat,IV_cel_lon)
+          ZV_cel_sum=ZV_cel_sum+numpy.ma.filled(                               \
+                     numpy.ma.sum(ZM_cel_var,axis=0,dtype=numpy.float64),0)
+          IV_cel_cnt=IV_cel_cnt+numpy.ma.count(ZM_cel_var,axis=0)
+     with numpy.errstate(divide='ignore',invalid='ignore'):
+          ZV_cel_avg=ZV_cel_sum/IV_cel_cnt
+     return ZV_cel_avg,ZM_cel_var
+
+
+#*******************************************************************************
+#Anomalies
+#*******************************************************************************
+def cell_anomalies(ZV_var,IV_cel_lat,IV_cel_lon,ZV_cel_avg,IS_chk=0,          \
+                   ZM_cel_var=None,JS_tim_beg=0):
+     """Yield (start,end,block) with the anomalies of each time chunk.
+
+     If the record is made of one unique chunk, the block ZM_cel_var that was
+     already read by cell_mean() can be given to avoid reading it again.
+     Only the time steps from JS_tim_beg are read if it is given, e.g. those
+     added to a record since its mean was computed.
+     """
+     IS_time=ZV_var.shape[0]
+     YV_chk=time_chunks(IS_time,IS_chk,JS_tim_beg)
+     for JS_beg,JS_end in YV_chk:
+          if len(YV_chk)>1 or ZM_cel_var is None:
+               ZM_cel_var=read_block(ZV_var,JS_beg,JS_end,IV_cel_lat,IV_cel_lon)
+          yield JS_beg,JS_end,ZM_cel_var-ZV_cel_avg
+
+
+#*******************************************************************************
+#End
+#*******************************************************************************
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+#*******************************************************************************
+#shbaam_base.py
+#*******************************************************************************
+
+#Purpose:
+#Compute the baseline mean of a (time,lat,lon) variable over a period given in
+#decimal years (e.g. 2004.0 to 2009.999), for all grid cells at once, and store
+#it in a small sidecar file. The file is named after the source file and a hash
+#of the source file (path, size and modification time, and those of its member
+#files if it is a .json index, see shbaam_vrtl.py), variable and period, so
+#that any change in either of them leads to a new file. All basins that use
+#the same source file and period then look their baseline up in this grid
+#instead of averaging the time series of their cells again.
+
+
+#*******************************************************************************
+#Import Python modules
+#*******************************************************************************
+import os.path
+import hashlib
+import numpy
+import shbaam_anom
+import shbaam_npzf
+import shbaam_dset
+import shbaam_vrtl
+
+
+#*******************************************************************************
+#Name of a baseline file
+#*******************************************************************************
+def baseline_file(shb_ncf_fil,YS_var,ZS_bas_beg,ZS_bas_end,shb_bas_dir=''):
+     """Return the path of the baseline file of a variable and period.
+
+     The file is located in shb_bas_dir, or next to the source file if ''.
+     The member files of a .json index are part of its hash, so that a change
+     in any of them leads to another baseline file.
+     """
+     shb_bas_hsh=hashlib.sha1()
+     shbaam_vrtl.update_hash(shb_bas_hsh,shb_ncf_fil)
+     for YS_val in [YS_var,repr(float(ZS_bas_beg)),repr(float(ZS_bas_end))]:
+          shb_bas_hsh.update((YS_val+'\n').encode('utf-8'))
+     if shb_bas_dir=='':
+          shb_bas_dir=os.path.dirname(os.path.abspath(shb_ncf_fil))
+     return os.path.join(shb_bas_dir,os.path.basename(shb_ncf_fil)+'.baseline.'\
+                                    +shb_bas_hsh.hexdigest()[:16]+'.npz')
+
+
+#*******************************************************************************
+#Mean of all grid cells over a range of time steps
+#*******************************************************************************
+def grid_mean(ZV_var,JS_tim_beg,JS_tim_end,IS_chk=0):
+     """Return the (lat,lon) mean of ZV_var over time steps JS_tim_beg:end.
+
+     The time steps are read by chunks of IS_chk, the values are summed in
+     double precision and masked values are ignored. Cells without any value
+     are NaN.
+     """
+     ZM_sum=None
+     for JS_beg,JS_end in shbaam_anom.time_chunks(JS_tim_end,IS_chk,JS_tim_beg):
+          ZM_var=numpy.ma.masked_invalid(ZV_var[JS_beg:JS_end,:,:])
+          if ZM_sum is None:
+               ZM_sum=numpy.zeros(ZM_var.shape[1:],dtype=numpy.float64)
+               IM_cnt=numpy.zeros(ZM_var.shape[1:],dtype=numpy.int64)
+          ZM_sum=ZM_sum+numpy.ma.filled(                                       \
+                        numpy.ma.sum(ZM_var,axis=0,dtype=numpy.float64),0)
+          IM_cnt=IM_cnt+numpy.ma.count(ZM_var,axis=0)
+     with numpy.errstate(divide='ignore',invalid='ignore'):
+          return numpy.where(IM_cnt>0,ZM_sum/IM_cnt,numpy.nan)
+
+
+#*******************************************************************************
+#Baseline mean, with sidecar file
+#*******************************************************************************
+def baseline(shb_dst,ZS_bas_beg,ZS_bas_end,shb_bas_dir='',IS_chk=0):
+     """Return the (lat,lon) baseline mean of a GridDataset over a period.
+
+     The period includes the time steps whose decimal years (see
+     shbaam_dset.py) are between ZS_bas_beg and ZS_bas_end. The mean is read
+     from its baseline file if it exists, otherwise it is computed and saved.
+     The whole record is used even if a time window was set on the dataset.
+     """
+     shb_bas_npz=baseline_file(shb_dst.filepath,shb_dst.YS_var,ZS_bas_beg,    \
+                               ZS_bas_end,shb_bas_dir)
+     shb_bas_dat=shbaam_npzf.read_npz(shb_bas_npz)
+     if shb_bas_dat is not None and 'ZM_bas_avg' in shb_bas_dat:
+          print(' - The baseline mean was read from: '+shb_bas_npz)
+          return shb_bas_dat['ZM_bas_avg']
+
+     ZV_dec=shbaam_dset.decimal_years(shb_dst.ZV_tim_rec,shb_dst.YS_tim_unt,  \
+                                      shb_dst.YS_tim_cal)
+     IV_bas_tim=numpy.nonzero((ZV_dec>=ZS_bas_beg)&(ZV_dec<=ZS_bas_end))[0]
+     if len(IV_bas_tim)==0:
+          raise ValueError('No time step within the baseline period: '         \
+                           +str(ZS_bas_beg)+'-'+str(ZS_bas_end))
+     JS_tim_beg=int(IV_bas_tim[0])
+     JS_tim_end=int(IV_bas_tim[-1])+1
+     #The time is increasing, the period is one contiguous range of time steps
+
+     ZM_bas_avg=grid_mean(shb_dst.var_rec,JS_tim_beg,JS_tim_end,IS_chk)
+
+     shb_bas_dir=os.path.dirname(shb_bas_npz)
+     if not os.path.isdir(shb_bas_dir):
+          os.makedirs(shb_bas_dir)
+     shbaam_npzf.write_npz(shb_bas_npz,ZM_bas_avg=ZM_bas_avg,                 \
+                           IV_bas_tim=numpy.array([JS_tim_beg,JS_tim_end]))
+     print(' - The baseline mean was written in: '+shb_bas_npz)
+     return ZM_bas_avg
+
+
+#*******************************************************************************
+#End
+#*******************************************************************************
@@ -1,7 +1,6 @@
 #!/usr/bin/env python2
 
 import rtree
-import math
 import shapely.prepared
 import shapely.geometry
 import fiona
@@ -12,122 +11,92 @@ import csv
 import subprocess
 import os
 import numpy as np
+import shbaam_wght
+import shbaam_anom
+import shbaam_grid
+import shbaam_ncdf
+import shbaam_dset
+import shbaam_prof
+import shbaam_base
+import shbaam_cell
 
 """
-Computes total terrestrial water storage anomaly timeseries.
+Computes the SWE anomalies of the grid cells for all times.
 
 params:
-    longitudes {list} list containing longitude values from the original input netCDF4 file
-    latitudes {list} list containing latitude values from the original input netCDF4 file
-    swe_average {list} list containing SWE Averages calculated over the total surface area for a particular grid cell
-    surface_area {list} list containing the surface area of each grid cell
-    input_netCDF4 {file} file object which is the representation of the input netCDF4 file
+    input_netCDF4 {GridDataset} the input netCDF4 file, see shbaam_dset.py
+    longitudes {list} longitude indices of the grid cells
+    latitudes {list} latitude indices of the grid cells
+    swe_average {list} list containing the SWE average of each grid cell
+    swe {array} optional (time, cell) SWE of the grid cells if it was already read, e.g. when computing the averages
 
 return:
-    {list} a list containing the total swe for a particular time (month in this case)
+    {array} the (time, cell) anomalies of the grid cells
 """
 
 
-def water_storage_timeseries(longitudes, latitudes, swe_averages, surface_areas, input_netCDF4):
-    print('Compute total terrestrial water storage anomaly timeseries')
-
-    # compute total surface area
-    total_surface_area = 0
-    for grid_cell in range(len(swe_averages)):
-        total_surface_area += surface_areas[grid_cell]
-
-    # init timeseries
-    timeseries = []
-    
-    # grab all time dimensions for the timeseries, there should be one for each month we are measuring
-    times = len(input_netCDF4.dimensions['time'])
-    for time in range(times):
-        total_swe_anomaly = 0
-
-        # iterate through each grid cell, use swe_average since it has an average for each grid cell
-        for grid_cell in range(len(swe_averages)):
-
-            # init values to be used in calculations
-            lon = longitudes[grid_cell]
-            lat = latitudes[grid_cell]
-            surface_area = surface_areas[grid_cell]
-            swe_average = swe_averages[grid_cell]
-
-            # in original code, he did something with the mask, but I don't think we have to do this? line 363-366 {?}
-
-            # add to total surface area
-
-            # get original SWE for the grid cell at the time for this loop
-            swe_total = input_netCDF4.variables['SWE'][time, lat, lon]
-
-            # calculate the anomaly for this grid cell
-            anomaly = swe_total - swe_average
-
-            # multiply by the surface area to eliminate m^2
-            anomaly *= surface_area
-
-            # add to the running total for this period in time
-            total_swe_anomaly += anomaly
-
-            # want millimeters averaged over the entire area
-            # compute mass of volume of each grid cell
-
-            # add them up and divide over total area
-
-        # get average
-        timeseries.append(total_swe_anomaly / total_surface_area)
-
-    return timeseries
+def swe_anomalies(input_netCDF4, longitudes, latitudes, swe_averages, swe=None):
+    if swe is None:
+        # read the SWE of the grid cells for all times at once, only the window covering the grid cells is read
+        swe_var = input_netCDF4.variables['SWE']
+        swe = shbaam_anom.read_block(swe_var, 0, swe_var.shape[0], latitudes, longitudes)
+    return swe - np.asarray(swe_averages)
 
 
 """
-Creates a series of datetime strings for each of the time dimensions in the input netCDF4 file. Will use later when creating the output CSV file
-NOTE: this relies on my conc file to work accurately, because it gets access to the conc time variable and takes the date from there
+Computes total terrestrial water storage anomaly timeseries. The grid cells whose SWE is masked at all times (NoData, e.g.
+the ocean) have no weight, and the anomalies are averaged over the area of the other cells, as in shbaam_twsa.py
+
 params:
+    longitudes {list} list containing longitude values from the original input netCDF4 file
+    latitudes {list} list containing latitude values from the original input netCDF4 file
+    swe_average {list} list containing SWE Averages calculated over the total surface area for a particular grid cell
+    surface_area {list} list containing the surface area of each grid cell
     input_netCDF4 {file} file object which is the representation of the input netCDF4 file
+    anomalies {array} optional (time, cell) anomalies of the grid cells (see swe_anomalies), read if not given
 
 return:
-    timestrings {list} a list of datetime strings with each date representing a different month in the netCDF4 file
+    {list} a list containing the total swe for a particular time (month in this case), NaN if there is no valid cell
 """
 
 
-def create_timestrings(input_netCDF4):
-    print('Determining datestrings...')
-    # grab initial date from conc file. this uses the units from the conc file
-    timestring = ' '.join(input_netCDF4.variables['time'].units.split(' ')[2:])
-    origin_date = datetime.datetime.strptime(timestring, '%Y-%m-%d %H:%M:%S')
+def water_storage_timeseries(longitudes, latitudes, swe_averages, surface_areas, input_netCDF4, anomalies=None):
+    print('Compute total terrestrial water storage anomaly timeseries')
 
-    # init return array
-    timestrings = [origin_date]
+    if anomalies is None:
+        anomalies = swe_anomalies(input_netCDF4, longitudes, latitudes, swe_averages)
 
-    for month_delta in range(1, len(input_netCDF4.variables['time'])):
-        # adds a new month to the timestrings, passing in the previous month to add to
+    # the NoData mask of each grid cell is that of its SWE over all times
+    num_cells = len(surface_areas)
+    nodata = np.all(np.ma.getmaskarray(anomalies), axis=0) if len(anomalies) > 0 else np.zeros(num_cells, dtype=bool)
+    print(' - The number of NoData grid cells is: ' + str(int(np.sum(nodata))))
 
-        timestrings.append(add_month(timestrings[month_delta - 1]))
+    # sparse matrix with one row and one weight (the surface area over the area of the valid cells) per grid cell
+    rows, cols, weights, total_surface_area = shbaam_wght.average_weights(np.zeros(num_cells, dtype=np.int64),
+                                                                          np.arange(num_cells),
+                                                                          np.asarray(surface_areas, dtype=np.float64),
+                                                                          np.ones(num_cells), nodata, 1)
+    print(' - The area of the valid grid cells is: ' + str(total_surface_area[0]))
 
-    return [date.strftime('%m/%d/%Y') for date in timestrings]
+    # one matrix product gives the area weighted average of the anomalies for all times
+    return list(shbaam_wght.weight_average(anomalies, rows, cols, weights, total_surface_area)[:, 0])
 
 
 """
-Helper function for creating datestrings. Increments the month by one. This can't be done using timedelta
-because a month is not a uniform measure.
-
+Creates a series of datetime strings for each of the time dimensions in the input netCDF4 file. Will use later when creating the output CSV file
+The time values are decoded once using the units and calendar of the time variable, so that the dates are correct for any
+origin date and for a time window that does not start at the origin date
 params:
-    date {datetime} a datetime object to increment by a month
+    input_netCDF4 {GridDataset} the input netCDF4 file, see shbaam_dset.py
 
 return:
-    {datetime} an object which is a month ahead of the input datetime
+    timestrings {list} a list of datetime strings with each date representing a different month in the netCDF4 file
 """
 
 
-def add_month(date):
-    new_year = date.year
-    new_month = date.month + 1
-    if new_month > 12:
-        new_month = 1
-        new_year += 1
-    new_day = date.day
-    return datetime.datetime(new_year, new_month, new_day)
+def create_timestrings(input_netCDF4):
+    print('Determining datestrings...')
+    return input_netCDF4.time_strings('%m/%d/%Y')
 
 
 """
@@ -200,22 +169,35 @@ params:
     latitudes {list}  latitudes taken from the original input nc4 file
     swe_average {list} list containing SWE Averages calculated over the total surface area for a particular grid cell
     timeseries {list} a list containing the total swe for a particular time (month in this case)
+    file_format {str} format of the output file, 'NETCDF3_CLASSIC', or 'NETCDF4'/'NETCDF4_CLASSIC' which are compressed
+    chunking {str} chunk shape of the compressed swe variable, 'time' for time-major or 'cell' for cell-major
+    crop {bool} if True the output only covers the smallest lat/lon window containing the intersecting grid cells
+    anomalies {array} optional (time, cell) anomalies of the grid cells (see swe_anomalies), read if not given
 """
 
 
-def create_output_netCDF4(input_netCDF4, output_filepath, fillvalue, gld_lon, gld_lat, intersect_lon, intersect_lat, swe_averages, timeseries):
+def create_output_netCDF4(input_netCDF4, output_filepath, fillvalue, gld_lon, gld_lat, intersect_lon, intersect_lat, swe_averages, timeseries,
+                          file_format='NETCDF3_CLASSIC', chunking='time', crop=False, anomalies=None):
     print('creating output netCDF4 file...')
 
     # create the output nc4 file from the filepath supplied in the args
-    output_netCDF4 = netCDF4.Dataset(output_filepath, 'w', format='NETCDF3_CLASSIC')
+    output_netCDF4 = netCDF4.Dataset(output_filepath, 'w', format=file_format)
     # input_netCDF4 = netCDF4.Dataset(input_filepath, 'r')
-    
+
+    # the window of the grid that is written, either the whole grid or the window containing the intersecting cells,
+    # which continues from the start of the grid if the cells straddle its end
+    if crop and len(intersect_lat) > 0:
+        lat_beg, lat_end, lon_beg, lon_end = shbaam_ncdf.cell_window(intersect_lat, intersect_lon, len(gld_lon))
+    else:
+        lat_beg, lat_end, lon_beg, lon_end = 0, len(gld_lat), 0, len(gld_lon)
+    window_lon = shbaam_ncdf.window_lon(gld_lon, lon_beg, lon_end)
 
     # create dimensions
-    create_dimensions(output_netCDF4, gld_lon, gld_lat)
+    create_dimensions(output_netCDF4, window_lon, gld_lat[lat_beg:lat_end])
 
     # create the variables then return them to use later in creating variable attributes
-    variables = create_variables(output_netCDF4, fillvalue)
+    options = shbaam_ncdf.variable_options(file_format, chunking, len(timeseries), lat_end - lat_beg, lon_end - lon_beg)
+    variables = create_variables(output_netCDF4, fillvalue, options)
 
     # create global attributes for the nc4 file
     create_global_attributes(output_netCDF4)
@@ -230,14 +212,15 @@ def create_output_netCDF4(input_netCDF4, output_filepath, fillvalue, gld_lon, gl
     print('populating static data')
 
     lon = variables['lon']
-    lon[:] = input_netCDF4.variables['lon'][:]
+    lon[:] = window_lon
     # variables['lon'][:] = input_netCDF4.variables['lon'][:]
     lat = variables['lat']
-    lat[:] = input_netCDF4.variables['lat'][:]
+    lat[:] = input_netCDF4.variables['lat'][lat_beg:lat_end]
 
     # variables['lat'][:] = input_netCDF4.variables['lat'][:]
 
-    populate_dynamic_data(output_netCDF4, input_netCDF4, intersect_lon, intersect_lat, swe_averages, timeseries)
+    populate_dynamic_data(output_netCDF4, input_netCDF4, intersect_lon, intersect_lat, swe_averages, timeseries,
+                          lat_beg, lon_beg, anomalies)
 
     # close files
     output_netCDF4.close()
@@ -267,20 +250,21 @@ Creates the variables for the output nc4 file
 params:
     output_netCDF4 {netCDF4.Dataset} the dataset which was created
     fillvalue {str} the fillvalue to be used in the swe variable
+    options {dict} compression and chunking options of the swe variable, see shbaam_ncdf.variable_options
 
 returns:
     {dict} the new variables objects of the output dataset in {'name': variable} format
 """
 
 
-def create_variables(output_netCDF4, fillvalue):
+def create_variables(output_netCDF4, fillvalue, options={}):
     print('creating variables')
     time = output_netCDF4.createVariable('time', 'i4', ('time',))
     time_bands = output_netCDF4.createVariable(
         'time_bands', 'i4', ('time', 'nv'))
     lat = output_netCDF4.createVariable('lat', 'f4', ('lat',))
     lon = output_netCDF4.createVariable('lon', 'f4', ('lon',))
-    swe = output_netCDF4.createVariable('swe', 'f4', ('time', 'lat', 'lon'), fill_value=fillvalue)
+    swe = output_netCDF4.createVariable('swe', 'f4', ('time', 'lat', 'lon'), fill_value=fillvalue, **options)
 
     # not sure what crs is
     crs = output_netCDF4.createVariable('crs', 'i4')
@@ -356,23 +340,27 @@ def modify_crs_attribute(output_netCDF4, output_variables):
 
 
 """
-populates the output file with the relavent data
+populates the output file with the relavent data. The anomalies of all the grid cells are written at once with a bulk
+write of the smallest lat/lon window that contains all the grid cells. They are those already computed for the
+timeseries if given, so that the SWE is not read again. lat_beg and lon_beg are the indices of the first latitude and
+longitude of the output in the input grid, the longitudes of the output continuing from the start of the input grid
+if needed (see shbaam_ncdf.cell_window)
 """
 
 
-def populate_dynamic_data(output_netCDF4, input_netCDF4, longitudes, latitudes, swe_averages, timeseries):
+def populate_dynamic_data(output_netCDF4, input_netCDF4, longitudes, latitudes, swe_averages, timeseries, lat_beg=0, lon_beg=0,
+                          anomalies=None):
     print('populate dynamic data...')
 
-    for grid_cell in range(len(swe_averages)):
-        lon = longitudes[grid_cell]
-        lat = latitudes[grid_cell]
-        swe_average = swe_averages[grid_cell]
+    latitudes = np.asarray(latitudes, dtype=np.int64)
+    longitudes = np.asarray(longitudes, dtype=np.int64)
 
-        for time in range(len(timeseries)):
-            try:
-                output_netCDF4.variables['swe'][time, lat, lon] = input_netCDF4.variables['SWE'][time, lat, lon] - swe_average
-            except Exception as e:
-                print(e)
+    if anomalies is None:
+        anomalies = swe_anomalies(input_netCDF4, longitudes, latitudes, swe_averages)
+
+    # the indices are shifted when the output is cropped
+    shbaam_ncdf.write_block(output_netCDF4.variables['swe'], 0, anomalies, latitudes - lat_beg,
+                            (longitudes - lon_beg) % len(input_netCDF4.ZV_lon))
 
     # why do we do this?
     output_netCDF4.variables['time'][:] = input_netCDF4.variables['time'][:]
@@ -391,36 +379,40 @@ Perform calculations on the grid cells: find long-term means and surface areas f
 	- cdf_file: 		the cdf_file itself - used to access the SWE values
 	- lat_interval:		the size of the latitude interval from the netCDF file
 	- lon_interval:		the size of the longitude interval from the netCDF file
+	- baseline:		optional (lat, lon) grid of baseline means (see shbaam_base.py), used instead of
+				the mean of the whole record
+	- areas:		optional surface area of each grid cell that is within the polygons (see
+				shbaam_cell.find_cells), used instead of the full area of the grid cells
 
-Returns: Tuple containing 2 arrays: (time_averages, surface_areas)
+Returns: Tuple containing 3 arrays: (time_averages, surface_areas, swe), swe being the (time, cell) SWE of the grid
+cells read to compute the averages, or None if the averages are looked up in the baseline
 '''
 
 
-def grid_calculations(total_num_cells, grid_lats, grid_lons, actual_lats, times, cdf_file, lat_interval, lon_interval):
-	# construct empty arrays to fill with values
-	time_averages = [0] * total_num_cells
-	surface_areas = [0] * total_num_cells
-
-	# iterate through the lats and lons for each grid cell
-	for grid in range(total_num_cells):
-		# retrieve lat and lon
-		lat = grid_lats[grid]  # the index of latitude for the current cell
-		lon = grid_lons[grid]  # the index of longitude for the current cell
-
-		# get the surface area for this cell and add it to the surface_areas array
-		SA = 6371000 * math.radians(lat_interval) * 6371000 * math.radians(lon_interval) * math.cos(math.radians(actual_lats[lat]))  # make a global var for 6371000
-		surface_areas[grid] = SA
-
-		# iterate through the grid cell at each time in the netCDf file's time dimension
-		for time in range(times):
-			# create a running total of SWE values in the time_averages array
-		    time_averages[grid] += cdf_file.variables['SWE'][time, lat, lon]
-
-	# divide the values in the time_averages array by times to get the average
-	time_averages = [x/times for x in time_averages]
-
-	# return 2 arrays: surface areas and time_averages
-	return (time_averages, surface_areas)
+def grid_calculations(total_num_cells, grid_lats, grid_lons, actual_lats, times, cdf_file, lat_interval, lon_interval, baseline=None,
+                      areas=None):
+	if areas is not None:
+		# the areas of the overlaps with the polygons were already computed
+		surface_areas = list(areas)
+	else:
+		# look up the surface area of each cell from the areas of the grid cells at each latitude, shared with shbaam_twsa
+		latitude_areas = shbaam_grid.latitude_areas(actual_lats, lon_interval, lat_interval)
+		surface_areas = list(latitude_areas[np.asarray(grid_lats, dtype=np.int64)])
+
+	cell_lats = np.asarray(grid_lats[:total_num_cells], dtype=np.int64)
+	cell_lons = np.asarray(grid_lons[:total_num_cells], dtype=np.int64)
+	if baseline is not None:
+		# look the means up in the baseline grid, which is computed once for all basins
+		time_averages = list(baseline[cell_lats, cell_lons])
+		swe = None
+	else:
+		# read the SWE of all the grid cells for all times at once, instead of one value at a time,
+		# and average it over time (masked values are ignored), the SWE read is returned to compute the anomalies
+		time_averages, swe = shbaam_anom.cell_mean(cdf_file.variables['SWE'], cell_lats, cell_lons)
+		time_averages = list(time_averages)
+
+	# return 3 arrays: surface areas, time_averages and the SWE read
+	return (time_averages, surface_areas, swe)
 
 # =================================================/Michelle======================================================
 # ================================================================================================================
@@ -439,8 +431,24 @@ def grid_calculations(total_num_cells, grid_lats, grid_lons, actual_lats, times,
 def check_command_line_arg():
     # Checks the length of arguements and if input files exist
     IS_arg = len(sys.argv)
-    if IS_arg != 6:
-        print('ERROR - 5 and only 5 arguments can be used')
+    if IS_arg < 6 or IS_arg > 16:
+        print('ERROR - A minimum of 5 and a maximum of 15 arguments can be used')
+        raise SystemExit(22)
+
+    if IS_arg > 12 and sys.argv[12] not in ('center', 'fraction'):
+        print('ERROR - The cell mode must be center or fraction: ' + sys.argv[12])
+        raise SystemExit(22)
+
+    if IS_arg > 13 and sys.argv[13] not in ('NETCDF3_CLASSIC', 'NETCDF4', 'NETCDF4_CLASSIC'):
+        print('ERROR - The netCDF format must be NETCDF3_CLASSIC, NETCDF4 or NETCDF4_CLASSIC: ' + sys.argv[13])
+        raise SystemExit(22)
+
+    if IS_arg > 14 and sys.argv[14] not in ('time', 'cell'):
+        print('ERROR - The chunking must be time or cell: ' + sys.argv[14])
+        raise SystemExit(22)
+
+    if IS_arg > 15 and sys.argv[15] not in ('True', 'False'):
+        print('ERROR - The crop option must be True or False: ' + sys.argv[15])
         raise SystemExit(22)
 
     for shb_file in sys.argv[1:3]:
@@ -539,22 +547,48 @@ if __name__ == '__main__':
     output_pnt_shp = sys.argv[3]  # shb_pnt_shp; Point File
     output_swe_csv = sys.argv[4]  # shb_wsa_csv;
     output_swe_ncf = sys.argv[5]  # shb_wsa_ncf
+    output_prf_jsn = sys.argv[6] if len(sys.argv) > 6 else ''  # shb_prf_jsn; optional JSON report of the stages
+    output_prf_dmp = sys.argv[7] if len(sys.argv) > 7 else ''  # shb_prf_dmp; optional cProfile statistics
+    baseline_beg = float(sys.argv[8]) if len(sys.argv) > 8 else 0  # ZS_bas_beg; optional start of the baseline period
+    baseline_end = float(sys.argv[9]) if len(sys.argv) > 9 else 0  # ZS_bas_end; optional end of the baseline period
+    date_beg = sys.argv[10] if len(sys.argv) > 10 else ''  # shb_dat_beg; optional first date (YYYY-MM-DD) of the time window
+    date_end = sys.argv[11] if len(sys.argv) > 11 else ''  # shb_dat_end; optional last date (YYYY-MM-DD) of the time window
+    cell_mode = sys.argv[12] if len(sys.argv) > 12 else 'center'  # shb_cel_mod; optional 'center' or 'fraction'
+    file_format = sys.argv[13] if len(sys.argv) > 13 else 'NETCDF3_CLASSIC'  # shb_ncf_fmt; optional format of swe_ncf
+    chunking = sys.argv[14] if len(sys.argv) > 14 else 'time'  # shb_ncf_chk; optional chunks, 'time' or 'cell'
+    crop = len(sys.argv) > 15 and sys.argv[15] == 'True'  # shb_ncf_crp; optional, True to crop the map to the domain
+
+    # each stage is timed if a report or statistics file is given, see shbaam_prof.py
+    profiler = shbaam_prof.StageProfiler(output_prf_jsn, output_prf_dmp, 'shbaam_brian.py')
 
     print('Read GLD netCDF file')
-    f = netCDF4.Dataset(input_gld_nc4, 'r')
+    profiler.stage('read_gld')
+    # the GLD data can be a netCDF file or the .json index of several netCDF files, its coordinates are read
+    # once into numpy arrays and the calls made to the netCDF library are counted. The SWE is read from its
+    # cell-major cache instead if one was written by shbaam_cmaj.py and is still fresh
+    f = shbaam_dset.GridDataset(input_gld_nc4, 'SWE')
+    profiler.watch(f)
+    # only the time steps between the two dates are read, '' for no bound
+    if date_beg != '' or date_end != '':
+        try:
+            window_beg, window_end = f.time_window(date_beg, date_end)
+        except ValueError as e:
+            print('ERROR - ' + str(e))
+            raise SystemExit(22)
+        print(' - The time window is: ' + str(window_beg) + '-' + str(window_end))
 
     # Get Dimension Sizes
-    number_of_lon = len(f.dimensions['lon'])  # IS_grc_lon
+    number_of_lon = f.IS_lon  # IS_grc_lon
     print(' - The number of longitudes is: '+str(number_of_lon))
-    number_of_lat = len(f.dimensions['lat'])  # IS_grc_lat
+    number_of_lat = f.IS_lat  # IS_grc_lat
     print(' - The number of latitudes is: '+str(number_of_lat))
-    num_of_time_steps = len(f.dimensions['time'])  # IS_grc_time
+    num_of_time_steps = f.IS_time  # IS_grc_time
     print(' - The number of time steps is: '+str(num_of_time_steps))
 
     # Value of Dimension Arrays
-    gld_lon = f.variables['lon']  # ZV_grc_lon
-    gld_lat = f.variables['lat']  # ZV_grc_lat
-    gld_time = f.variables['time']  # ZV_grc_time
+    gld_lon = f.ZV_lon  # ZV_grc_lon
+    gld_lat = f.ZV_lat  # ZV_grc_lat
+    gld_time = f.ZV_time  # ZV_grc_time
 
     # Get Interval Sizes
     gld_lon_interval_size = abs(gld_lon[1] - gld_lon[0])
@@ -579,26 +613,62 @@ if __name__ == '__main__':
     print('[+] Variables are set up properly')  # Can Delete
 
 
+    profiler.stage('read_polygons')
     polyShapeFile = readPolygonShpFile(input_pol_shp)  # shb_pol_lay
-    createShapeFile(number_of_lat, number_of_lon, gld_lon, gld_lat, polyShapeFile, output_pnt_shp)
-
-    point_features=fiona.open(output_pnt_shp, 'r')  # shb_pnt_lay
-    index=createSpatialIndex(point_features)
-    intersect_tot, intersect_lon, intersect_lat = find_intersection(polyShapeFile, index, point_features)
-
-    time_averages, surface_areas = grid_calculations(intersect_tot, intersect_lat, intersect_lon, gld_lat, num_of_time_steps, f, gld_lat_interval_size, gld_lon_interval_size)
-
-    swe_time_series = water_storage_timeseries(intersect_lon, intersect_lat, time_averages, surface_areas, f)
-
-    print('SWE timeseries average: {}'.format(np.average(swe_time_series)))
-    print('SWE timeseries min: {}'.format(np.min(swe_time_series)))
-    print('SWE timeseries max: {}'.format(np.max(swe_time_series)))
-
+    if output_pnt_shp != '' or cell_mode == 'center':
+        profiler.stage('point_shapefile')
+        createShapeFile(number_of_lat, number_of_lon, gld_lon, gld_lat, polyShapeFile, output_pnt_shp)
+
+    profiler.stage('selection')
+    overlap_areas = None
+    if cell_mode == 'center':
+        point_features=fiona.open(output_pnt_shp, 'r')  # shb_pnt_lay
+        index=createSpatialIndex(point_features)
+        intersect_tot, intersect_lon, intersect_lat = find_intersection(polyShapeFile, index, point_features)
+    else:
+        # the grid cells that overlap with the polygons are weighted by the area of their overlap, as in
+        # shbaam_twsa.py, the NoData cells touched by the polygons being dropped from the average
+        intersect_lon, intersect_lat, _, overlap_areas = shbaam_cell.find_cells(gld_lon, gld_lat, polyShapeFile, '',
+                                                                                'fraction')
+        intersect_tot = len(intersect_lon)
+        print(' - The number of grid cells found is: '+str(intersect_tot))
+
+    profiler.stage('mean')
+    # the baseline means of all grid cells over the period, in decimal years, are computed once and saved
+    # next to the GLD file, the following runs look them up
+    baseline = None
+    if baseline_beg != 0 or baseline_end != 0:
+        baseline = shbaam_base.baseline(f, baseline_beg, baseline_end)
+    time_averages, surface_areas, swe = grid_calculations(intersect_tot, intersect_lat, intersect_lon, gld_lat, num_of_time_steps, f, gld_lat_interval_size, gld_lon_interval_size, baseline,
+                                                     overlap_areas)
+
+    profiler.stage('anomaly')
+    # the anomalies are computed once from the SWE read for the averages, and used for both the CSV and the map
+    anomalies = swe_anomalies(f, intersect_lon, intersect_lat, time_averages, swe)
+    swe_time_series = water_storage_timeseries(intersect_lon, intersect_lat, time_averages, surface_areas, f, anomalies)
+
+    print('SWE timeseries average: {}'.format(np.nanmean(swe_time_series)))
+    print('SWE timeseries min: {}'.format(np.nanmin(swe_time_series)))
+    print('SWE timeseries max: {}'.format(np.nanmax(swe_time_series)))
+
+    profiler.stage('time_strings')
     timestrings = create_timestrings(f)
 
+    profiler.stage('write_csv')
     create_csv(timestrings, swe_time_series, output_swe_csv)
+    profiler.output(output_swe_csv)
     fillvalue = get_fillvalue(f)
 
-    create_output_netCDF4(f, output_swe_ncf, fillvalue, gld_lon, gld_lat, intersect_lon, intersect_lat, time_averages, swe_time_series)
+    profiler.stage('write_netcdf')
+    create_output_netCDF4(f, output_swe_ncf, fillvalue, gld_lon, gld_lat, intersect_lon, intersect_lat, time_averages, swe_time_series,
+                          file_format, chunking, crop, anomalies)
+    profiler.output(output_swe_ncf)
+    profiler.stop()
+    print(' - The number of netCDF reads is: {}'.format(f.IS_rd_cnt))
+    print(' - The number of bytes read is: {}'.format(f.IS_rd_byt))
+
+    if profiler.enabled:
+        print('Write profile')
+        profiler.write()
 
     print('[+] Script Completed')
@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+#*******************************************************************************
+#shbaam_cell.py
+#*******************************************************************************
+
+#Purpose:
+#Find the grid cells of a regular longitude/latitude grid whose centers are
+#located within the features of a polygon shapefile. The membership of cell
+#centers is computed directly from the coordinate vectors of the grid, only
+#for the cells that lie within the bounding box of each polygon feature, and
+#using a vectorized point-in-polygon test. The point shapefile with all grid
+#cells that was historically used along with a spatial index is only created
+#when explicitly requested.
+#Alternatively, the fraction of the area of each grid cell that overlaps with
+#each polygon feature can be computed, so that cells only partially covered by
+#a polygon are accounted for in proportion of their overlap.
+#The cells found and their surface areas can be stored in an on-disk cache, in
+#which each file is named after a hash of the polygon geometries and of the
+#coordinate vectors of the grid. Any change in either of them leads to a new
+#hash, hence the cache is automatically invalidated.
+
+
+#*******************************************************************************
+#Import Python modules
+#*******************************************************************************
+import os.path
+import hashlib
+import numpy
+import fiona
+import shbaam_grid
+import shbaam_npzf
+import shapely.geometry
+try:
+     from shapely import contains_xy as shapely_contains_xy
+     from shapely import box as shapely_box
+     from shapely import intersection as shapely_intersection
+     from shapely import area as shapely_area
+     #Shapely 2.x
+except ImportError:
+     from shapely.vectorized import contains as shapely_contains_xy
+     shapely_box=None
+     #Shapely 1.x
+
+
+#*******************************************************************************
+#Shift longitudes
+#*******************************************************************************
+def shift_lon(ZV_grc_lon):
+     """Shift longitude values from the [0;360] range to [-180;180]."""
+     ZV_grc_lon=numpy.array(ZV_grc_lon[:],dtype=numpy.float64)
+     ZV_grc_lon[ZV_grc_lon>180]=ZV_grc_lon[ZV_grc_lon>180]-360
+     return ZV_grc_lon
+
+
+#*******************************************************************************
+#Vectorized point-in-polygon test
+#*******************************************************************************
+def contains_xy(shb_pol_shy,ZV_x,ZV_y):
+     """Return a boolean array that is True where (x,y) is within a polygon.
+
+     The semantics are those of shapely's 'contains' predicate, i.e. points
+     located exactly on the boundary of the polygon are not selected.
+     """
+     return shapely_contains_xy(shb_pol_shy,ZV_x,ZV_y)
+
+
+#*******************************************************************************
+#Find the grid cells located within one polygon
+#*******************************************************************************
+def select_cells_geom(ZV_lon_shf,ZV_grc_lat,shb_pol_shy):
+     """Return the (lon,lat) indices of the cell centers within one geometry.
+
+     ZV_lon_shf is the longitude vector already shifted to [-180;180] and
+     ZV_grc_lat is the latitude vector. Only the cells within the bounding box
+     of the geometry are tested. The indices are sorted with longitude as the
+     outer loop and latitude as the inner loop.
+     """
+     ZV_grc_lat=numpy.asarray(ZV_grc_lat[:],dtype=numpy.float64)
+     ZS_min_lon,ZS_min_lat,ZS_max_lon,ZS_max_lat=shb_pol_shy.bounds
+
+     IV_box_lon=numpy.nonzero((ZV_lon_shf>=ZS_min_lon)                         \
+                             &(ZV_lon_shf<=ZS_max_lon))[0]
+     IV_box_lat=numpy.nonzero((ZV_grc_lat>=ZS_min_lat)                         \
+                             &(ZV_grc_lat<=ZS_max_lat))[0]
+     #Clip the grid to the bounding box of the geometry
+
+     IM_box_lon,IM_box_lat=numpy.meshgrid(IV_box_lon,IV_box_lat,indexing='ij')
+     IV_box_lon=IM_box_lon.ravel()
+     IV_box_lat=IM_box_lat.ravel()
+
+     ZV_box_msk=contains_xy(shb_pol_shy,ZV_lon_shf[IV_box_lon],               \
+                                       ZV_grc_lat[IV_box_lat])
+
+     return IV_box_lon[ZV_box_msk],IV_box_lat[ZV_box_msk]
+
+
+#*******************************************************************************
+#Find the fraction of grid cells that overlaps with one polygon
+#*******************************************************************************
+def overlap_cells_geom(ZV_lon_shf,ZV_grc_lat,ZS_lon_stp,ZS_lat_stp,shb_pol_shy):
+     """Return the (lon,lat) indices and overlap fraction of cells in a geometry.
+
+     Each grid cell is a box of size ZS_lon_stp by ZS_lat_stp centered on its
+     coordinates, and the fraction is the area of its intersection with the
+     geometry divided by its area. Only the cells that intersect with the
+     bounding box of the geometry are tested, and only the cells with a
+     non-zero overlap are returned.
+     """
+     ZV_grc_lat=numpy.asarray(ZV_grc_lat[:],dtype=numpy.float64)
+     ZS_min_lon,ZS_min_lat,ZS_max_lon,ZS_max_lat=shb_pol_shy.bounds
+
+     IV_box_lon=numpy.nonzero((ZV_lon_shf+ZS_lon_stp/2>ZS_min_lon)             \
+                             &(ZV_lon_shf-ZS_lon_stp/2<ZS_max_lon))[0]
+     IV_box_lat=numpy.nonzero((ZV_grc_lat+ZS_lat_stp/2>ZS_min_lat)             \
+                             &(ZV_grc_lat-ZS_lat_stp/2<ZS_max_lat))[0]
+     #Clip the grid to the cells that intersect the bounding box of the geometry
+
+     IM_box_lon,IM_box_lat=numpy.meshgrid(IV_box_lon,IV_box_lat,indexing='ij')
+     IV_box_lon=IM_box_lon.ravel()
+     IV_box_lat=IM_box_lat.ravel()
+
+     ZV_box_lon=ZV_lon_shf[IV_box_lon]
+     ZV_box_lat=ZV_grc_lat[IV_box_lat]
+     if shapely_box is not None:
+          shb_box_shy=shapely_box(ZV_box_lon-ZS_lon_stp/2,                     \
+                                  ZV_box_lat-ZS_lat_stp/2,                     \
+                                  ZV_box_lon+ZS_lon_stp/2,                     \
+                                  ZV_box_lat+ZS_lat_stp/2)
+          ZV_box_frc=shapely_area(shapely_intersection(shb_box_shy,            \
+                                                       shb_pol_shy))
+     else:
+          ZV_box_frc=numpy.zeros(len(IV_box_lon))
+          for JS_box in range(len(IV_box_lon)):
+               shb_box_shy=shapely.geometry.box(                               \
+                                         ZV_box_lon[JS_box]-ZS_lon_stp/2,      \
+                                         ZV_box_lat[JS_box]-ZS_lat_stp/2,      \
+                                         ZV_box_lon[JS_box]+ZS_lon_stp/2,      \
+                                         ZV_box_lat[JS_box]+ZS_lat_stp/2)
+               ZV_box_frc[JS_box]=shb_box_shy.intersection(shb_pol_shy).area
+     ZV_box_frc=ZV_box_frc/(ZS_lon_stp*ZS_lat_stp)
+
+     ZV_box_msk=(ZV_box_frc>0)
+     return IV_box_lon[ZV_box_msk],IV_box_lat[ZV_box_msk],                    \
+            numpy.minimum(ZV_box_frc[ZV_box_msk],1)
+
+
+#*******************************************************************************
+#Find the grid cells located within all polygons of a shapefile
+#*******************************************************************************
+def select_cells(ZV_grc_lon,ZV_grc_lat,shb_pol_lay,YS_cel_mod='center'):
+     """Return the (lon,lat,feature) indices and fractions of the cells found.
+
+     With YS_cel_mod='center', the cells whose centers are within each feature
+     are selected and their fractions are all 1. With YS_cel_mod='fraction',
+     all cells that overlap with each feature are selected along with the
+     fraction of their area that overlaps.
+     The cells found for each feature of shb_pol_lay are appended one feature
+     after the other along with the index of the feature, so that a cell
+     located within several features is counted several times, as in the
+     original rtree-based algorithm.
+     """
+     if YS_cel_mod!='center' and YS_cel_mod!='fraction':
+          raise ValueError('Invalid cell selection method: '+YS_cel_mod)
+
+     ZV_lon_shf=shift_lon(ZV_grc_lon)
+     ZV_grc_lat=numpy.asarray(ZV_grc_lat[:],dtype=numpy.float64)
+     ZS_lon_stp=abs(float(ZV_grc_lon[1])-float(ZV_grc_lon[0]))
+     ZS_lat_stp=abs(float(ZV_grc_lat[1])-float(ZV_grc_lat[0]))
+
+     IV_dom_lon=[numpy.zeros(0,dtype=numpy.int64)]
+     IV_dom_lat=[numpy.zeros(0,dtype=numpy.int64)]
+     IV_dom_fea=[numpy.zeros(0,dtype=numpy.int64)]
+     ZV_dom_frc=[numpy.zeros(0,dtype=numpy.float64)]
+     for JS_pol_fea,shb_pol_fea in enumerate(shb_pol_lay):
+          shb_pol_shy=shapely.geometry.shape(shb_pol_fea['geometry'])
+          if YS_cel_mod=='center':
+               IV_fea_lon,IV_fea_lat=select_cells_geom(ZV_lon_shf,ZV_grc_lat, \
+                                                       shb_pol_shy)
+               ZV_fea_frc=numpy.ones(len(IV_fea_lon),dtype=numpy.float64)
+          else:
+               IV_fea_lon,IV_fea_lat,ZV_fea_frc=overlap_cells_geom(           \
+                                                 ZV_lon_shf,ZV_grc_lat,       \
+                                                 ZS_lon_stp,ZS_lat_stp,       \
+                                                 shb_pol_shy)
+          IV_dom_lon.append(IV_fea_lon)
+          IV_dom_lat.append(IV_fea_lat)
+          IV_dom_fea.append(numpy.full(len(IV_fea_lon),JS_pol_fea,            \
+                                       dtype=numpy.int64))
+          ZV_dom_frc.append(ZV_fea_frc)
+
+     return numpy.concatenate(IV_dom_lon),numpy.concatenate(IV_dom_lat),      \
+            numpy.concatenate(IV_dom_fea),numpy.concatenate(ZV_dom_frc)
+
+
+#*******************************************************************************
+#Cache of grid cells
+#*******************************************************************************
+def cell_key(ZV_grc_lon,ZV_grc_lat,shb_pol_lay,YS_cel_mod='center'):
+     """Return a hash of the polygon geometries, grid and selection method."""
+     shb_cel_hsh=hashlib.sha1()
+     shb_cel_hsh.update(YS_cel_mod.encode('ascii'))
+     shb_cel_hsh.update(numpy.array(ZV_grc_lon[:],dtype=numpy.float64).tobytes())
+     shb_cel_hsh.update(numpy.array(ZV_grc_lat[:],dtype=numpy.float64).tobytes())
+     for shb_pol_fea in shb_pol_lay:
+          shb_pol_shy=shapely.geometry.shape(shb_pol_fea['geometry'])
+          shb_cel_hsh.update(shb_pol_shy.wkb)
+     return shb_cel_hsh.hexdigest()
+
+
+#*******************************************************************************
+#Find the grid cells located within all polygons of a shapefile, with cache
+#*******************************************************************************
+def find_cells(ZV_grc_lon,ZV_grc_lat,shb_pol_lay,shb_cel_dir='',            \
+               YS_cel_mod='center',YS_are_mod='sphere'):
+     """Return the (lon,lat,feature) indices and areas of the selected cells.
+
+     The area returned for each cell is the area of the cell that is within
+     the feature, i.e. the full area of the cell with YS_cel_mod='center' and
+     the overlapping area with YS_cel_mod='fraction'. The areas of the cells
+     are those of the Earth model YS_are_mod, see shbaam_grid.py. These areas
+     are the weights of a sparse (feature,cell) matrix, see shbaam_wght.py.
+     If shb_cel_dir is not empty, the results are looked up in, or added to,
+     the cache located in that directory.
+     """
+     YV_cel_var=['IV_dom_lon','IV_dom_lat','IV_dom_fea','ZV_dom_sqm']
+
+     if shb_cel_dir!='':
+          YS_cel_key=cell_key(ZV_grc_lon,ZV_grc_lat,shb_pol_lay,               \
+                              YS_cel_mod if YS_are_mod=='sphere'               \
+                                         else YS_cel_mod+'/'+YS_are_mod)
+          #Cache files of the spherical model keep their existing names
+          shb_cel_npz=os.path.join(shb_cel_dir,YS_cel_key+'.npz')
+          shb_cel_dat=shbaam_npzf.read_npz(shb_cel_npz)
+          if shb_cel_dat is not None                                          \
+             and all(YS_var in shb_cel_dat for YS_var in YV_cel_var):
+               print(' - The grid cells were read from cache: '+shb_cel_npz)
+               return tuple(shb_cel_dat[YS_var] for YS_var in YV_cel_var)
+
+     IV_dom_lon,IV_dom_lat,IV_dom_fea,ZV_dom_frc=select_cells(ZV_grc_lon,     \
+                                                              ZV_grc_lat,     \
+                                                              shb_pol_lay,    \
+                                                              YS_cel_mod)
+     ZV_dom_sqm=shbaam_grid.cell_areas(ZV_grc_lon,ZV_grc_lat,IV_dom_lat,      \
+                                       YS_are_mod)*ZV_dom_frc
+
+     if shb_cel_dir!='':
+          if not os.path.isdir(shb_cel_dir):
+               os.makedirs(shb_cel_dir)
+          shbaam_npzf.write_npz(shb_cel_npz,IV_dom_lon=IV_dom_lon,            \
+                                            IV_dom_lat=IV_dom_lat,            \
+                                            IV_dom_fea=IV_dom_fea,            \
+                                            ZV_dom_sqm=ZV_dom_sqm)
+          print(' - The grid cells were added to cache: '+shb_cel_npz)
+
+     return IV_dom_lon,IV_dom_lat,IV_dom_fea,ZV_dom_sqm
+
+
+#*******************************************************************************
+#Create a point shapefile with all the grid cells
+#*******************************************************************************
+def write_point_shapefile(shb_pnt_shp,ZV_grc_lon,ZV_grc_lat,shb_pol_lay):
+     """Create a point shapefile with all the grid cells.
+
+     The driver and coordinate reference system are copied from the polygon
+     shapefile shb_pol_lay.
+     """
+     shb_pnt_drv=shb_pol_lay.driver
+     shb_pnt_crs=shb_pol_lay.crs.copy()
+
+     shb_pnt_sch={'geometry': 'Point',                                         \
+                  'properties': {'JS_grc_lon': 'int:4',                        \
+                                 'JS_grc_lat': 'int:4'}}
+
+     ZV_grc_lon=ZV_grc_lon[:]
+     ZV_grc_lat=ZV_grc_lat[:]
+
+     with fiona.open(shb_pnt_shp,'w',driver=shb_pnt_drv,                       \
+                                     crs=shb_pnt_crs,                          \
+                                     schema=shb_pnt_sch) as shb_pnt_lay:
+          for JS_grc_lon in range(len(ZV_grc_lon)):
+               ZS_grc_lon=ZV_grc_lon[JS_grc_lon]
+               if (ZS_grc_lon > 180):
+                    ZS_grc_lon=ZS_grc_lon-360
+                    #Shift longitude range from [0;360] to [-180;180]
+               for JS_grc_lat in range(len(ZV_grc_lat)):
+                    ZS_grc_lat=ZV_grc_lat[JS_grc_lat]
+                    shb_pnt_prp={'JS_grc_lon': JS_grc_lon,                     \
+                                 'JS_grc_lat': JS_grc_lat}
+                    shb_pnt_geo=shapely.geometry.mapping(                      \
+                                shapely.geometry.Point((ZS_grc_lon,ZS_grc_lat)))
+                    shb_pnt_lay.write({                                        \
+                                       'properties': shb_pnt_prp,              \
+                                       'geometry': shb_pnt_geo,                \
+                                       })
+
+
+#*******************************************************************************
+#End
+#*******************************************************************************
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+#*******************************************************************************
+#shbaam_cmaj.py
+#*******************************************************************************
+
+#Purpose:
+#Convert a (time,lat,lon) variable of a netCDF file (e.g. lwe_thickness of
+#GRACE or SWE of LDAS) to a cell-major cache: a (lat,lon,time) .npy file in
+#which the whole time series of each grid cell is contiguous. The cache is
+#written once, next to the source file, and is named after the source file and
+#a hash of the source file (path, size and modification time, as well as those
+#of the member files of a shbaam_vrtl.py index) and variable, so that a cache
+#is only found as long as it is fresh. The cache is then used
+#transparently by shbaam_dset.GridDataset, and thus by shbaam_twsa.py and
+#shbaam_brian.py, instead of the time-major source: the time series of the
+#grid cells of a basin are read from a few contiguous ranges of the cache
+#rather than from every time record of the source. Masked values are stored as
+#NaN.
+
+
+#*******************************************************************************
+#Import Python modules
+#*******************************************************************************
+import sys
+import os.path
+import hashlib
+import tempfile
+import numpy
+import shbaam_anom
+import shbaam_vrtl
+
+
+#*******************************************************************************
+#Declaration of variables (given as command line arguments)
+#*******************************************************************************
+# 1 - shb_ncf_fil
+# 2 - YS_var (e.g. 'lwe_thickness' or 'SWE')
+#(3)- IS_tim_chk (optional, number of time steps read at once, default: 12)
+
+
+#*******************************************************************************
+#Name of a cache file
+#*******************************************************************************
+def cache_file(shb_ncf_fil,YS_var):
+     """Return the path of the cell-major cache of a variable.
+
+     The file is located next to the source file. The member files of a
+     .json index are part of its hash, so that a change in any of them
+     leads to another cache.
+     """
+     shb_cch_hsh=hashlib.sha1()
+     shbaam_vrtl.update_hash(shb_cch_hsh,shb_ncf_fil)
+     shb_cch_hsh.update((YS_var+'\n').encode('utf-8'))
+     return os.path.join(os.path.dirname(os.path.abspath(shb_ncf_fil)),        \
+                         os.path.basename(shb_ncf_fil)+'.'+YS_var+'.cells.'    \
+                         +shb_cch_hsh.hexdigest()[:16]+'.npy')
+
+
+#*******************************************************************************
+#Write a cache file
+#*******************************************************************************
+def write_cache(shb_ncf_fil,YS_var,IS_chk=12):
+     """Write the cell-major cache of a variable and return its path.
+
+     The source is read by chunks of IS_chk time steps, and the cache is
+     written through a temporary file and a rename.
+     """
+     shb_cch_npy=cache_file(shb_ncf_fil,YS_var)
+     f=shbaam_vrtl.open_dataset(shb_ncf_fil)
+     try:
+          if YS_var not in f.variables:
+               raise ValueError('No variable '+YS_var+' in: '+shb_ncf_fil)
+          var=f.variables[YS_var]
+          if len(var.dimensions)!=3 or var.dimensions[0]!='time':
+               raise ValueError('The variable '+YS_var+' is not (time,lat,lon)')
+          IS_time,IS_lat,IS_lon=var.shape
+          YS_dty=numpy.result_type(var.dtype,numpy.float32)
+          #Floating point type, so that masked values can be stored as NaN
+
+          shb_cch_dir=os.path.dirname(shb_cch_npy)
+          shb_tmp_fid,shb_tmp_npy=tempfile.mkstemp(suffix='.npy',             \
+                                                   dir=shb_cch_dir)
+          os.close(shb_tmp_fid)
+          try:
+               ZM_cch=numpy.lib.format.open_memmap(                            \
+                                  shb_tmp_npy,mode='w+',dtype=YS_dty,          \
+                                  shape=(IS_lat,IS_lon,IS_time))
+               for JS_beg,JS_end in shbaam_anom.time_chunks(IS_time,IS_chk):
+                    ZM_var=numpy.ma.asarray(var[JS_beg:JS_end,:,:])
+                    ZM_cch[:,:,JS_beg:JS_end]=numpy.rollaxis(                  \
+                               numpy.ma.filled(ZM_var.astype(YS_dty),          \
+                                               numpy.nan),0,3)
+               ZM_cch.flush()
+               del ZM_cch
+               os.rename(shb_tmp_npy,shb_cch_npy)
+               #The rename is atomic, concurrent runs never see a partial file
+          except BaseException:
+               os.remove(shb_tmp_npy)
+               raise
+     finally:
+          f.close()
+     return shb_cch_npy
+
+
+#*******************************************************************************
+#Variable read from a cache file
+#*******************************************************************************
+class CellMajorVariable(object):
+     """A (time,lat,lon) variable whose values are read from its cell-major
+     cache, the other attributes being those of the source variable var.
+     """
+
+     def __init__(self,shb_cch_npy,var):
+          self._cch=numpy.load(shb_cch_npy,mmap_mode='r')
+          self._var=var
+          if self._cch.shape!=tuple(var.shape[1:])+(var.shape[0],):
+               raise ValueError('The cache does not match its source: '        \
+                                +shb_cch_npy)
+
+     @property
+     def shape(self):
+          return (self._cch.shape[2],)+self._cch.shape[:2]
+
+     def __getitem__(self,key):
+          if not isinstance(key,tuple):
+               key=(key,)
+          for JS_key in range(len(key)):
+               if key[JS_key] is Ellipsis:
+                    key=key[:JS_key]+(slice(None),)*(4-len(key))              \
+                       +key[JS_key+1:]
+                    break
+          key=key+(slice(None),)*(3-len(key))
+          ZM_var=self._cch[key[1],key[2],key[0]]
+          if not isinstance(key[0],(int,numpy.integer)):
+               ZM_var=numpy.rollaxis(ZM_var,ZM_var.ndim-1)
+          #The time is the last dimension of the values read, if it was kept
+          return numpy.ma.masked_invalid(ZM_var)
+
+     def __getattr__(self,name):
+          return getattr(self._var,name)
+
+     def __len__(self):
+          return self._cch.shape[2]
+
+
+#*******************************************************************************
+#Main
+#*******************************************************************************
+def main():
+     IS_arg=len(sys.argv)
+     if IS_arg < 3 or IS_arg > 4:
+          print('ERROR - A minimum of 2 and a maximum of 3 arguments can be '  \
+                +'used')
+          raise SystemExit(22)
+
+     shb_ncf_fil=sys.argv[1]
+     YS_var=sys.argv[2]
+     IS_tim_chk=int(sys.argv[3]) if IS_arg > 3 else 12
+
+     print('Command line inputs')
+     print(' - '+shb_ncf_fil)
+     print(' - '+YS_var)
+     print(' - '+str(IS_tim_chk))
+
+     if not os.path.isfile(shb_ncf_fil):
+          print('ERROR - Unable to open '+shb_ncf_fil)
+          raise SystemExit(22)
+
+     print('Write cell-major cache')
+     shb_cch_npy=cache_file(shb_ncf_fil,YS_var)
+     if os.path.isfile(shb_cch_npy):
+          print(' - The cache is already up to date: '+shb_cch_npy)
+          return
+     try:
+          shb_cch_npy=write_cache(shb_ncf_fil,YS_var,IS_tim_chk)
+     except ValueError as e:
+          print('ERROR - '+str(e))
+          raise SystemExit(22)
+     print(' - The cache was written in: '+shb_cch_npy)
+     print('Success!!!')
+
+
+if __name__ == '__main__':
+     main()
+
+
+#*******************************************************************************
+#End
+#*******************************************************************************
@@ -1,106 +1,177 @@
 #!/usr/bin/env python
 # *******************************************************************************
-# shbaam_twsa.py
+# shbaam_conc.py
 # *******************************************************************************
 
 # Purpose:
 # Concatinates multiple netCDF4 files together along the time axis.
 # Given multiple nc files, each of which contain consistant data in the following format:
+#   - the same dimensions, with the same sizes except for 'time'
+#   - the same variables and dimensions, 'time' being a dimension of the time-dependent ones
 #
-# TODO: List formatting constraints
+# The input files are sorted by name, their headers are read first so that the time
+# variable of the output can be filled (and the time dimension allocated) at once, and
+# the values of every time-dependent variable are then streamed to the output in bulk
+# slabs of several time steps, in one sequential pass. The contents of the next input
+# files are read from disk by a read-ahead thread while the current one is processed.
 
 # *******************************************************************************
 # Import Python modules
 # *******************************************************************************
 import netCDF4
-import os
-import glob
 import sys
 import numpy
-import datetime
+import multiprocessing.pool
 
 """
 Validates argumnets supplied
 """
 def validate_args(args):
     print('Validating Args...')
-    for file in glob.glob(args[0]):
+    if len(args) < 2:
+        raise SystemExit('At least one input file and one output file are needed')
+    for file in args[:-1]:
         try:
             f = open(file, 'r')
-        except:
             f.close()
-            raise Exception('Error opening file')
+        except IOError:
+            raise SystemExit('Error opening file ' + file)
 
 """
-We should validate the netCDF4 files to be sure they are all the same dimension sizes before attempting to merge them
-Check: 
-    Size of dimensions
-    Names of each variable
+Reads the headers of all input files and validates them against the first one
+Check:
+    Size of dimensions other than time
+    Names of each variable and their dimensions
 
+Returns:
+    times {list} the time values of each input file, in the units of the first file
 """
-def validate_netCDF4():
+def validate_netCDF4(input_filepaths):
     print('Validating .nc4 input variables and dimensions...')
-    # should probably check if all files have the same varibles / dimensions
-    pass
+    times = []
+    with netCDF4.Dataset(input_filepaths[0], 'r') as first:
+        dimensions = dict((name, len(dimension)) for name, dimension in first.dimensions.items() if name != 'time')
+        variables = dict((name, variable.dimensions) for name, variable in first.variables.items())
+        units = first['time'].units
+        calendar = getattr(first['time'], 'calendar', 'standard')
+
+    for file in input_filepaths:
+        with netCDF4.Dataset(file, 'r') as src:
+            for name, size in dimensions.items():
+                if name not in src.dimensions or len(src.dimensions[name]) != size:
+                    raise SystemExit('Inconsistent dimension ' + name + ' in ' + file)
+            for name, variable_dimensions in variables.items():
+                if name not in src.variables or src[name].dimensions != variable_dimensions:
+                    raise SystemExit('Inconsistent variable ' + name + ' in ' + file)
+            times.append(time_values(src['time'], units, calendar))
+
+    return times
+
+"""
+Converts the values of a time variable to the given units and calendar
+"""
+def time_values(time, units, calendar):
+    values = time[:]
+    if time.units == units and getattr(time, 'calendar', 'standard') == calendar:
+        return numpy.ma.filled(values, 0)
+    dates = netCDF4.num2date(values, time.units, getattr(time, 'calendar', 'standard'))
+    return numpy.asarray(netCDF4.date2num(dates, units, calendar))
 
 """
-Creates an exact copy of the input file and returns a netCDF4.Dataset of the newly created file
+Creates the output file with the dimensions, variables and attributes of the input file,
+copies the time-independent variables and writes the time variable of all files at once.
+Returns a netCDF4.Dataset of the newly created file
 """
-def copy(input_filepath, output_filepath):
+def create_output(input_filepath, output_filepath, times):
     print('Creating output file')
     dst = netCDF4.Dataset(output_filepath, 'w')
     with netCDF4.Dataset(input_filepath, 'r') as src:
+        dst.setncatts(src.__dict__)
 
-        # copy dimensions
+        # copy dimensions, time being unlimited
         print('Copying dimensions...')
         for name, dimension in src.dimensions.items():
-            dst.createDimension(name, len(dimension) if not dimension.isunlimited() else None)
+            dst.createDimension(name, None if name == 'time' or dimension.isunlimited() else len(dimension))
             print('\tName: {}\n\tLength: {}'.format(name, len(dimension)))
 
-        # copy variables
-        print('Initializing with data from first file')
+        # copy variables, the fill value must be given at creation
+        print('Copying variables...')
         for name, variable in src.variables.items():
-            x = dst.createVariable(name, variable.datatype, variable.dimensions)
-            # copy variable attributes all at once via dictionary
-            dst[name].setncatts(src[name].__dict__)
-            dst[name][:] = src[name][:]
-            
+            attributes = variable.__dict__
+            options = {}
+            if '_FillValue' in attributes:
+                options['fill_value'] = attributes['_FillValue']
+            filters = variable.filters() or {}
+            if filters.get('zlib'):
+                options['zlib'] = True
+                options['complevel'] = filters.get('complevel', 4)
+                options['shuffle'] = filters.get('shuffle', False)
+            dst.createVariable(name, variable.datatype, variable.dimensions, **options)
+            dst[name].setncatts(dict((k, v) for k, v in attributes.items() if k != '_FillValue'))
+            if 'time' not in variable.dimensions:
+                dst[name][:] = src[name][:]
+
+    # writing all time values extends the time dimension to its final size
+    dst['time'][:] = numpy.concatenate(times)
 
     print('Creation of Dimensions and Variables successful')
     return dst
 
+"""
+Reads the contents of the input files in a background thread, at most depth files ahead.
+Only the raw bytes are read in the thread, the netCDF library being called from the main
+thread only.
 
+Yields:
+    (filepath, contents) for each input file, in order
 """
-Takes in the variables from the input file and appends it to the output file in the "time" dimension
+def read_ahead(input_filepaths, depth=2):
+    def read(filepath):
+        with open(filepath, 'rb') as f:
+            return f.read()
+
+    pool = multiprocessing.pool.ThreadPool(1)
+    try:
+        results = [pool.apply_async(read, (file,)) for file in input_filepaths[:depth]]
+        for index, file in enumerate(input_filepaths):
+            contents = results[index].get()
+            results[index] = None
+            if index + depth < len(input_filepaths):
+                results.append(pool.apply_async(read, (input_filepaths[index + depth],)))
+            yield file, contents
+    finally:
+        pool.terminate()
+        pool.join()
+
 """
-def concatenate_file(input_file, output_file, time_slice):
-    # get data in Canint Variable
-    # Append data to Canint Variable in time dimension
-    output_file['Canint'][time_slice + 1,:,:] = input_file['Canint'][0,:,:]
-    output_file['SWE'][time_slice + 1,:,:] = input_file['SWE'][0,:,:]
-    output_file.variables['time'][time_slice + 1] = time_slice + 1
-    
-
-def alter_time_dimension(output_file, input_filepaths):
-    print('obtaining time series information from filenames...')
-    datestrings = []
-    for file in input_filepaths:
-        file_name = file.split('/')[-1]
-        file_date = file_name.split('.')[1]
-        file_date = file_date[1:]
-        year = file_date[0:4]
-        month = file_date[4:]
-
-        dt = datetime.datetime(int(year), int(month), 1)
-        datestrings.append(str(dt))
-    
-    
-    # print('Assigning datetimes to time variable')
-    nc_time = output_file.variables['time']
-    # nc_time = numpy.ma.masked_array(datestrings, mask=False)
-    nc_time.units = 'Months beginning at ' + str(datestrings[0])
-    
-    
+Streams the time-dependent variables of all input files to the output file. The values of
+several files are gathered in memory and written with one call per variable, in the order
+of the time dimension, whichever the position of the time dimension in the variable.
+"""
+def concatenate_files(input_filepaths, output_netCDF4, times, slab_size=64):
+    axes = dict((name, variable.dimensions.index('time'))
+                for name, variable in output_netCDF4.variables.items()
+                if name != 'time' and 'time' in variable.dimensions)
+    names = sorted(axes)
+    buffers = dict((name, []) for name in names)
+    slab_start = 0
+    buffered = 0
+
+    for index, (file, contents) in enumerate(read_ahead(input_filepaths)):
+        with netCDF4.Dataset(file, 'r', memory=contents) as input_netCDF4:
+            for name in names:
+                buffers[name].append(input_netCDF4[name][:])
+        buffered += len(times[index])
+        print('\tFinished ' + str(file))
+
+        if buffered >= slab_size or index == len(input_filepaths) - 1:
+            for name in names:
+                slab = (slice(None),) * axes[name] + (slice(slab_start, slab_start + buffered),)
+                output_netCDF4[name][slab] = numpy.ma.concatenate(buffers[name], axis=axes[name])
+                buffers[name] = []
+            slab_start += buffered
+            buffered = 0
+
 
 def main():
     print('Beginning Concatenation of nc.4 files')
@@ -111,9 +182,6 @@ def main():
     # validate argv
     validate_args(sys.argv[1:])
 
-    # validate netCDF4 variables
-    validate_netCDF4()
-
     # getting variables from sys.argv
     input_filepaths = sys.argv[1:-1]
     output_filepath = sys.argv[-1]
@@ -121,34 +189,27 @@ def main():
     # order output files by number
     input_filepaths = sorted(input_filepaths)
 
+    # validate netCDF4 variables and get the time values of all files
+    times = validate_netCDF4(input_filepaths)
+
     # create output file from input file - maintaining all metadata
     print('Copying files...')
-    output_netCDF4 = copy(input_filepaths[0], output_filepath)
+    output_netCDF4 = create_output(input_filepaths[0], output_filepath, times)
 
-    # run through each file and process
+    # stream all files to the output
     try:
-        time_slice = 0
-        for file in input_filepaths[1:]:
-            input_netCDF4 = netCDF4.Dataset(str(file), 'r')
-            concatenate_file(input_netCDF4, output_netCDF4, time_slice)
-            print('\tFinished '+ str(file))
-            input_netCDF4.close()
-        
-        alter_time_dimension(output_netCDF4, input_filepaths)
+        concatenate_files(input_filepaths, output_netCDF4, times)
         print('Copied all Files successfully')
         print('Output: ')
         print(output_netCDF4)
 
     except Exception as e:
-        raise SystemExit('Error processing an input file.')
+        raise SystemExit('Error processing an input file: ' + str(e))
     finally:
         print('Closing output file and exiting program')
         output_netCDF4.close()
-    
+
 
 
 if __name__ == '__main__':
     main()
-
-
-# TODO: Copy global attributes over
\ No newline at end of file
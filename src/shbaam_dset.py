@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+#*******************************************************************************
+#shbaam_dset.py
+#*******************************************************************************
+
+#Purpose:
+#Open a gridded netCDF file (or a virtual index of several netCDF files, see
+#shbaam_vrtl.py) and load its coordinate vectors, time axis and fill value once
+#into plain NumPy arrays, so that they can be used in loops without going
+#through the netCDF library at each access. A two-dimensional variable such as
+#the GRACE scale factors can also be loaded once with its mask. The dataset
+#can be used in place of a netCDF4.Dataset for reading: all its variables are
+#wrapped so that the calls made to the netCDF library, and the number of bytes
+#they return, are counted.
+#The time can also be converted to decimal years (e.g. 2004.5) or to date
+#strings using its units and calendar, and restricted to a window of dates so
+#that only the corresponding time steps are read. If a cell-major cache of the
+#variable was written by shbaam_cmaj.py and is fresh, it is read instead of the
+#source.
+
+
+#*******************************************************************************
+#Import Python modules
+#*******************************************************************************
+import os.path
+import collections
+import datetime
+import netCDF4
+import numpy
+import shbaam_vrtl
+import shbaam_cmaj
+
+
+#*******************************************************************************
+#Decimal years
+#*******************************************************************************
+YS_tim_unt='days since 2002-01-01 00:00:00'
+#Units of the time of GRACE data, used when the time has no units attribute
+
+def decimal_years(ZV_time,YS_unt=YS_tim_unt,YS_cal='standard'):
+     """Return the decimal years of time values given in units YS_unt.
+
+     A time at the beginning of a year Y is Y, and a time t within this year
+     is Y plus the fraction of the year elapsed, computed in the calendar
+     YS_cal.
+     """
+     ZV_time=numpy.asarray(ZV_time,dtype=numpy.float64)
+     if ZV_time.size==0:
+          return ZV_time
+     IV_yea=numpy.array([x.year for x in netCDF4.num2date(ZV_time,YS_unt,    \
+                                                           YS_cal)])
+     IV_uni,IV_idx=numpy.unique(IV_yea,return_inverse=True)
+     ZV_beg=numpy.asarray(netCDF4.date2num([datetime.datetime(int(x),1,1)      \
+                                            for x in IV_uni],YS_unt,YS_cal))
+     ZV_end=numpy.asarray(netCDF4.date2num([datetime.datetime(int(x)+1,1,1)    \
+                                            for x in IV_uni],YS_unt,YS_cal))
+     IV_idx=IV_idx.ravel()
+     return IV_yea+(ZV_time-ZV_beg[IV_idx])/(ZV_end[IV_idx]-ZV_beg[IV_idx])
+
+
+def time_strings(ZV_time,YS_unt=YS_tim_unt,YS_cal='standard',YS_fmt='%m/%d/%Y'):
+     """Return the dates of time values given in units YS_unt as strings."""
+     if len(ZV_time)==0:
+          return []
+     return [x.strftime(YS_fmt) for x in                                      \
+             numpy.ravel(netCDF4.num2date(ZV_time,YS_unt,YS_cal))]
+
+
+def parse_date(YS_dat):
+     """Return the datetime of an ISO 8601 date, with or without a time."""
+     for YS_fmt in ('%Y-%m-%dT%H:%M:%S','%Y-%m-%d %H:%M:%S','%Y-%m-%d'):
+          try:
+               return datetime.datetime.strptime(YS_dat,YS_fmt)
+          except ValueError:
+               pass
+     raise ValueError('Invalid date, use YYYY-MM-DD: '+YS_dat)
+
+
+#*******************************************************************************
+#Variable restricted to a window of time steps
+#*******************************************************************************
+class WindowVariable(object):
+     """A (time,...) variable of which only the time steps JS_beg:JS_end are
+     seen, the indices along time being shifted before each read.
+     """
+
+     def __init__(self,var,JS_beg,JS_end):
+          self._var=var
+          self._beg=JS_beg
+          self._len=JS_end-JS_beg
+
+     @property
+     def shape(self):
+          return (self._len,)+tuple(self._var.shape[1:])
+
+     def _time_index(self,key):
+          if isinstance(key,slice):
+               JS_sta,JS_sto,JS_stp=key.indices(self._len)
+               if JS_stp<0:
+                    raise IndexError('Negative steps are not supported in time')
+               return slice(self._beg+JS_sta,self._beg+max(JS_sto,JS_sta),     \
+                            JS_stp)
+          if isinstance(key,(int,numpy.integer)):
+               JS_idx=int(key)
+               if JS_idx<0:
+                    JS_idx=JS_idx+self._len
+               if JS_idx<0 or JS_idx>=self._len:
+                    raise IndexError('Time index out of range: '+str(key))
+               return self._beg+JS_idx
+          IV_idx=numpy.arange(self._len)[key]
+          return self._beg+IV_idx
+
+     def __getitem__(self,key):
+          if not isinstance(key,tuple):
+               key=(key,)
+          if len(key)==0 or key[0] is Ellipsis:
+               key=(slice(None),)+key
+          return self._var[(self._time_index(key[0]),)+key[1:]]
+
+     def __getattr__(self,name):
+          return getattr(self._var,name)
+
+     def __len__(self):
+          return self._len
+
+
+#*******************************************************************************
+#Variable with read counts
+#*******************************************************************************
+class CountedVariable(object):
+     """A netCDF variable whose reads are counted by its GridDataset."""
+
+     def __init__(self,shb_dst,var):
+          self._dst=shb_dst
+          self._var=var
+
+     def __getitem__(self,key):
+          ZM_var=self._var[key]
+          self._dst.IS_rd_cnt=self._dst.IS_rd_cnt+1
+          self._dst.IS_rd_byt=self._dst.IS_rd_byt+numpy.ma.getdata(ZM_var).nbytes
+          return ZM_var
+
+     def __getattr__(self,name):
+          return getattr(self._var,name)
+
+     def __len__(self):
+          return len(self._var)
+
+
+#*******************************************************************************
+#Gridded dataset
+#*******************************************************************************
+class GridDataset(object):
+     """A gridded netCDF dataset with its coordinates loaded once.
+
+     The following are available after opening:
+      - IS_lon, IS_lat, IS_time: dimension sizes (IS_time is 0 without time)
+      - ZV_lon, ZV_lat, ZV_time: coordinate values (ZV_time is None without
+        time)
+      - ZS_fil: the fill value of the data, as found by shbaam_twsa.py
+      - YS_tim_unt, YS_tim_cal: units and calendar of the time
+      - var: the variable YS_var, read from its cell-major cache if any
+      - var_rec, ZV_tim_rec: the variable YS_var and the time of the whole
+        record, kept unchanged by time_window()
+      - IS_rd_cnt, IS_rd_byt: number of reads and bytes read so far
+     """
+
+     def __init__(self,shb_ncf_fil,YS_var):
+          self.filepath=shb_ncf_fil
+          self.f=shbaam_vrtl.open_dataset(shb_ncf_fil)
+          self.IS_rd_cnt=0
+          self.IS_rd_byt=0
+          self.dimensions=self.f.dimensions
+          self._src=collections.OrderedDict(self.f.variables)
+          var=self._src[YS_var]
+          if var.dimensions[:1]==('time',) and len(var.dimensions)==3:
+               shb_cch_npy=shbaam_cmaj.cache_file(shb_ncf_fil,YS_var)
+               if os.path.isfile(shb_cch_npy):
+                    self._src[YS_var]=shbaam_cmaj.CellMajorVariable(           \
+                                      shb_cch_npy,var)
+          #The cell-major cache of the variable is used instead of the source
+          #if it was written by shbaam_cmaj.py and is still fresh
+          self.variables=collections.OrderedDict(                              \
+                         (YS_nam,CountedVariable(self,self._src[YS_nam]))      \
+                         for YS_nam in self._src)
+          self.YS_var=YS_var
+          self.var=self.variables[YS_var]
+          self._fld=None
+
+          self.IS_lon=len(self.dimensions['lon'])
+          self.IS_lat=len(self.dimensions['lat'])
+          self.ZV_lon=numpy.ma.getdata(self.variables['lon'][:])
+          self.ZV_lat=numpy.ma.getdata(self.variables['lat'][:])
+          if 'time' in self.dimensions:
+               self.IS_time=len(self.dimensions['time'])
+               self.ZV_time=numpy.ma.getdata(self.variables['time'][:])
+          else:
+               self.IS_time=0
+               self.ZV_time=None
+
+          self.YS_tim_unt=YS_tim_unt
+          self.YS_tim_cal='standard'
+          if 'time' in self.variables:
+               var=self.variables['time']
+               if 'units' in var.ncattrs():
+                    self.YS_tim_unt=var.units
+               if 'calendar' in var.ncattrs():
+                    self.YS_tim_cal=var.calendar
+
+          self.var_rec=self.var
+          self.ZV_tim_rec=self.ZV_time
+
+          self.ZS_fil=netCDF4.default_fillvals['f4']
+          if 'RUNSF' in self.variables:
+               var=self.variables['RUNSF']
+               if '_FillValue' in var.ncattrs():
+                    self.ZS_fil=var._FillValue
+               else:
+                    self.ZS_fil=None
+
+     def field(self):
+          """Return the whole variable as a masked array, read only once."""
+          if self._fld is None:
+               self._fld=numpy.ma.asarray(self.var[...])
+          return self._fld
+
+     def decimal_years(self):
+          """Return the time in decimal years."""
+          if self.ZV_time is None:
+               return numpy.zeros(0)
+          return decimal_years(self.ZV_time,self.YS_tim_unt,self.YS_tim_cal)
+
+     def time_strings(self,YS_fmt='%m/%d/%Y'):
+          """Return the dates of the time steps as strings."""
+          if self.ZV_time is None:
+               return []
+          return time_strings(self.ZV_time,self.YS_tim_unt,self.YS_tim_cal,    \
+                              YS_fmt)
+
+     def time_window(self,YS_dat_beg='',YS_dat_end=''):
+          """Restrict the dataset to the time steps between two dates.
+
+          The dates are given as YYYY-MM-DD ('' for no bound) and both are
+          included. They are converted to the units of the time, and the time
+          steps within the window are found in the time already loaded, so
+          that var, ZV_time, IS_time and all the variables along time then
+          only cover the window, and only its time steps are read afterwards.
+          Return the first and last+1 indices of the window in the record.
+          """
+          if self.ZV_tim_rec is None:
+               raise ValueError('No time in: '+self.filepath)
+          JS_tim_beg=0
+          JS_tim_end=len(self.ZV_tim_rec)
+          if YS_dat_beg!='':
+               ZS_beg=netCDF4.date2num(parse_date(YS_dat_beg),self.YS_tim_unt, \
+                                       self.YS_tim_cal)
+               JS_tim_beg=int(numpy.searchsorted(self.ZV_tim_rec,ZS_beg,       \
+                                                 'left'))
+          if YS_dat_end!='':
+               ZS_end=netCDF4.date2num(parse_date(YS_dat_end),self.YS_tim_unt, \
+                                       self.YS_tim_cal)
+               JS_tim_end=int(numpy.searchsorted(self.ZV_tim_rec,ZS_end,       \
+                                                 'right'))
+          if JS_tim_end<=JS_tim_beg:
+               raise ValueError('No time step between '+YS_dat_beg+' and '     \
+                                +YS_dat_end+' in: '+self.filepath)
+          #The time is increasing
+
+          for YS_nam in self._src:
+               var=self._src[YS_nam]
+               if var.dimensions[:1]==('time',):
+                    self.variables[YS_nam]=CountedVariable(self,               \
+                                   WindowVariable(var,JS_tim_beg,JS_tim_end))
+          self.var=self.variables[self.YS_var]
+          self.ZV_time=self.ZV_tim_rec[JS_tim_beg:JS_tim_end]
+          self.IS_time=JS_tim_end-JS_tim_beg
+          self._fld=None
+          return JS_tim_beg,JS_tim_end
+
+     def __getitem__(self,name):
+          return self.variables[name]
+
+     def ncattrs(self):
+          return self.f.ncattrs()
+
+     def getncattr(self,name):
+          return self.f.getncattr(name)
+
+     def close(self):
+          self.f.close()
+
+     def __enter__(self):
+          return self
+
+     def __exit__(self,*args):
+          self.close()
+
+
+#*******************************************************************************
+#End
+#*******************************************************************************
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+#*******************************************************************************
+#shbaam_grid.py
+#*******************************************************************************
+
+#Purpose:
+#Compute the surface area of the grid cells of a regular longitude/latitude
+#grid. All grid cells located at the same latitude have the same area, hence
+#the areas are computed once for each latitude of the grid, with vectorized
+#operations, and kept in memory for each grid definition (the latitude vector
+#and the interval sizes), so that all tools share the same values.
+#Two Earth models are available: a sphere of radius 6371000 m using the
+#historical formula of SHBAAM (the area of a flat cell of the size of the grid
+#intervals at the latitude of its center), and the WGS84 ellipsoid using the
+#exact area of the cell between the latitudes of its edges.
+
+
+#*******************************************************************************
+#Import Python modules
+#*******************************************************************************
+import numpy
+
+
+#*******************************************************************************
+#Earth models
+#*******************************************************************************
+ZS_sph_rad=6371000.0
+#Radius of the sphere (m)
+ZS_wgs_sma=6378137.0
+ZS_wgs_inf=298.257223563
+#Semi-major axis (m) and inverse flattening of the WGS84 ellipsoid
+
+YV_are_mod=['sphere','wgs84']
+
+YD_lat_are={}
+#Areas of the grid cells at each latitude, for each grid definition
+
+
+#*******************************************************************************
+#Interval sizes
+#*******************************************************************************
+def grid_steps(ZV_grc_lon,ZV_grc_lat):
+     """Return the (lon,lat) interval sizes from the first two coordinates."""
+     ZS_lon_stp=float(abs(ZV_grc_lon[1]-ZV_grc_lon[0]))
+     ZS_lat_stp=float(abs(ZV_grc_lat[1]-ZV_grc_lat[0]))
+     return ZS_lon_stp,ZS_lat_stp
+
+
+#*******************************************************************************
+#Area of the grid cells at each latitude
+#*******************************************************************************
+def latitude_areas(ZV_grc_lat,ZS_lon_stp,ZS_lat_stp,YS_are_mod='sphere'):
+     """Return the area (m2) of a grid cell at each latitude of ZV_grc_lat.
+
+     The areas are computed once per (latitudes,intervals,model) and the same
+     read-only array is returned for later calls.
+     """
+     if YS_are_mod not in YV_are_mod:
+          raise ValueError('Invalid area model: '+YS_are_mod)
+
+     ZV_grc_lat=numpy.array(ZV_grc_lat[:],dtype=numpy.float64)
+     YS_lat_key=(ZV_grc_lat.tobytes(),float(ZS_lon_stp),float(ZS_lat_stp),    \
+                 YS_are_mod)
+     if YS_lat_key in YD_lat_are:
+          return YD_lat_are[YS_lat_key]
+
+     if YS_are_mod=='sphere':
+          ZV_lat_are=ZS_sph_rad*numpy.radians(ZS_lat_stp)                      \
+                    *ZS_sph_rad*numpy.radians(ZS_lon_stp)                      \
+                    *numpy.cos(numpy.radians(ZV_grc_lat))
+     else:
+          ZV_lat_are=ellipsoid_areas(ZV_grc_lat,ZS_lon_stp,ZS_lat_stp)
+
+     ZV_lat_are.setflags(write=False)
+     YD_lat_are[YS_lat_key]=ZV_lat_are
+     return ZV_lat_are
+
+
+def ellipsoid_areas(ZV_grc_lat,ZS_lon_stp,ZS_lat_stp):
+     """Return the area (m2) of a cell at each latitude on the WGS84 ellipsoid.
+
+     The area between the equator and a latitude phi over a longitude interval
+     dlon is b2*dlon/2*(sin(phi)/(1-e2*sin2(phi))+atanh(e*sin(phi))/e).
+     """
+     ZS_ecc=numpy.sqrt((2-1/ZS_wgs_inf)/ZS_wgs_inf)
+     ZS_smb=ZS_wgs_sma*(1-1/ZS_wgs_inf)
+
+     def zone(ZV_lat):
+          ZV_sin=numpy.sin(numpy.radians(numpy.clip(ZV_lat,-90,90)))
+          return ZV_sin/(1-(ZS_ecc*ZV_sin)**2)                                 \
+                +numpy.arctanh(ZS_ecc*ZV_sin)/ZS_ecc
+
+     return ZS_smb**2*numpy.radians(ZS_lon_stp)/2                              \
+           *abs(zone(ZV_grc_lat+ZS_lat_stp/2)-zone(ZV_grc_lat-ZS_lat_stp/2))
+
+
+#*******************************************************************************
+#Area of a set of grid cells
+#*******************************************************************************
+def cell_areas(ZV_grc_lon,ZV_grc_lat,IV_dom_lat,YS_are_mod='sphere'):
+     """Return the area (m2) of the grid cells at the given latitude indices.
+
+     The interval sizes are computed from the first two values of each
+     coordinate vector.
+     """
+     ZS_lon_stp,ZS_lat_stp=grid_steps(ZV_grc_lon,ZV_grc_lat)
+     ZV_lat_are=latitude_areas(ZV_grc_lat,ZS_lon_stp,ZS_lat_stp,YS_are_mod)
+     return ZV_lat_are[numpy.asarray(IV_dom_lat,dtype=numpy.int64)]
+
+
+#*******************************************************************************
+#End
+#*******************************************************************************
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+#*******************************************************************************
+#shbaam_http.py
+#*******************************************************************************
+
+#Purpose:
+#Download files over HTTP with a networking session that can be shared by
+#several threads. Each file is streamed to a temporary '.part' file next to its
+#final location, and renamed atomically once complete, so that an interrupted
+#download never leaves a truncated file with the final name. A '.part' file left
+#by a previous attempt is resumed with an HTTP range request when the server
+#supports it, the '.part' file being discarded if the server answers with
+#another range. Failed requests (connection errors, server errors, truncated
+#transfers) are retried with an exponential backoff.
+
+
+#*******************************************************************************
+#Import Python modules
+#*******************************************************************************
+import os
+import os.path
+import time
+import requests
+
+
+#*******************************************************************************
+#Networking session
+#*******************************************************************************
+def session(cred=None,IS_wrk=1):
+     """Return a session whose connection pool can serve IS_wrk threads."""
+     s=requests.Session()
+     s.max_redirects=200
+     s.auth=cred
+     shb_adp=requests.adapters.HTTPAdapter(pool_connections=max(IS_wrk,1),    \
+                                           pool_maxsize=max(IS_wrk,1))
+     s.mount('https://',shb_adp)
+     s.mount('http://',shb_adp)
+     return s
+
+
+#*******************************************************************************
+#Download one file
+#*******************************************************************************
+def download(s,url,payload,shb_out_dir,YS_lbl,IS_try=5,ZS_bck=1.0,           \
+             ZS_tmo=300.0,IS_blk=65536):
+     """Download one file to shb_out_dir and return its path.
+
+     The file is named after the content-disposition header of the response,
+     or after YS_lbl if there is none. The request is attempted IS_try times,
+     waiting ZS_bck, 2*ZS_bck, 4*ZS_bck... seconds between attempts. Client
+     errors (4xx other than 408 and 429) are not retried. An attempt fails if
+     the server does not send any data for ZS_tmo seconds. IOError is raised
+     if all attempts fail.
+     """
+     shb_prt=os.path.join(shb_out_dir,YS_lbl+'.part')
+     YS_err=''
+     for JS_try in range(IS_try):
+          if JS_try>0:
+               time.sleep(ZS_bck*2**(JS_try-1))
+          try:
+               return download_once(s,url,payload,shb_out_dir,YS_lbl,shb_prt, \
+                                    ZS_tmo,IS_blk)
+          except requests.exceptions.HTTPError as e:
+               YS_err=str(e)
+               IS_sta=e.response.status_code
+               if 400<=IS_sta<500 and IS_sta!=408 and IS_sta!=429:
+                    break
+          except (requests.exceptions.RequestException,IOError) as e:
+               YS_err=str(e)
+     raise IOError('Unable to download '+YS_lbl+': '+YS_err)
+
+
+def range_start(YS_rng):
+     """Return the first byte of a content-range header, or None."""
+     YS_rng=YS_rng.strip()
+     if not YS_rng.startswith('bytes '):
+          return None
+     try:
+          return int(YS_rng[len('bytes '):].split('-')[0])
+     except ValueError:
+          return None
+
+
+def download_once(s,url,payload,shb_out_dir,YS_lbl,shb_prt,ZS_tmo,IS_blk):
+     """Make one attempt at downloading a file, resuming a '.part' file."""
+     IS_beg=0
+     if os.path.isfile(shb_prt):
+          IS_beg=os.path.getsize(shb_prt)
+     YD_hdr={}
+     if IS_beg>0:
+          YD_hdr['Range']='bytes='+str(IS_beg)+'-'
+
+     r=s.get(url,params=payload,headers=YD_hdr,stream=True,timeout=ZS_tmo)
+     try:
+          if r.status_code==416:
+               IS_beg=0
+               os.remove(shb_prt)
+               raise IOError('Invalid range for partial file '+shb_prt)
+               #The partial file is not a prefix of the file, start again
+          r.raise_for_status()
+          if r.status_code!=206:
+               IS_beg=0
+          #The server ignored the range request and sends the whole file
+          elif range_start(r.headers.get('content-range',''))!=IS_beg:
+               IS_beg=0
+               os.remove(shb_prt)
+               raise IOError('Misaligned range for partial file '+shb_prt)
+               #The server does not resume where the partial file ends, start
+               #again rather than corrupting the file
+
+          YS_name=r.headers.get('content-disposition','')
+          YS_name=YS_name.replace('attachment; filename=','')
+          YS_name=YS_name.replace('"','')
+          if YS_name=='':
+               YS_name=YS_lbl
+          YS_name=os.path.basename(YS_name)
+
+          IS_len=r.headers.get('content-length')
+          IS_siz=IS_beg
+          with open(shb_prt,'ab' if IS_beg>0 else 'wb') as shb_fil:
+               for YS_blk in r.iter_content(chunk_size=IS_blk):
+                    shb_fil.write(YS_blk)
+                    IS_siz=IS_siz+len(YS_blk)
+     finally:
+          r.close()
+
+     if IS_len is not None and IS_siz-IS_beg!=int(IS_len):
+          raise IOError('Truncated transfer for '+YS_lbl)
+
+     shb_fin=os.path.join(shb_out_dir,YS_name)
+     os.rename(shb_prt,shb_fin)
+     return shb_fin
+
+
+#*******************************************************************************
+#End
+#*******************************************************************************
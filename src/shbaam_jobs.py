@@ -0,0 +1,661 @@
+#!/usr/bin/env python
+#*******************************************************************************
+#shbaam_jobs.py
+#*******************************************************************************
+
+#Purpose:
+#Compute Terrestrial Water Storage Anomalies from GRACE from within a Python
+#process, without running shbaam_twsa.py for each shapefile. A TWSAJob opens
+#the GRACE data and associated scale factors once, checks that their grids are
+#consistent, and keeps the datasets open along with everything that does not
+#depend on the shapefile: the coordinates, the scale factors and their mask,
+#the time strings and the attributes of the outputs. The GRACE data can also be
+#loaded once in memory, or read from a memory-mapped copy shared by several
+#processes. Each call then only reads the polygon shapefile, selects its grid
+#cells and aggregates the anomalies over them, so that a long-lived process can
+#serve many basins in a row. This is the computation of shbaam_twsa.py, of
+#shbaam_pool.py and of 'shbaam.py twsa', which all write the CSV time series
+#and netCDF map with the same methods.
+#The cells, long-term mean and weights of a shapefile can also be saved in a
+#state file, so that a later run only reads the time steps added to the GRACE
+#data since then and appends them to the existing outputs (fixed baseline).
+#Errors are raised as exceptions (IOError, ValueError) instead of exiting, so
+#that one bad request does not stop the process.
+
+
+#*******************************************************************************
+#Import Python modules
+#*******************************************************************************
+import os.path
+import hashlib
+import subprocess
+import datetime
+import csv
+import netCDF4
+import numpy
+import fiona
+import shbaam_cell
+import shbaam_wght
+import shbaam_anom
+import shbaam_ncdf
+import shbaam_dset
+import shbaam_base
+import shbaam_npzf
+
+
+#*******************************************************************************
+#Content of the state of a shapefile (see TWSAJob.update())
+#*******************************************************************************
+YV_sta_var=['IV_dom_lon','IV_dom_lat','IV_dom_fea','ZV_dom_sqm','IV_dom_cel',  \
+            'IV_cel_lat','IV_cel_lon','ZV_cel_avg','IV_wgt_row','IV_wgt_col',  \
+            'ZV_wgt_val','ZV_fea_sqm']
+
+
+#*******************************************************************************
+#Attributes copied from the GRACE netCDF file to the maps
+#*******************************************************************************
+YD_ncf_att={'time': ['standard_name','long_name','units','axis','calendar',   \
+                     'bounds'],                                                \
+            'lat': ['standard_name','long_name','units','axis'],               \
+            'lon': ['standard_name','long_name','units','axis'],               \
+            'lwe_thickness': ['standard_name','long_name','units',             \
+                              'coordinates','grid_mapping','cell_methods'],    \
+            'crs': ['grid_mapping_name','semi_major_axis',                     \
+                    'inverse_flattening']}
+
+
+#*******************************************************************************
+#Memory-mapped grid read as a masked array
+#*******************************************************************************
+class MaskedGrid(object):
+     """A memory-mapped grid whose NaN values are masked when read, as the
+     missing values of the netCDF variable it was copied from.
+     """
+
+     def __init__(self,ZM_grd):
+          self._grd=ZM_grd
+
+     @property
+     def shape(self):
+          return self._grd.shape
+
+     def __getitem__(self,key):
+          return numpy.ma.masked_invalid(self._grd[key])
+
+
+#*******************************************************************************
+#Job computing the anomalies of many shapefiles
+#*******************************************************************************
+class TWSAJob(object):
+     """The GRACE data and scale factors, opened once for many shapefiles.
+
+     The options are those of shbaam_twsa.py: shb_cel_dir (cache of grid
+     cells, '' to disable), YS_cel_mod ('center' or 'fraction'), YS_are_mod
+     ('sphere' or 'wgs84'), IS_tim_chk (time steps read at once, 0 for all),
+     and the baseline period ZS_bas_beg to ZS_bas_end in decimal years (0 and
+     0 for the mean of the whole record) with shb_bas_dir (folder of the
+     baseline files, see shbaam_base.py). Only the time steps between the
+     dates YS_dat_beg and YS_dat_end (YYYY-MM-DD, '' for no bound) are read.
+     The maps are written in the format YS_ncf_fmt, with the chunks YS_ncf_chk
+     ('time' or 'cell') if compressed, and cropped to the domain if ZB_ncf_crp
+     is True.
+     If ZB_grc_mem is True, the GRACE data is read once in memory and never
+     read from disk again, which is fastest when many shapefiles are
+     processed and the data fits in memory. If shb_lwe_npy is given, the
+     GRACE data is read from this copy written by save_grace() instead, which
+     can be memory-mapped by many processes at once.
+     """
+
+     def __init__(self,shb_grc_ncf,shb_fct_ncf,shb_cel_dir='',               \
+                  YS_cel_mod='center',YS_are_mod='sphere',IS_tim_chk=0,        \
+                  ZB_grc_mem=False,ZS_bas_beg=0,ZS_bas_end=0,shb_bas_dir='',   \
+                  YS_dat_beg='',YS_dat_end='',YS_ncf_fmt='NETCDF3_CLASSIC',    \
+                  YS_ncf_chk='time',ZB_ncf_crp=False,shb_lwe_npy=''):
+          for shb_fil in [shb_grc_ncf,shb_fct_ncf]:
+               if not os.path.isfile(shb_fil):
+                    raise IOError('Unable to open '+shb_fil)
+
+          self.shb_cel_dir=shb_cel_dir
+          self.YS_cel_mod=YS_cel_mod
+          self.YS_are_mod=YS_are_mod
+          self.IS_tim_chk=IS_tim_chk
+          self.ZS_bas_beg=ZS_bas_beg
+          self.ZS_bas_end=ZS_bas_end
+          self.YS_ncf_fmt=YS_ncf_fmt
+          self.YS_ncf_chk=YS_ncf_chk
+          self.ZB_ncf_crp=ZB_ncf_crp
+          self.shb_grc_ncf=shb_grc_ncf
+          self.shb_fct_ncf=shb_fct_ncf
+
+          self.f=shbaam_dset.GridDataset(shb_grc_ncf,'lwe_thickness')
+          self.g=shbaam_dset.GridDataset(shb_fct_ncf,'scale_factor')
+          if self.f.IS_lon!=self.g.IS_lon                                      \
+             or not numpy.array_equal(self.f.ZV_lon,self.g.ZV_lon):
+               self.close()
+               raise ValueError('The longitudes of the netCDF files differ')
+          if self.f.IS_lat!=self.g.IS_lat                                      \
+             or not numpy.array_equal(self.f.ZV_lat,self.g.ZV_lat):
+               self.close()
+               raise ValueError('The latitudes of the netCDF files differ')
+          if YS_dat_beg!='' or YS_dat_end!='':
+               try:
+                    self.f.time_window(YS_dat_beg,YS_dat_end)
+               except ValueError:
+                    self.close()
+                    raise
+
+          self.ZV_grc_lon=self.f.ZV_lon
+          self.ZV_grc_lat=self.f.ZV_lat
+          self.ZV_grc_time=self.f.ZV_time
+          self.YV_grc_time=self.f.time_strings('%m/%d/%Y')
+
+          if shb_lwe_npy!='':
+               self.ZV_grc_lwe=MaskedGrid(numpy.load(shb_lwe_npy,mmap_mode='r'))
+               if self.ZV_grc_lwe.shape!=self.f.var.shape:
+                    self.close()
+                    raise ValueError('The shape of '+shb_lwe_npy+' differs '   \
+                                     +'from that of the GRACE data')
+          elif ZB_grc_mem:
+               self.ZV_grc_lwe=self.f.field()
+          else:
+               self.ZV_grc_lwe=self.f.var
+          #Either a copy of the data, or the netCDF variable read at each call
+
+          self.ZM_bas_avg=None
+          if ZS_bas_beg!=0 or ZS_bas_end!=0:
+               try:
+                    self.ZM_bas_avg=shbaam_base.baseline(self.f,ZS_bas_beg,    \
+                                                         ZS_bas_end,           \
+                                                         shb_bas_dir,          \
+                                                         IS_tim_chk)
+               except ValueError:
+                    self.close()
+                    raise
+          #The baseline mean of all cells, looked up by all shapefiles
+
+          ZM_grc_scl=self.g.field()
+          self.ZM_grc_msk=numpy.ma.getmaskarray(ZM_grc_scl)
+          self.ZM_grc_scl=numpy.ma.filled(ZM_grc_scl,0)
+          #The scale factor is set to zero for NoData points
+
+          self.YD_ncf_att={}
+          for YS_var in YD_ncf_att:
+               if YS_var in self.f.variables:
+                    var=self.f.variables[YS_var]
+                    self.YD_ncf_att[YS_var]=dict(                             \
+                             (YS_att,var.getncattr(YS_att))                    \
+                             for YS_att in YD_ncf_att[YS_var]                  \
+                             if YS_att in var.ncattrs())
+          #The attributes of the maps
+
+     #--------------------------------------------------------------------------
+     #Copy of the GRACE data
+     #--------------------------------------------------------------------------
+     def save_grace(self,shb_lwe_npy):
+          """Copy the GRACE data of the time window to a .npy file.
+
+          The data is copied by chunks of IS_tim_chk time steps (12 if 0), and
+          masked values are stored as NaN. The copy is then read by the jobs
+          given shb_lwe_npy.
+          """
+          ZM_grc_lwe=numpy.lib.format.open_memmap(shb_lwe_npy,mode='w+',      \
+                                                  dtype=numpy.float32,         \
+                                                  shape=self.f.var.shape)
+          for JS_beg,JS_end in shbaam_anom.time_chunks(ZM_grc_lwe.shape[0],  \
+                                                        self.IS_tim_chk or 12):
+               ZM_grc_lwe[JS_beg:JS_end,:,:]=numpy.ma.filled(                  \
+                               numpy.ma.asarray(self.ZV_grc_lwe[JS_beg:JS_end, \
+                                                                :,:])          \
+                               .astype(numpy.float32),numpy.nan)
+          ZM_grc_lwe.flush()
+          del ZM_grc_lwe
+
+     #--------------------------------------------------------------------------
+     #Select grid cells
+     #--------------------------------------------------------------------------
+     def cells(self,shb_pol_shp,shb_fea_fld=''):
+          """Return a dict with the grid cells selected for a shapefile.
+
+          With shb_fea_fld='', all features are merged into one domain.
+          Otherwise, each feature is its own domain and is named after its
+          attribute shb_fea_fld (batch mode of shbaam_twsa.py).
+          """
+          if not os.path.isfile(shb_pol_shp):
+               raise IOError('Unable to open '+shb_pol_shp)
+
+          with fiona.open(shb_pol_shp,'r') as shb_pol_lay:
+               IV_dom_lon,IV_dom_lat,IV_dom_fea,ZV_dom_sqm=                    \
+                         shbaam_cell.find_cells(self.ZV_grc_lon,               \
+                                                self.ZV_grc_lat,shb_pol_lay,   \
+                                                self.shb_cel_dir,              \
+                                                self.YS_cel_mod,               \
+                                                self.YS_are_mod)
+               if shb_fea_fld=='':
+                    YV_fea_nam=[]
+               else:
+                    YV_fea_nam=[str(shb_pol_fea['properties'][shb_fea_fld])   \
+                                for shb_pol_fea in shb_pol_lay]
+
+          if shb_fea_fld=='':
+               IS_fea_tot=1
+               IV_dom_fea=numpy.zeros(len(IV_dom_lon),dtype=numpy.int64)
+          else:
+               IS_fea_tot=len(YV_fea_nam)
+
+          IS_grc_lon=len(self.ZV_grc_lon)
+          IV_cel_lin,IV_dom_cel=numpy.unique(IV_dom_lat*IS_grc_lon+IV_dom_lon, \
+                                             return_inverse=True)
+          IV_dom_cel=IV_dom_cel.ravel()
+          #Each grid cell is only processed once, even if located within
+          #several features
+
+          return {'IV_dom_lon': IV_dom_lon, 'IV_dom_lat': IV_dom_lat,          \
+                  'IV_dom_fea': IV_dom_fea, 'ZV_dom_sqm': ZV_dom_sqm,          \
+                  'IV_dom_cel': IV_dom_cel,                                    \
+                  'IV_cel_lat': IV_cel_lin//IS_grc_lon,                        \
+                  'IV_cel_lon': IV_cel_lin%IS_grc_lon,                         \
+                  'IS_fea_tot': IS_fea_tot, 'YV_fea_nam': YV_fea_nam,          \
+                  'shb_fea_fld': shb_fea_fld}
+
+     #--------------------------------------------------------------------------
+     #Compute anomalies
+     #--------------------------------------------------------------------------
+     def run(self,shb_pol_shp,shb_fea_fld=''):
+          """Return a dict with the anomalies of a shapefile.
+
+          The dict holds the cells of cells(), along with the long-term mean
+          ZV_cel_avg of each cell, the weight matrix of the average of each
+          feature (IV_wgt_row,IV_wgt_col,ZV_wgt_val), the area ZV_fea_sqm of
+          each feature without the NoData points, and the (time,feature)
+          anomalies ZM_wsa in cm of the time steps from JS_tim_beg (0 here).
+          """
+          shb_res=self.cells(shb_pol_shp,shb_fea_fld)
+          ZM_cel_lwe=self.mean(shb_res)
+          self.weights(shb_res)
+          self.anomalies(shb_res,0,ZM_cel_lwe)
+          return shb_res
+
+     def mean(self,shb_res):
+          """Add the long-term mean ZV_cel_avg of the cells to a result.
+
+          The mean is that of the time steps read, or that of the baseline
+          period if given. Returns the last block of time steps read, which
+          can be given to anomalies() to avoid reading it again (None if the
+          mean is that of the baseline).
+          """
+          IV_cel_lat=shb_res['IV_cel_lat']
+          IV_cel_lon=shb_res['IV_cel_lon']
+          if self.ZM_bas_avg is None:
+               ZV_cel_avg,ZM_cel_lwe=shbaam_anom.cell_mean(self.ZV_grc_lwe,    \
+                                                           IV_cel_lat,         \
+                                                           IV_cel_lon,         \
+                                                           self.IS_tim_chk)
+               #The time steps are read in chunks of IS_tim_chk with one
+               #single call each, and the (time,cell) block of the domain is
+               #extracted from them
+          else:
+               ZV_cel_avg=self.ZM_bas_avg[IV_cel_lat,IV_cel_lon]
+               ZM_cel_lwe=None
+          shb_res['ZV_cel_avg']=ZV_cel_avg
+          return ZM_cel_lwe
+
+     def weights(self,shb_res):
+          """Add the weights of the average of each feature to a result.
+
+          These are the sparse (feature,cell) matrix of the product of scale
+          factors and cell areas (IV_wgt_row,IV_wgt_col,ZV_wgt_val), and the
+          area ZV_fea_sqm of each feature without the NoData points of the
+          scale factors, which are ignored.
+          """
+          IV_cel_lat=shb_res['IV_cel_lat']
+          IV_cel_lon=shb_res['IV_cel_lon']
+          ZV_cel_msk=self.ZM_grc_msk[IV_cel_lat,IV_cel_lon]
+          ZV_cel_scl=self.ZM_grc_scl[IV_cel_lat,IV_cel_lon]
+          IV_wgt_row,IV_wgt_col,ZV_wgt_val,ZV_fea_sqm=                         \
+                         shbaam_wght.average_weights(shb_res['IV_dom_fea'],    \
+                                                     shb_res['IV_dom_cel'],    \
+                                                     shb_res['ZV_dom_sqm'],    \
+                                                     ZV_cel_scl,ZV_cel_msk,    \
+                                                     shb_res['IS_fea_tot'])
+          shb_res['IV_wgt_row']=IV_wgt_row
+          shb_res['IV_wgt_col']=IV_wgt_col
+          shb_res['ZV_wgt_val']=ZV_wgt_val
+          shb_res['ZV_fea_sqm']=ZV_fea_sqm
+
+     def anomalies(self,shb_res,JS_tim_beg=0,ZM_cel_lwe=None,h=None):
+          """Compute the anomalies ZM_wsa of a result from time step JS_tim_beg.
+
+          The mean and weights already in shb_res are used, and only the time
+          steps from JS_tim_beg are read. If the map h opened by create_map()
+          is given, the anomalies are also written in it as they are computed,
+          so that the GRACE data is not read again for the map.
+          """
+          ZM_wsa=numpy.zeros((len(self.ZV_grc_time)-JS_tim_beg,               \
+                              shb_res['IS_fea_tot']))
+          for JS_beg,JS_end,ZM_cel_ano in shbaam_anom.cell_anomalies(          \
+                                      self.ZV_grc_lwe,shb_res['IV_cel_lat'],   \
+                                      shb_res['IV_cel_lon'],                   \
+                                      shb_res['ZV_cel_avg'],self.IS_tim_chk,   \
+                                      ZM_cel_lwe,JS_tim_beg):
+               ZM_wsa[JS_beg-JS_tim_beg:JS_end-JS_tim_beg,:]=                  \
+                         shbaam_wght.weight_average(ZM_cel_ano,                \
+                                                    shb_res['IV_wgt_row'],     \
+                                                    shb_res['IV_wgt_col'],     \
+                                                    shb_res['ZV_wgt_val'],     \
+                                                    shb_res['ZV_fea_sqm'])
+               #Features without any valid grid cell have no data (NaN)
+               if h is not None and shb_res['shb_fea_fld']=='':
+                    self.write_block(shb_res,h,JS_beg,ZM_cel_ano)
+          shb_res['JS_tim_beg']=JS_tim_beg
+          shb_res['ZM_wsa']=ZM_wsa
+          if h is not None:
+               if shb_res['shb_fea_fld']!='':
+                    h.variables['lwe_thickness'][JS_tim_beg:,:]=               \
+                                              numpy.ma.masked_invalid(ZM_wsa)
+               h.variables['time'][JS_tim_beg:]=self.ZV_grc_time[JS_tim_beg:]
+
+     #--------------------------------------------------------------------------
+     #Write outputs
+     #--------------------------------------------------------------------------
+     def write_csv(self,shb_res,shb_wsa_csv):
+          """Write the time series of a result of run().
+
+          If the anomalies start after the first time step, their rows are
+          appended to an existing file.
+          """
+          JS_tim_beg=shb_res['JS_tim_beg']
+          with open(shb_wsa_csv,'wb' if JS_tim_beg==0 else 'ab') as csvfile:
+               csvwriter=csv.writer(csvfile,dialect='excel')
+               if shb_res['shb_fea_fld']!='' and JS_tim_beg==0:
+                    csvwriter.writerow([shb_res['shb_fea_fld']]               \
+                                       +shb_res['YV_fea_nam'])
+               for JS_grc_time in range(JS_tim_beg,len(self.YV_grc_time)):
+                    ZV_wsa=shb_res['ZM_wsa'][JS_grc_time-JS_tim_beg,:]
+                    if shb_res['shb_fea_fld']=='':
+                         csvwriter.writerow([self.YV_grc_time[JS_grc_time],    \
+                                             ZV_wsa[0]])
+                    else:
+                         csvwriter.writerow([self.YV_grc_time[JS_grc_time]]    \
+                                            +list(ZV_wsa))
+                         #Wide format, with one column for each feature
+
+     def create_map(self,shb_res,shb_wsa_ncf):
+          """Create the map of a result and return it open for writing.
+
+          The map has the anomalies of the grid cells on the GRACE grid, or
+          on the smallest window covering the domain if ZB_ncf_crp is True,
+          or, in batch mode, one time series for each of the features. Its
+          anomalies and time are left to be written, see anomalies() and
+          write_map().
+          """
+          shb_fea_fld=shb_res['shb_fea_fld']
+          IS_grc_lon=len(self.ZV_grc_lon)
+          IS_grc_lat=len(self.ZV_grc_lat)
+          h=netCDF4.Dataset(shb_wsa_ncf,'w',format=self.YS_ncf_fmt)
+
+          h.createDimension('time',None)
+          h.createDimension('nv',2)
+          h.createVariable('time','i4',('time',))
+          h.createVariable('time_bnds','i4',('time','nv',))
+          if shb_fea_fld=='':
+               if self.ZB_ncf_crp and len(shb_res['IV_cel_lat'])>0:
+                    JS_lat_beg,JS_lat_end,JS_lon_beg,JS_lon_end=               \
+                         shbaam_ncdf.cell_window(shb_res['IV_cel_lat'],        \
+                                                 shb_res['IV_cel_lon'],        \
+                                                 IS_grc_lon)
+               else:
+                    JS_lat_beg,JS_lat_end,JS_lon_beg,JS_lon_end=               \
+                                                     0,IS_grc_lat,0,IS_grc_lon
+               #The map is either global or cropped to the window covering
+               #the domain, which continues from the start of the grid if the
+               #domain straddles its end
+               h.createDimension('lat',JS_lat_end-JS_lat_beg)
+               h.createDimension('lon',JS_lon_end-JS_lon_beg)
+               lat=h.createVariable('lat','f4',('lat',))
+               lon=h.createVariable('lon','f4',('lon',))
+               lwe_thickness=h.createVariable('lwe_thickness','f4',            \
+                                              ('time','lat','lon',),           \
+                                              fill_value=self.f.ZS_fil,        \
+                                              **shbaam_ncdf.variable_options(  \
+                                                self.YS_ncf_fmt,               \
+                                                self.YS_ncf_chk,               \
+                                                len(self.ZV_grc_time),         \
+                                                JS_lat_end-JS_lat_beg,         \
+                                                JS_lon_end-JS_lon_beg))
+          else:
+               YV_fea_nam=shb_res['YV_fea_nam']
+               IS_fea_str=max([len(YS_fea_nam) for YS_fea_nam in YV_fea_nam]   \
+                              +[1])
+               h.createDimension('feature',len(YV_fea_nam))
+               h.createDimension('name_strlen',IS_fea_str)
+               feature_id=h.createVariable('feature_id','S1',                  \
+                                           ('feature','name_strlen',))
+               lwe_thickness=h.createVariable('lwe_thickness','f4',            \
+                                              ('time','feature',),             \
+                                              fill_value=self.f.ZS_fil)
+               #Batch mode, one time series for each feature
+          h.createVariable('crs','i4')
+
+          vsn=subprocess.Popen('bash ../version.sh',                           \
+                               stdout=subprocess.PIPE,shell=True).communicate()
+          vsn=vsn[0].rstrip().decode('ascii','replace')
+          dt=datetime.datetime.utcnow().replace(microsecond=0)
+          #Version of SHBAAM and current UTC time without the microseconds
+
+          h.Conventions='CF-1.6'
+          h.title=''
+          h.institution=''
+          h.source='SHBAAM: '+vsn                                              \
+                  +', GRACE: '+os.path.basename(self.shb_grc_ncf)              \
+                  +', Scale factors: '+os.path.basename(self.shb_fct_ncf)
+          h.history='date created: '+dt.isoformat()+'+00:00'
+          h.references='https://github.com/c-h-david/shbaam/'
+          h.comment=''
+          h.featureType='timeSeries'
+
+          for YS_var in self.YD_ncf_att:
+               if YS_var in h.variables:
+                    h.variables[YS_var].setncatts(self.YD_ncf_att[YS_var])
+          lwe_thickness.grid_mapping='crs'
+          h.variables['crs'].grid_mapping_name='latitude_longitude'
+          h.variables['crs'].semi_major_axis='6378137'
+          h.variables['crs'].inverse_flattening='298.257223563'
+          #These are for the WGS84 spheroid
+
+          if shb_fea_fld=='':
+               lon[:]=shbaam_ncdf.window_lon(self.ZV_grc_lon,JS_lon_beg,       \
+                                             JS_lon_end)
+               lat[:]=self.ZV_grc_lat[JS_lat_beg:JS_lat_end]
+          else:
+               feature_id[:]=numpy.array([list(YS_fea_nam.ljust(IS_fea_str))  \
+                                          for YS_fea_nam in YV_fea_nam],       \
+                                         dtype='S1')
+               feature_id.long_name=shb_fea_fld
+               feature_id.cf_role='timeseries_id'
+               lwe_thickness.coordinates='feature_id'
+          return h
+
+     def write_block(self,shb_res,h,JS_beg,ZM_cel_ano):
+          """Write the anomalies of a chunk of time steps in a gridded map.
+
+          The anomalies of all grid cells are written at once, using the
+          smallest lat/lon window covering the domain. The map can be cropped,
+          its window is then found from its first coordinates.
+          """
+          JS_lat_beg=int(numpy.argmin(abs(self.ZV_grc_lat                      \
+                                          -h.variables['lat'][0])))
+          JS_lon_beg=int(numpy.argmin(abs(self.ZV_grc_lon                      \
+                                          -h.variables['lon'][0])))
+          shbaam_ncdf.write_block(h.variables['lwe_thickness'],JS_beg,         \
+                                  ZM_cel_ano,shb_res['IV_cel_lat']-JS_lat_beg, \
+                                  (shb_res['IV_cel_lon']-JS_lon_beg)           \
+                                  %len(self.ZV_grc_lon))
+
+     def write_map(self,shb_res,shb_wsa_ncf):
+          """Write the map of the anomalies of a result of run().
+
+          The map is created by create_map(), or, if the anomalies start
+          after the first time step, they are appended along the unlimited
+          time of an existing map, which must have the time steps before
+          JS_tim_beg. The anomalies of the grid cells are read again, the map
+          can be written along with them instead, see anomalies().
+          """
+          JS_tim_beg=shb_res['JS_tim_beg']
+          if JS_tim_beg==0:
+               h=self.create_map(shb_res,shb_wsa_ncf)
+          else:
+               h=netCDF4.Dataset(shb_wsa_ncf,'a')
+          try:
+               if JS_tim_beg>0 and len(h.dimensions['time'])!=JS_tim_beg:
+                    raise ValueError('The number of time steps of '           \
+                                     +shb_wsa_ncf+' is not '+str(JS_tim_beg))
+               if 'feature' in h.variables['lwe_thickness'].dimensions:
+                    h.variables['lwe_thickness'][JS_tim_beg:,:]=               \
+                                     numpy.ma.masked_invalid(shb_res['ZM_wsa'])
+               else:
+                    for JS_beg,JS_end,ZM_cel_ano in shbaam_anom.cell_anomalies(\
+                                         self.ZV_grc_lwe,shb_res['IV_cel_lat'],\
+                                         shb_res['IV_cel_lon'],                \
+                                         shb_res['ZV_cel_avg'],                \
+                                         self.IS_tim_chk,None,JS_tim_beg):
+                         self.write_block(shb_res,h,JS_beg,ZM_cel_ano)
+               h.variables['time'][JS_tim_beg:]=self.ZV_grc_time[JS_tim_beg:]
+          finally:
+               h.close()
+
+     #--------------------------------------------------------------------------
+     #Incremental runs
+     #--------------------------------------------------------------------------
+     def state_key(self,shb_pol_shp,shb_fea_fld=''):
+          """Return a hash of everything a saved state depends on.
+
+          These are the polygons, the grid and the options of the selection
+          (see shbaam_cell.cell_key()), the scale factors and their mask, and
+          the baseline period.
+          """
+          with fiona.open(shb_pol_shp,'r') as shb_pol_lay:
+               YS_cel_key=shbaam_cell.cell_key(self.ZV_grc_lon,self.ZV_grc_lat,\
+                                               shb_pol_lay,                    \
+                                               self.YS_cel_mod+'/'             \
+                                               +self.YS_are_mod+'/'            \
+                                               +shb_fea_fld)
+          shb_sta_hsh=hashlib.sha1()
+          shb_sta_hsh.update(YS_cel_key.encode('ascii'))
+          shb_sta_hsh.update(repr((float(self.ZS_bas_beg),                     \
+                                   float(self.ZS_bas_end))).encode('ascii'))
+          shb_sta_hsh.update(numpy.ascontiguousarray(self.ZM_grc_scl,          \
+                                                     dtype=numpy.float64))
+          shb_sta_hsh.update(numpy.ascontiguousarray(self.ZM_grc_msk))
+          return shb_sta_hsh.hexdigest()
+
+     def write_state(self,shb_res,shb_sta_npz,YS_sta_key):
+          """Save the cells, mean and weights of a result, with its times."""
+          shbaam_npzf.write_npz(shb_sta_npz,                                   \
+                     YS_sta_key=numpy.array(YS_sta_key),                       \
+                     YV_fea_nam=numpy.array(shb_res['YV_fea_nam'],dtype=str),  \
+                     ZV_grc_time=self.ZV_grc_time,                             \
+                     **dict((YS_var,shb_res[YS_var]) for YS_var in YV_sta_var))
+
+     def read_state(self,shb_sta_npz,YS_sta_key,shb_fea_fld=''):
+          """Return the result saved for a shapefile, or None if not usable.
+
+          The state is not usable if missing, if its key is not YS_sta_key
+          (see state_key()), or if the time steps it was saved with are not
+          the first time steps of the GRACE data.
+          """
+          shb_sta_dat=shbaam_npzf.read_npz(shb_sta_npz)
+          if shb_sta_dat is None                                               \
+             or str(shb_sta_dat['YS_sta_key'])!=YS_sta_key:
+               return None
+          ZV_sta_time=shb_sta_dat['ZV_grc_time']
+          if len(ZV_sta_time)>len(self.ZV_grc_time)                            \
+             or not numpy.array_equal(ZV_sta_time,                             \
+                                      self.ZV_grc_time[:len(ZV_sta_time)]):
+               return None
+
+          shb_res=dict((YS_var,shb_sta_dat[YS_var]) for YS_var in YV_sta_var)
+          shb_res['IS_fea_tot']=len(shb_res['ZV_fea_sqm'])
+          shb_res['YV_fea_nam']=[str(x) for x in shb_sta_dat['YV_fea_nam']]
+          shb_res['shb_fea_fld']=shb_fea_fld
+          shb_res['IS_tim_sta']=len(ZV_sta_time)
+          return shb_res
+
+     def output_steps(self,shb_wsa_csv,shb_wsa_ncf='',shb_fea_fld=''):
+          """Return the numbers of time steps of the CSV file and of the map.
+
+          The number of the map is None if there is no map.
+          """
+          with open(shb_wsa_csv,'rb') as csvfile:
+               IS_csv=sum(1 for YV_row in csv.reader(csvfile))
+          if shb_fea_fld!='':
+               IS_csv=IS_csv-1
+          #The first row of batch mode holds the names of the features
+          IS_ncf=None
+          if shb_wsa_ncf!='':
+               with netCDF4.Dataset(shb_wsa_ncf,'r') as h:
+                    IS_ncf=len(h.dimensions['time'])
+          return IS_csv,IS_ncf
+
+     def update(self,shb_pol_shp,shb_sta_npz,shb_wsa_csv,shb_wsa_ncf='',       \
+                shb_fea_fld=''):
+          """Compute and write the anomalies of the time steps not yet done.
+
+          The cells, long-term mean and weights of the shapefile are saved in
+          shb_sta_npz by the first run. The following runs only read the time
+          steps added to the GRACE data since then, and append them to the
+          CSV file and map. The anomalies of all time steps are therefore
+          relative to the mean of the record of the first run, or to the
+          baseline period if given. Everything is computed again if the state
+          is not usable, or if an output is missing or does not have the time
+          steps of the state, e.g. when a previous run stopped between the
+          writing of the outputs and that of the state. Returns the result,
+          see run().
+          """
+          YS_sta_key=self.state_key(shb_pol_shp,shb_fea_fld)
+          shb_res=None
+          if os.path.isfile(shb_wsa_csv)                                       \
+             and (shb_wsa_ncf=='' or os.path.isfile(shb_wsa_ncf)):
+               shb_res=self.read_state(shb_sta_npz,YS_sta_key,shb_fea_fld)
+          if shb_res is not None:
+               IS_csv,IS_ncf=self.output_steps(shb_wsa_csv,shb_wsa_ncf,        \
+                                               shb_fea_fld)
+               if IS_csv!=shb_res['IS_tim_sta']                                \
+                  or (IS_ncf is not None and IS_ncf!=shb_res['IS_tim_sta']):
+                    print(' - The outputs do not match the state')
+                    shb_res=None
+          #The state is written after the outputs, an interrupted update
+          #leaves outputs longer than the state, which are written again
+
+          if shb_res is None:
+               print(' - No usable state, all time steps are computed')
+               shb_res=self.run(shb_pol_shp,shb_fea_fld)
+          else:
+               print(' - The number of time steps already computed is: '       \
+                     +str(shb_res['IS_tim_sta']))
+               self.anomalies(shb_res,shb_res['IS_tim_sta'])
+
+          if shb_res['JS_tim_beg']==0 or len(shb_res['ZM_wsa'])>0:
+               self.write_csv(shb_res,shb_wsa_csv)
+               if shb_wsa_ncf!='':
+                    self.write_map(shb_res,shb_wsa_ncf)
+               self.write_state(shb_res,shb_sta_npz,YS_sta_key)
+          return shb_res
+
+     #--------------------------------------------------------------------------
+     #Close
+     #--------------------------------------------------------------------------
+     def close(self):
+          """Close the netCDF files."""
+          self.f.close()
+          self.g.close()
+
+     def __enter__(self):
+          return self
+
+     def __exit__(self,*args):
+          self.close()
+
+
+#*******************************************************************************
+#End
+#*******************************************************************************
@@ -6,7 +6,10 @@
 #Purpose:
 #Given and model name, a start date, an end date, and a folder path, this script
 #downloads LDAS data from GES-DISC using the NASA EarthData credentials stored
-#locally in '~/.netrc' file.
+#locally in '~/.netrc' file. The files can be downloaded concurrently by a given
+#number of workers sharing the same networking session, and interrupted
+#downloads are resumed when the script is run again. The URL of the service can
+#be given as an optional argument, e.g. to use a local stand-in server.
 #Author:
 #Cedric H. David, 2018-2018
 
@@ -17,7 +20,9 @@
 import sys
 import os.path
 import datetime
+import multiprocessing.pool
 import requests
+import shbaam_http
 
 
 #*******************************************************************************
@@ -27,14 +32,16 @@ import requests
 # 2 - rrr_iso_beg
 # 3 - rrr_iso_end
 # 4 - rrr_lsm_dir
+# 5 - IS_wrk (optional, number of concurrent downloads, 1 by default)
+# 6 - rrr_lsm_url (optional, URL of the subsetting service)
 
 
 #*******************************************************************************
 #Get command line arguments
 #*******************************************************************************
 IS_arg=len(sys.argv)
-if IS_arg != 5:
-     print('ERROR - 4 and only 4 arguments can be used')
+if IS_arg < 5 or IS_arg > 7:
+     print('ERROR - A minimum of 4 and a maximum of 6 arguments can be used')
      raise SystemExit(22) 
 
 rrr_lsm_mod=sys.argv[1]
@@ -42,6 +49,15 @@ rrr_iso_beg=sys.argv[2]
 rrr_iso_end=sys.argv[3]
 rrr_lsm_dir=sys.argv[4]
 
+IS_wrk=1
+if IS_arg > 5:
+     IS_wrk=int(sys.argv[5])
+
+rrr_lsm_url='https://hydro1.gesdisc.eosdis.nasa.gov/daac-bin/OTF/'            \
+           +'HTTP_services.cgi'
+if IS_arg > 6:
+     rrr_lsm_url=sys.argv[6]
+
 
 #*******************************************************************************
 #Print input information
@@ -51,6 +67,8 @@ print('- '+rrr_lsm_mod)
 print('- '+rrr_iso_beg)
 print('- '+rrr_iso_end)
 print('- '+rrr_lsm_dir)
+print('- '+str(IS_wrk))
+print('- '+rrr_lsm_url)
 
 
 #*******************************************************************************
@@ -75,6 +93,12 @@ else:
      print('ERROR - Invalid model name')
      raise SystemExit(22) 
 
+if IS_wrk>=1:
+     print('- Number of concurrent downloads is valid')
+else:
+     print('ERROR - Invalid number of concurrent downloads')
+     raise SystemExit(22) 
+
 
 #*******************************************************************************
 #Check temporal information
@@ -134,7 +158,7 @@ print('- The credentials were obtained from ~/.netrc file')
 
 print('Checking that service and credentials work for one known file')
 
-url='https://hydro1.gesdisc.eosdis.nasa.gov/daac-bin/OTF/HTTP_services.cgi'
+url=rrr_lsm_url
 payload={}
 payload['FILENAME']='/data/GLDAS_V1/GLDAS_VIC10_M/2000/'                       \
                    +'GLDAS_VIC10_M.A200001.001.grb'
@@ -188,9 +212,7 @@ print('Downloading all files')
 #-------------------------------------------------------------------------------
 print('- Creating a networking session and assigning associated credentials')
 
-s=requests.Session()
-s.max_redirects=200
-s.auth=cred
+s=shbaam_http.session(cred,IS_wrk)
 
      
 #-------------------------------------------------------------------------------
@@ -202,7 +224,7 @@ s.auth=cred
 #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 print('- Initializing URL and payload')
 
-url='https://hydro1.gesdisc.eosdis.nasa.gov/daac-bin/OTF/HTTP_services.cgi'
+url=rrr_lsm_url
 payload={}
 payload['FILENAME']='/data/GLDAS_V1/GLDAS_VIC10_M/2000/'                       \
                    +'GLDAS_VIC10_M.A200001.001.grb'
@@ -220,6 +242,8 @@ payload['VARIABLES']='SWE,SoilM1,SoilMoist1,Canint,Canopint'
 #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 print('- Looping over all files')
 
+YV_fut=[]
+shb_wrk=multiprocessing.pool.ThreadPool(IS_wrk)
 rrr_dat_cur=rrr_dat_beg
 for JS_count in range(IS_count):
      # - + - + - + - + - + - + - + - + - + - + - + - + - + - + - + - + - + - + -
@@ -253,22 +277,32 @@ for JS_count in range(IS_count):
           print(' . Skipping '+payload['LABEL'])
      else:
           print(' . Downloading '+payload['LABEL'])
-          r=s.get(url, params=payload)
-          if not r.ok:
-               print('ERROR - status code '+str(r.status_code)+                \
-                     'returned when downloading '+payload['FILENAME'])
-               raise SystemExit(22)
-          YS_name=r.headers['content-disposition']
-          YS_name=YS_name.replace('attachment; filename=','')
-          YS_name=YS_name.replace('"','')
-          #The file name is extracted directly from requests.get() results
-          open(rrr_lsm_dir+YS_dir+YS_name, 'wb').write(r.content)
-          #The file is written on local disk
+          YV_fut.append(shb_wrk.apply_async(shbaam_http.download,             \
+                                            (s,url,dict(payload),              \
+                                             rrr_lsm_dir+YS_dir,               \
+                                             payload['LABEL'])))
+          #The file is streamed to a temporary file that is renamed once
+          #complete, its name is extracted from the content-disposition
      # - + - + - + - + - + - + - + - + - + - + - + - + - + - + - + - + - + - + -
      #Increment current datetime
      # - + - + - + - + - + - + - + - + - + - + - + - + - + - + - + - + - + - + -
      rrr_dat_cur=(rrr_dat_cur+datetime.timedelta(days=32)).replace(day=1)
-     
+
+#- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#Waiting for all downloads
+#- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+print('- Waiting for all downloads')
+
+IS_err=0
+for shb_fut in YV_fut:
+     try:
+          print(' . Downloaded '+os.path.basename(shb_fut.get()))
+     except IOError as e:
+          print('ERROR - '+str(e))
+          IS_err=IS_err+1
+shb_wrk.close()
+shb_wrk.join()
+
 #-------------------------------------------------------------------------------
 #Closing the networking session
 #-------------------------------------------------------------------------------
@@ -276,6 +310,10 @@ print('- Closing the networking session')
 
 s.close()
 
+if IS_err>0:
+     print('ERROR - '+str(IS_err)+' files could not be downloaded')
+     raise SystemExit(22)
+
 
 #*******************************************************************************
 #End
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+#*******************************************************************************
+#shbaam_ncdf.py
+#*******************************************************************************
+
+#Purpose:
+#Write the values of a set of grid cells to a (time,lat,lon) netCDF variable
+#with bulk hyperslab writes. The values of a chunk of time steps are assembled
+#in memory within the smallest lat/lon window that contains all grid cells, and
+#this window is written with one single call to the netCDF library. The grid
+#cells outside of the window are left to the fill value of the variable. Grid
+#cells that straddle the end of the longitudes (e.g. 0/360 degrees) are covered
+#by two windows, one at each end.
+#The map variables can be created in the classic netCDF format or in the
+#netCDF4/HDF5 format, the latter with compression and with chunks that are
+#either time-major (one map per chunk, fast to read one time step) or
+#cell-major (a full time series of a small tile per chunk, fast to read the
+#time series of one grid cell).
+
+
+#*******************************************************************************
+#Import Python modules
+#*******************************************************************************
+import numpy
+import shbaam_anom
+
+
+#*******************************************************************************
+#Options for the creation of map variables
+#*******************************************************************************
+def variable_options(YS_ncf_fmt,YS_ncf_chk,IS_time,IS_lat,IS_lon):
+     """Return the keyword arguments of createVariable() for a map variable.
+
+     YS_ncf_fmt is the format of the netCDF file, and YS_ncf_chk is either
+     'time' for time-major chunks or 'cell' for cell-major chunks. Compression
+     and chunking are only available with the netCDF4/HDF5 formats.
+     """
+     if YS_ncf_fmt!='NETCDF4' and YS_ncf_fmt!='NETCDF4_CLASSIC':
+          return {}
+
+     if YS_ncf_chk=='time':
+          IV_chk=(1,max(IS_lat,1),max(IS_lon,1))
+     elif YS_ncf_chk=='cell':
+          IV_chk=(max(IS_time,1),min(max(IS_lat,1),16),min(max(IS_lon,1),16))
+     else:
+          raise ValueError('Invalid chunk shape: '+YS_ncf_chk)
+
+     return {'zlib': True, 'shuffle': True, 'complevel': 4,                    \
+             'chunksizes': IV_chk}
+
+
+#*******************************************************************************
+#Window covering a set of grid cells
+#*******************************************************************************
+def cell_window(IV_cel_lat,IV_cel_lon,IS_lon):
+     """Return (lat_beg,lat_end,lon_beg,lon_end) covering the given cells.
+
+     The longitudes are periodic with IS_lon values. If the cells straddle the
+     end of the grid (see shbaam_anom.cell_windows()), the window starts near
+     the end of the grid and continues from its start, lon_end being then
+     larger than IS_lon: the longitude indices of the window are those of
+     numpy.arange(lon_beg,lon_end)%IS_lon, see window_lon().
+     """
+     (JS_lat_beg,JS_lat_end),YV_lon_win=shbaam_anom.cell_windows(IV_cel_lat,  \
+                                                                 IV_cel_lon,  \
+                                                                 IS_lon)
+     JS_lon_beg=YV_lon_win[0][0]
+     JS_lon_end=YV_lon_win[-1][1]
+     if len(YV_lon_win)>1:
+          JS_lon_end=JS_lon_end+IS_lon
+     return JS_lat_beg,JS_lat_end,JS_lon_beg,JS_lon_end
+
+
+def window_lon(ZV_lon,JS_lon_beg,JS_lon_end):
+     """Return the longitudes of a window of cell_window().
+
+     The longitudes taken again from the start of the grid are increased by
+     360 degrees, so that they keep increasing across the end of the grid.
+     """
+     IV_lon=numpy.arange(JS_lon_beg,JS_lon_end)
+     IS_lon=len(ZV_lon)
+     return numpy.asarray(ZV_lon)[IV_lon%IS_lon]+360.0*(IV_lon//IS_lon)
+
+
+#*******************************************************************************
+#Write a (time,cell) block
+#*******************************************************************************
+def write_block(ZV_out,JS_beg,ZM_cel_var,IV_cel_lat,IV_cel_lon):
+     """Write the (time,cell) block ZM_cel_var to ZV_out starting at JS_beg.
+
+     The block is scattered into masked (time,lat,lon) windows, those of
+     shbaam_anom.cell_windows(), and each window is written at once, the
+     masked values becoming fill values. The cells that straddle the end of
+     the longitudes of ZV_out are written as two windows, one at each end.
+     """
+     if len(IV_cel_lat)==0:
+          return
+     IV_cel_lat=numpy.asarray(IV_cel_lat,dtype=numpy.int64)
+     IV_cel_lon=numpy.asarray(IV_cel_lon,dtype=numpy.int64)
+     IS_lon=ZV_out.shape[-1]
+     (JS_lat_beg,JS_lat_end),YV_lon_win=shbaam_anom.cell_windows(IV_cel_lat,  \
+                                                                 IV_cel_lon,  \
+                                                                 IS_lon)
+     IS_time=ZM_cel_var.shape[0]
+     for JS_lon_beg,JS_lon_end in YV_lon_win:
+          IV_sel=(IV_cel_lon>=JS_lon_beg)&(IV_cel_lon<JS_lon_end)
+          ZM_win=numpy.ma.masked_all((IS_time,JS_lat_end-JS_lat_beg,          \
+                                              JS_lon_end-JS_lon_beg),         \
+                                     dtype=ZV_out.dtype)
+          ZM_win[:,IV_cel_lat[IV_sel]-JS_lat_beg,                              \
+                   IV_cel_lon[IV_sel]-JS_lon_beg]=ZM_cel_var[:,IV_sel]
+          ZV_out[JS_beg:JS_beg+IS_time,JS_lat_beg:JS_lat_end,                  \
+                                       JS_lon_beg:JS_lon_end]=ZM_win
+
+
+#*******************************************************************************
+#End
+#*******************************************************************************
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+#*******************************************************************************
+#shbaam_npzf.py
+#*******************************************************************************
+
+#Purpose:
+#Read and write the .npz files in which the SHBAAM tools keep arrays from one
+#run to the next: the cache of grid cells (shbaam_cell.py), the baseline means
+#(shbaam_base.py) and the state of incremental runs (shbaam_jobs.py). A file is
+#written through a temporary file in the same folder that is then renamed, so
+#that concurrent runs never read a partial file.
+
+
+#*******************************************************************************
+#Import Python modules
+#*******************************************************************************
+import os
+import os.path
+import tempfile
+import numpy
+
+
+#*******************************************************************************
+#Read a file
+#*******************************************************************************
+def read_npz(shb_fil_npz):
+     """Return the arrays of a .npz file as a dict, or None if missing."""
+     if not os.path.isfile(shb_fil_npz):
+          return None
+     with numpy.load(shb_fil_npz) as shb_fil_dat:
+          return dict((YS_var,shb_fil_dat[YS_var]) for YS_var in shb_fil_dat)
+
+
+#*******************************************************************************
+#Write a file
+#*******************************************************************************
+def write_npz(shb_fil_npz,**shb_fil_dat):
+     """Write arrays to a .npz file, through a temporary file and a rename."""
+     shb_fil_dir=os.path.dirname(os.path.abspath(shb_fil_npz))
+     shb_tmp_fid,shb_tmp_npz=tempfile.mkstemp(suffix='.npz',dir=shb_fil_dir)
+     with os.fdopen(shb_tmp_fid,'wb') as shb_tmp_fil:
+          numpy.savez(shb_tmp_fil,**shb_fil_dat)
+     os.rename(shb_tmp_npz,shb_fil_npz)
+     #The rename is atomic, concurrent runs never see a partial file
+
+
+#*******************************************************************************
+#End
+#*******************************************************************************
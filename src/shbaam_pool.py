@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+#*******************************************************************************
+#shbaam_pool.py
+#*******************************************************************************
+
+#Purpose:
+#Compute Terrestrial Water Storage Anomalies from GRACE for many shapefiles in
+#parallel. The GRACE data is read only once and stored in a read-only
+#memory-mapped file that is shared by a pool of worker processes. Each worker
+#opens a TWSAJob (see shbaam_jobs.py) over this file once, then only selects
+#the grid cells of one shapefile at a time and aggregates the anomalies over
+#them, and produces the same CSV time series and netCDF map as shbaam_twsa.py,
+#named after the shapefile in an output folder. The options of the selection of
+#grid cells, of batch mode, of the chunks of time steps, of the maps, of the
+#baseline period and of the time window are those of shbaam_twsa.py and are
+#used by all workers.
+
+
+#*******************************************************************************
+#Import Python modules
+#*******************************************************************************
+import sys
+import os.path
+import tempfile
+import shutil
+import multiprocessing
+import numpy
+import shbaam_jobs
+
+
+#*******************************************************************************
+#Declaration of variables (given as command line arguments)
+#*******************************************************************************
+# 1 - shb_grc_ncf
+# 2 - shb_fct_ncf
+# 3 - shb_out_dir
+# 4 - IS_wrk (number of worker processes, 0 for the number of processors)
+# 5 - shb_cel_dir (use '' to disable the cache of grid cells)
+# 6 - shb_cel_mod ('center' or 'fraction', see shbaam_twsa.py)
+# 7 - shb_fea_fld (use '' to merge all features into one domain, or the name
+#     of the attribute that identifies each feature for batch mode)
+# 8 - IS_tim_chk (number of time steps read at once, 0 for all)
+# 9 - shb_are_mod (Earth model for the areas of grid cells: 'sphere' or
+#     'wgs84')
+#10 - shb_ncf_fmt (format of the maps: 'NETCDF3_CLASSIC', or 'NETCDF4'/
+#     'NETCDF4_CLASSIC' which are compressed)
+#11 - shb_ncf_chk (chunks of compressed maps: 'time' or 'cell')
+#12 - shb_ncf_crp (True to crop the maps to the domains)
+#13 - ZS_bas_beg (start of the baseline period in decimal years, use 0 along
+#     with ZS_bas_end for the mean of the time window)
+#14 - ZS_bas_end (end of the baseline period in decimal years)
+#15 - shb_bas_dir (folder of the baseline files, use '' for the folder of
+#     shb_grc_ncf)
+#16 - shb_dat_beg (first date of the time window as YYYY-MM-DD, use '' for
+#     the beginning of the record)
+#17 - shb_dat_end (last date of the time window as YYYY-MM-DD, use '' for the
+#     end of the record)
+#18+- shb_pol_shp (one or more shapefiles)
+
+
+#*******************************************************************************
+#Job of each worker process
+#*******************************************************************************
+shb_wrk_job={}
+#The job opened by the worker process, kept open for all the basins it
+#processes
+
+
+def open_job(shb_opt,shb_lwe_npy=''):
+     """Return a TWSAJob with the options shb_opt, see shbaam_jobs.py."""
+     return shbaam_jobs.TWSAJob(shb_opt['shb_grc_ncf'],shb_opt['shb_fct_ncf'],\
+                                shb_opt['shb_cel_dir'],shb_opt['shb_cel_mod'], \
+                                shb_opt['shb_are_mod'],shb_opt['IS_tim_chk'],  \
+                                ZS_bas_beg=shb_opt['ZS_bas_beg'],              \
+                                ZS_bas_end=shb_opt['ZS_bas_end'],              \
+                                shb_bas_dir=shb_opt['shb_bas_dir'],            \
+                                YS_dat_beg=shb_opt['shb_dat_beg'],             \
+                                YS_dat_end=shb_opt['shb_dat_end'],             \
+                                YS_ncf_fmt=shb_opt['shb_ncf_fmt'],             \
+                                YS_ncf_chk=shb_opt['shb_ncf_chk'],             \
+                                ZB_ncf_crp=shb_opt['shb_ncf_crp'],             \
+                                shb_lwe_npy=shb_lwe_npy)
+
+
+#*******************************************************************************
+#Compute and write the anomalies for one basin
+#*******************************************************************************
+def run_basin(shb_lwe_npy,shb_pol_shp,shb_out_dir,shb_opt):
+     """Compute the anomalies of one shapefile and write its CSV and map.
+
+     The options shb_opt are a dict with the input files and the options of
+     shbaam_twsa.py, see main(). The job over the memory-mapped GRACE data
+     shb_lwe_npy is opened once per worker process and kept open for all the
+     basins processed by this worker.
+     """
+     if shb_wrk_job.get('shb_lwe_npy')!=shb_lwe_npy:
+          if 'shb_job' in shb_wrk_job:
+               shb_wrk_job['shb_job'].close()
+          shb_wrk_job.clear()
+          shb_wrk_job['shb_job']=open_job(shb_opt,shb_lwe_npy)
+          shb_wrk_job['shb_lwe_npy']=shb_lwe_npy
+     shb_job=shb_wrk_job['shb_job']
+
+     YS_bas=os.path.splitext(os.path.basename(shb_pol_shp))[0]
+     shb_wsa_csv=os.path.join(shb_out_dir,'timeseries_'+YS_bas+'.csv')
+     shb_wsa_ncf=os.path.join(shb_out_dir,'map_'+YS_bas+'.nc')
+
+     shb_res=shb_job.run(shb_pol_shp,shb_opt['shb_fea_fld'])
+     shb_job.write_csv(shb_res,shb_wsa_csv)
+     shb_job.write_map(shb_res,shb_wsa_ncf)
+
+     return YS_bas,len(shb_res['IV_dom_lon']),numpy.sum(shb_res['ZV_fea_sqm'])
+
+
+#*******************************************************************************
+#Main
+#*******************************************************************************
+def main():
+     IS_arg=len(sys.argv)
+     if IS_arg < 19:
+          print('ERROR - A minimum of 18 arguments must be used')
+          raise SystemExit(22)
+
+     shb_out_dir=sys.argv[3]
+     IS_wrk=int(sys.argv[4])
+     shb_opt={'shb_grc_ncf': sys.argv[1],                                      \
+              'shb_fct_ncf': sys.argv[2],                                      \
+              'shb_cel_dir': sys.argv[5],                                      \
+              'shb_cel_mod': sys.argv[6],                                      \
+              'shb_fea_fld': sys.argv[7],                                      \
+              'IS_tim_chk': int(sys.argv[8]),                                  \
+              'shb_are_mod': sys.argv[9],                                      \
+              'shb_ncf_fmt': sys.argv[10],                                     \
+              'shb_ncf_chk': sys.argv[11],                                     \
+              'shb_ncf_crp': sys.argv[12]=='True',                             \
+              'ZS_bas_beg': float(sys.argv[13]),                               \
+              'ZS_bas_end': float(sys.argv[14]),                               \
+              'shb_bas_dir': sys.argv[15],                                     \
+              'shb_dat_beg': sys.argv[16],                                     \
+              'shb_dat_end': sys.argv[17]}
+     YV_pol_shp=sys.argv[18:]
+
+     print('Command line inputs')
+     print(' - '+shb_opt['shb_grc_ncf'])
+     print(' - '+shb_opt['shb_fct_ncf'])
+     print(' - '+shb_out_dir)
+     print(' - '+str(IS_wrk))
+     for YS_opt in ['shb_cel_dir','shb_cel_mod','shb_fea_fld','IS_tim_chk',    \
+                    'shb_are_mod','shb_ncf_fmt','shb_ncf_chk','shb_ncf_crp',   \
+                    'ZS_bas_beg','ZS_bas_end','shb_bas_dir','shb_dat_beg',     \
+                    'shb_dat_end']:
+          print(' - '+str(shb_opt[YS_opt]))
+     print(' - '+str(len(YV_pol_shp))+' shapefiles')
+
+     for shb_fil in [shb_opt['shb_grc_ncf'],shb_opt['shb_fct_ncf']]+YV_pol_shp:
+          try:
+               with open(shb_fil) as file:
+                    pass
+          except IOError as e:
+               print('ERROR - Unable to open '+shb_fil)
+               raise SystemExit(22)
+
+     if shb_opt['shb_cel_mod'] not in ['center','fraction']:
+          print('ERROR - The cell mode must be center or fraction')
+          raise SystemExit(22)
+
+     if shb_opt['shb_are_mod'] not in ['sphere','wgs84']:
+          print('ERROR - The area model must be sphere or wgs84')
+          raise SystemExit(22)
+
+     if not os.path.isdir(shb_out_dir):
+          os.makedirs(shb_out_dir)
+
+     if IS_wrk<=0:
+          IS_wrk=multiprocessing.cpu_count()
+
+     print('Load GRACE data into a memory-mapped file')
+     shb_mmp_dir=tempfile.mkdtemp(dir=shb_out_dir)
+     try:
+          shb_lwe_npy=os.path.join(shb_mmp_dir,'lwe_thickness.npy')
+          try:
+               with open_job(shb_opt) as shb_job:
+                    shb_job.save_grace(shb_lwe_npy)
+          except (IOError,ValueError) as e:
+               print('ERROR - '+str(e))
+               raise SystemExit(22)
+          #The baseline file, if any, is also written once here and only
+          #looked up by the workers
+
+          print('Compute anomalies for all shapefiles with '+str(IS_wrk)      \
+                +' workers')
+          IS_err=0
+          shb_wrk=multiprocessing.Pool(IS_wrk)
+          try:
+               YV_res=[(shb_pol_shp,                                           \
+                        shb_wrk.apply_async(run_basin,(shb_lwe_npy,shb_pol_shp,\
+                                                       shb_out_dir,shb_opt)))  \
+                       for shb_pol_shp in YV_pol_shp]
+               for shb_pol_shp,shb_res in YV_res:
+                    try:
+                         YS_bas,IS_dom_tot,ZS_sqm=shb_res.get()
+                         print(' - '+YS_bas+': '+str(IS_dom_tot)             \
+                               +' grid cells, '+str(ZS_sqm)+' m2')
+                    except Exception as e:
+                         print('ERROR - '+shb_pol_shp+': '+str(e))
+                         IS_err=IS_err+1
+          finally:
+               shb_wrk.close()
+               shb_wrk.join()
+     finally:
+          shutil.rmtree(shb_mmp_dir)
+
+     if IS_err>0:
+          print('ERROR - '+str(IS_err)+' shapefiles failed')
+          raise SystemExit(22)
+
+
+if __name__ == '__main__':
+     main()
+
+
+#*******************************************************************************
+#End
+#*******************************************************************************
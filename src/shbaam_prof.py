@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+#*******************************************************************************
+#shbaam_prof.py
+#*******************************************************************************
+
+#Purpose:
+#Record the cost of each stage of a SHBAAM script: the wall-clock time, the CPU
+#time (user and system), the peak resident set size of the process at the end
+#of the stage, the number of bytes read from the netCDF datasets that are
+#watched (see shbaam_dset.py) and the number of bytes written to the output
+#files that are watched (the growth of their sizes on disk). A script starts
+#each stage by giving its name, the previous stage being ended at that time.
+#The stages are saved in a JSON report, and the whole run can also be profiled
+#with cProfile, the statistics being dumped to a file that can be read with the
+#pstats module. Profiling is disabled when no file name is given, in which case
+#all calls return immediately.
+
+
+#*******************************************************************************
+#Import Python modules
+#*******************************************************************************
+import sys
+import os
+import json
+import timeit
+import cProfile
+try:
+     import resource
+except ImportError:
+     resource=None
+#The resource module is not available on Windows, peak memory is then unknown
+
+
+#*******************************************************************************
+#Peak resident set size
+#*******************************************************************************
+def peak_rss():
+     """Return the peak resident set size (bytes) of the process, or None."""
+     if resource is None:
+          return None
+     IS_rss=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+     if sys.platform=='darwin':
+          return int(IS_rss)
+     return int(IS_rss)*1024
+     #ru_maxrss is given in bytes on macOS and in kilobytes on Linux
+
+
+#*******************************************************************************
+#CPU time
+#*******************************************************************************
+def cpu_time():
+     """Return the user and system CPU time (s) used by the process so far."""
+     YV_tim=os.times()
+     return YV_tim[0]+YV_tim[1]
+
+
+#*******************************************************************************
+#Profiler of the stages of a script
+#*******************************************************************************
+class StageProfiler(object):
+     """The stages of a script, with their costs.
+
+     Profiling is enabled if shb_prf_jsn (the JSON report) or shb_prf_dmp (the
+     cProfile statistics) is not empty.
+     """
+
+     def __init__(self,shb_prf_jsn='',shb_prf_dmp='',YS_scr=''):
+          self.shb_prf_jsn=shb_prf_jsn
+          self.shb_prf_dmp=shb_prf_dmp
+          self.YS_scr=YS_scr
+          self.enabled=(shb_prf_jsn!='' or shb_prf_dmp!='')
+          self.YV_stg=[]
+          self._dst=[]
+          self._out=[]
+          self._cur=None
+          self._prf=None
+          if self.enabled:
+               self._tic=self._sample()
+               self._beg=self._tic
+          if shb_prf_dmp!='':
+               self._prf=cProfile.Profile()
+               self._prf.enable()
+
+     def watch(self,shb_dst):
+          """Count the bytes read from a GridDataset (see shbaam_dset.py)."""
+          if self.enabled:
+               self._dst.append(shb_dst)
+
+     def output(self,shb_out_fil):
+          """Count the growth of the size of an output file as bytes written.
+
+          The file should be given once created, as the sizes of the previous
+          versions of an output file are not known.
+          """
+          if self.enabled and shb_out_fil!='':
+               self._out.append(shb_out_fil)
+
+     def _sample(self):
+          IS_rd_byt=sum(shb_dst.IS_rd_byt for shb_dst in self._dst)
+          IS_wr_byt=sum(os.path.getsize(shb_out_fil)                           \
+                        for shb_out_fil in self._out                           \
+                        if os.path.isfile(shb_out_fil))
+          return {'wall': timeit.default_timer(), 'cpu': cpu_time(),           \
+                  'read': IS_rd_byt, 'write': IS_wr_byt}
+
+     def stage(self,YS_stg):
+          """End the current stage, if any, and start the stage YS_stg."""
+          if not self.enabled:
+               return
+          self.stop()
+          self._cur=YS_stg
+          self._tic=self._sample()
+
+     def stop(self):
+          """End the current stage, if any."""
+          if not self.enabled or self._cur is None:
+               return
+          YD_toc=self._sample()
+          self.YV_stg.append({'stage': self._cur,                              \
+                              'wall_time': YD_toc['wall']-self._tic['wall'],   \
+                              'cpu_time': YD_toc['cpu']-self._tic['cpu'],      \
+                              'peak_rss': peak_rss(),                          \
+                              'bytes_read': YD_toc['read']-self._tic['read'],  \
+                              'bytes_written': YD_toc['write']                 \
+                                              -self._tic['write']})
+          self._cur=None
+
+     def write(self):
+          """End the current stage and write the report and the statistics."""
+          if not self.enabled:
+               return
+          self.stop()
+          if self._prf is not None:
+               self._prf.disable()
+               self._prf.dump_stats(self.shb_prf_dmp)
+               print(' - The cProfile statistics were written in: '            \
+                     +self.shb_prf_dmp)
+          if self.shb_prf_jsn!='':
+               YD_toc=self._sample()
+               YD_prf={'script': self.YS_scr,                                  \
+                       'wall_time': YD_toc['wall']-self._beg['wall'],          \
+                       'cpu_time': YD_toc['cpu']-self._beg['cpu'],             \
+                       'peak_rss': peak_rss(),                                 \
+                       'stages': self.YV_stg}
+               with open(self.shb_prf_jsn,'w') as shb_prf:
+                    json.dump(YD_prf,shb_prf,indent=1)
+               print(' - The profile of the stages was written in: '           \
+                     +self.shb_prf_jsn)
+
+
+#*******************************************************************************
+#End
+#*******************************************************************************
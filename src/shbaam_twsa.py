@@ -22,16 +22,12 @@
 #*******************************************************************************
 import sys
 import os.path
-import subprocess
-import netCDF4
 import numpy
-import datetime
 import fiona
-import shapely.geometry
-import shapely.prepared
-import rtree
-import math
-import csv
+import shbaam_cell
+import shbaam_anom
+import shbaam_jobs
+import shbaam_prof
 
 
 #*******************************************************************************
@@ -40,9 +36,36 @@ import csv
 # 1 - shb_grc_ncf
 # 2 - shb_fct_ncf
 # 3 - shb_pol_shp
-# 4 - shb_pnt_shp
+# 4 - shb_pnt_shp (optional, use '' to skip the creation of this shapefile)
 # 5 - shb_wsa_csv
 # 6 - shb_wsa_ncf
+#(7)- shb_cel_dir (optional, use '' to disable the cache of grid cells)
+#(8)- shb_cel_mod (optional, 'center' to select the grid cells whose centers are
+#     within the polygon, or 'fraction' to weigh all overlapping cells by the
+#     fraction of their area that is within the polygon)
+#(9)- shb_fea_fld (optional, use '' to merge all features into one domain, or
+#     the name of the attribute that identifies each feature for batch mode)
+#(10)-IS_tim_chk (optional, number of time steps read at once, 0 for all)
+#(11)-shb_ncf_fmt (optional, format of shb_wsa_ncf: 'NETCDF3_CLASSIC', or
+#     'NETCDF4'/'NETCDF4_CLASSIC' which are compressed)
+#(12)-shb_ncf_chk (optional, chunks of compressed maps: 'time' for time-major or
+#     'cell' for cell-major)
+#(13)-shb_ncf_crp (optional, True to crop the map to the domain)
+#(14)-shb_are_mod (optional, Earth model for the areas of grid cells: 'sphere'
+#     or 'wgs84')
+#(15)-shb_prf_jsn (optional, JSON report with the wall time, CPU time, peak
+#     memory and netCDF bytes read/written of each stage, use '' to skip)
+#(16)-shb_prf_dmp (optional, cProfile statistics of the run, use '' to skip)
+#(17)-ZS_bas_beg (optional, start of the baseline period in decimal years, e.g.
+#     2004.0, use 0 along with ZS_bas_end for the mean of the time window)
+#(18)-ZS_bas_end (optional, end of the baseline period in decimal years, e.g.
+#     2009.999)
+#(19)-shb_bas_dir (optional, folder of the baseline files, use '' for the
+#     folder of shb_grc_ncf)
+#(20)-shb_dat_beg (optional, first date of the time window as YYYY-MM-DD, use
+#     '' for the beginning of the record)
+#(21)-shb_dat_end (optional, last date of the time window as YYYY-MM-DD, use
+#     '' for the end of the record)
 
 
 #*******************************************************************************
@@ -56,9 +79,24 @@ import csv
 shb_grc_ncf='input/GRACE/GRCTellus.JPL.200204_201608.GLO.RL05M_1.MSCNv02CRIv02.nc'
 shb_fct_ncf='input/GRACE/CLM4.SCALE_FACTOR.JPL.MSCNv01CRIv01.nc'
 shb_pol_shp='input/SERVIR_STK/NorthWestBD.shp'
-shb_pnt_shp='output/SERVIR_STK/GRCTellus.JPL.pnt_tst.shp'
+shb_pnt_shp=''
 shb_wsa_csv='output/SERVIR_STK/timeseries_NorthWestBD_tst.csv'
 shb_wsa_ncf='output/SERVIR_STK/map_NorthWestBD_tst.nc'
+shb_cel_dir=''
+shb_cel_mod='center'
+shb_fea_fld=''
+IS_tim_chk=0
+shb_ncf_fmt='NETCDF3_CLASSIC'
+shb_ncf_chk='time'
+shb_ncf_crp=False
+shb_are_mod='sphere'
+shb_prf_jsn=''
+shb_prf_dmp=''
+ZS_bas_beg=0
+ZS_bas_end=0
+shb_bas_dir=''
+shb_dat_beg=''
+shb_dat_end=''
 
 
 #*******************************************************************************
@@ -71,6 +109,21 @@ print(' - '+shb_pol_shp)
 print(' - '+shb_pnt_shp)
 print(' - '+shb_wsa_csv)
 print(' - '+shb_wsa_ncf)
+print(' - '+shb_cel_dir)
+print(' - '+shb_cel_mod)
+print(' - '+shb_fea_fld)
+print(' - '+str(IS_tim_chk))
+print(' - '+shb_ncf_fmt)
+print(' - '+shb_ncf_chk)
+print(' - '+str(shb_ncf_crp))
+print(' - '+shb_are_mod)
+print(' - '+shb_prf_jsn)
+print(' - '+shb_prf_dmp)
+print(' - '+str(ZS_bas_beg))
+print(' - '+str(ZS_bas_end))
+print(' - '+shb_bas_dir)
+print(' - '+shb_dat_beg)
+print(' - '+shb_dat_end)
 
 
 #*******************************************************************************
@@ -99,33 +152,71 @@ except IOError as e:
 
 
 #*******************************************************************************
-#Read GRACE netCDF file
+#Start profiling (optional)
 #*******************************************************************************
-print('Read GRACE netCDF file')
+shb_prf=shbaam_prof.StageProfiler(shb_prf_jsn,shb_prf_dmp,'shbaam_twsa.py')
+#Each of the following stages is timed if shb_prf_jsn or shb_prf_dmp is given
+
+
+#*******************************************************************************
+#Read GRACE and scale factors netCDF files
+#*******************************************************************************
+print('Read GRACE and scale factors netCDF files')
+shb_prf.stage('read_grace')
 
 #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-#Open netCDF file
+#Open netCDF files
 #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-f = netCDF4.Dataset(shb_grc_ncf, 'r')
+try:
+     shb_job=shbaam_jobs.TWSAJob(shb_grc_ncf,shb_fct_ncf,shb_cel_dir,          \
+                                 shb_cel_mod,shb_are_mod,IS_tim_chk,           \
+                                 ZS_bas_beg=ZS_bas_beg,ZS_bas_end=ZS_bas_end,  \
+                                 shb_bas_dir=shb_bas_dir,                      \
+                                 YS_dat_beg=shb_dat_beg,                       \
+                                 YS_dat_end=shb_dat_end,                       \
+                                 YS_ncf_fmt=shb_ncf_fmt,                       \
+                                 YS_ncf_chk=shb_ncf_chk,                       \
+                                 ZB_ncf_crp=shb_ncf_crp)
+except (IOError,ValueError) as e:
+     print('ERROR - '+str(e))
+     raise SystemExit(22)
+f=shb_job.f
+g=shb_job.g
+shb_prf.watch(f)
+shb_prf.watch(g)
+#The computation is that of shbaam_jobs.py, each of its steps being one of the
+#following stages. The job checks that the grids of both files are consistent,
+#reads the coordinates, time, fill value and scale factors once, and computes
+#the baseline mean of all grid cells if a baseline period is given. The GRACE
+#data can also be given as the .json index of several netCDF files, and is read
+#from its cell-major cache if one was written by shbaam_cmaj.py. The calls made
+#to the netCDF library are counted.
+
+if shb_dat_beg!='' or shb_dat_end!='':
+     JS_tim_beg=int(numpy.searchsorted(f.ZV_tim_rec,f.ZV_time[0]))
+     print(' - The time window is: '+str(JS_tim_beg)+'-'                      \
+           +str(JS_tim_beg+f.IS_time))
+#The dates are resolved to a range of time steps from the time already loaded,
+#only these time steps are read afterwards.
 
 #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 #Get dimension sizes
 #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-IS_grc_lon=len(f.dimensions['lon'])
+IS_grc_lon=f.IS_lon
 print(' - The number of longitudes is: '+str(IS_grc_lon))
 
-IS_grc_lat=len(f.dimensions['lat'])
+IS_grc_lat=f.IS_lat
 print(' - The number of latitudes is: '+str(IS_grc_lat))
 
-IS_grc_time=len(f.dimensions['time'])
+IS_grc_time=f.IS_time
 print(' - The number of time steps is: '+str(IS_grc_time))
 
 #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 #Get values of dimension arrays
 #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-ZV_grc_lon=f.variables['lon']
-ZV_grc_lat=f.variables['lat']
-ZV_grc_time=f.variables['time']
+ZV_grc_lon=shb_job.ZV_grc_lon
+ZV_grc_lat=shb_job.ZV_grc_lat
+ZV_grc_time=shb_job.ZV_grc_time
 
 #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 #Get the interval sizes
@@ -146,62 +237,9 @@ else:
 #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 #Get fill values
 #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-ZS_grc_fil=netCDF4.default_fillvals['f4']
-if 'RUNSF' in f.variables:
-     var=f.variables['RUNSF']
-     if '_FillValue' in  var.ncattrs(): 
-          ZS_grc_fil=var._FillValue
-          print(' - The fill value for RUNSF is: '+str(ZS_grc_fil))
-     else:
-          ZS_grc_fil=None
-     
-
-#*******************************************************************************
-#Read scale factors netCDF file
-#*******************************************************************************
-print('Read scale factors netCDF file')
-
-#- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-#Open netCDF file
-#- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-g= netCDF4.Dataset(shb_fct_ncf, 'r')
-
-#- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-#Get dimension sizes
-#- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-IS_fct_lon=len(g.dimensions['lon'])
-print(' - The number of longitudes is: '+str(IS_fct_lon))
-
-IS_fct_lat=len(g.dimensions['lat'])
-print(' - The number of latitudes is: '+str(IS_fct_lat))
-
-#- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-#Get values of dimension arrays
-#- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-ZV_fct_lon=g.variables['lon']
-ZV_fct_lat=g.variables['lat']
-
-
-#*******************************************************************************
-#Check consistency between netCDF files
-#*******************************************************************************
-print('Check consistency between netCDF files')
-
-if (IS_fct_lon != IS_grc_lon):
-     print('ERROR - The number of longitudes differ')
-     raise SystemExit(22) 
-
-if not (ZV_fct_lon[:] == ZV_grc_lon[:]).all():
-     print('ERROR - The values of longitudes differ')
-     raise SystemExit(22) 
-
-if (IS_fct_lat != IS_grc_lat):
-     print('ERROR - The number of latitudes differ')
-     raise SystemExit(22) 
-
-if not (ZV_fct_lat[:] == ZV_grc_lat[:]).all():
-     print('ERROR - The values of latitudes differ')
-     raise SystemExit(22) 
+ZS_grc_fil=f.ZS_fil
+if 'RUNSF' in f.variables and ZS_grc_fil is not None:
+     print(' - The fill value for RUNSF is: '+str(ZS_grc_fil))
 
 print(' - The files are consistent')
 
@@ -210,6 +248,7 @@ print(' - The files are consistent')
 #Read polygon shapefile
 #*******************************************************************************
 print('Read polygon shapefile')
+shb_prf.stage('read_polygons')
 
 shb_pol_lay=fiona.open(shb_pol_shp, 'r')
 IS_pol_tot=len(shb_pol_lay)
@@ -217,316 +256,132 @@ print(' - The number of polygon features is: '+str(IS_pol_tot))
 
 
 #*******************************************************************************
-#Create a point shapefile with all the GRACE grid cells
+#Create a point shapefile with all the GRACE grid cells (optional)
 #*******************************************************************************
-print('Create a point shapefile with all the GRACE grid cells')
-
-shb_pol_drv=shb_pol_lay.driver
-shb_pnt_drv=shb_pol_drv
-
-shb_pol_crs=shb_pol_lay.crs
-shb_pnt_crs=shb_pol_crs.copy()
-
-shb_pnt_sch={'geometry': 'Point',                                              \
-             'properties': {'JS_grc_lon': 'int:4',                             \
-                            'JS_grc_lat': 'int:4'}}
+if shb_pnt_shp!='':
+     print('Create a point shapefile with all the GRACE grid cells')
+     shb_prf.stage('point_shapefile')
+     shbaam_cell.write_point_shapefile(shb_pnt_shp,ZV_grc_lon,ZV_grc_lat,      \
+                                       shb_pol_lay)
+     print(' - New shapefile created')
 
-with fiona.open(shb_pnt_shp,'w',driver=shb_pnt_drv,                            \
-                                crs=shb_pnt_crs,                               \
-                                schema=shb_pnt_sch) as shb_pnt_lay:
-     for JS_grc_lon in range(IS_grc_lon):
-          ZS_grc_lon=ZV_grc_lon[JS_grc_lon]
-          if (ZS_grc_lon > 180):
-               ZS_grc_lon=ZS_grc_lon-360
-               #Shift GRACE longitude range from [0;360] to [-180;180]
-          for JS_grc_lat in range(IS_grc_lat):
-               ZS_grc_lat=ZV_grc_lat[JS_grc_lat]
-               shb_pnt_prp={'JS_grc_lon': JS_grc_lon, 'JS_grc_lat': JS_grc_lat}
-               shb_pnt_geo=shapely.geometry.mapping(                           \
-                                shapely.geometry.Point((ZS_grc_lon,ZS_grc_lat)))
-               shb_pnt_lay.write({                                             \
-                                  'properties': shb_pnt_prp,                   \
-                                  'geometry': shb_pnt_geo,                     \
-                                  })
-
-print(' - New shapefile created')
-
-
-#*******************************************************************************
-#Create spatial index for the bounds of each point feature
-#*******************************************************************************
-print('Create spatial index for the bounds of each point feature')
-
-shb_pnt_lay=fiona.open(shb_pnt_shp, 'r')
-
-index=rtree.index.Index()
-for shb_pnt_fea in shb_pnt_lay:
-     shb_pnt_fid=int(shb_pnt_fea['id'])
-     #the first argument of index.insert has to be 'int', not 'long' or 'str'
-     shb_pnt_shy=shapely.geometry.shape(shb_pnt_fea['geometry'])
-     index.insert(shb_pnt_fid, shb_pnt_shy.bounds)
-     #creates an index between the feature ID and the bounds of that feature
-
-print(' - Spatial index created')
+shb_pol_lay.close()
 
 
 #*******************************************************************************
 #Find GRACE grid cells that intersect with polygon
 #*******************************************************************************
 print('Find GRACE grid cells that intersect with polygon')
+shb_prf.stage('selection')
+
+shb_res=shb_job.cells(shb_pol_shp,shb_fea_fld)
+IS_dom_tot=len(shb_res['IV_dom_lon'])
+#The grid cells within the bounding box of each polygon are tested all at once,
+#without the need for a point shapefile or spatial index. The surface area of
+#each cell is the area within the polygon, i.e. the full area of the cell if
+#shb_cel_mod is 'center' and the overlapping area if it is 'fraction'.
+#The cells found and their surface areas are cached if shb_cel_dir is given.
+#The areas of the cells are looked up per latitude in shbaam_grid.py, for the
+#Earth model shb_are_mod.
 
-IS_dom_tot=0
-IV_dom_lon=[]
-IV_dom_lat=[]
-
-for shb_pol_fea in shb_pol_lay:
-     shb_pol_shy=shapely.geometry.shape(shb_pol_fea['geometry'])
-     shb_pol_pre=shapely.prepared.prep(shb_pol_shy)
-     #a 'prepared' geometry allows for faster processing after
-     for shb_pnt_fid in [int(x) for x in                                       \
-                                  list(index.intersection(shb_pol_shy.bounds))]:
-          shb_pnt_fea=shb_pnt_lay[shb_pnt_fid]
-          shb_pnt_shy=shapely.geometry.shape(shb_pnt_fea['geometry'])
-          if shb_pol_pre.contains(shb_pnt_shy):
-               JS_dom_lon=shb_pnt_fea['properties']['JS_grc_lon']
-               JS_dom_lat=shb_pnt_fea['properties']['JS_grc_lat']
-               IV_dom_lon.append(JS_dom_lon)
-               IV_dom_lat.append(JS_dom_lat)
-               IS_dom_tot=IS_dom_tot+1
- 
 print(' - The number of grid cells found is: '+str(IS_dom_tot))
 
+if shb_fea_fld!='':
+     print(' - Batch mode, one time series for each of the features')
+#Otherwise all features are merged into one unique domain
 
-#*******************************************************************************
-#Find long-term mean for each intersecting GRACE grid cell
-#*******************************************************************************
-print('Find long-term mean for each intersecting GRACE grid cell')
+IV_cel_lat=shb_res['IV_cel_lat']
+IV_cel_lon=shb_res['IV_cel_lon']
+IS_cel_tot=len(IV_cel_lat)
+#Each grid cell is only processed once, even if located within several features
 
-ZV_dom_avg=[0]*IS_dom_tot
-for JS_dom_tot in range(IS_dom_tot):
-     JS_grc_lon=IV_dom_lon[JS_dom_tot]
-     JS_grc_lat=IV_dom_lat[JS_dom_tot]
-     for JS_grc_time in range(IS_grc_time):
-          ZV_dom_avg[JS_dom_tot]=ZV_dom_avg[JS_dom_tot]                        \
-                                +f.variables['lwe_thickness']                  \
-                                            [JS_grc_time,JS_grc_lat,JS_grc_lon]
-ZV_dom_avg=[x/IS_grc_time for x in ZV_dom_avg]
+print(' - The number of unique grid cells is: '+str(IS_cel_tot))
 
 
 #*******************************************************************************
-#Compute surface area of each grid cell
+#Find long-term mean for each intersecting GRACE grid cell
 #*******************************************************************************
-print('Compute surface area of each grid cell')
+print('Find long-term mean for each intersecting GRACE grid cell')
+shb_prf.stage('mean')
+
+ZM_cel_lwe=shb_job.mean(shb_res)
+#The time steps are read in chunks of IS_tim_chk with one single call to the
+#netCDF library each, and the (time,cell) block of the domain is extracted from
+#them, this is much faster than reading values one by one. The mean over a
+#baseline period is looked up in the baseline file instead.
 
-ZV_dom_sqm=[0]*IS_dom_tot
-for JS_dom_tot in range(IS_dom_tot):
-     JS_grc_lat=IV_dom_lat[JS_dom_tot]
-     ZS_grc_lat=ZV_grc_lat[JS_grc_lat]
-     ZV_dom_sqm[JS_dom_tot]=6371000*math.radians(ZS_grc_lat_stp)               \
-                           *6371000*math.radians(ZS_grc_lon_stp)               \
-                           *math.cos(math.radians(ZS_grc_lat))
+print(' - The number of time steps per chunk is: '                             \
+      +str(shbaam_anom.time_chunks(IS_grc_time,IS_tim_chk)[0][1]))
 
 
 #*******************************************************************************
 # Find number of NoData points in scale factors for shapefile and area
 #*******************************************************************************
 print('Find number of NoData points in scale factors for shapefile and area')
+shb_prf.stage('scale_factors')
 
-ZM_grc_scl=g.variables['scale_factor'][:,:]
-IS_dom_msk=0
-ZS_sqm=0
-for JS_dom_tot in range(IS_dom_tot):
-     JS_grc_lon=IV_dom_lon[JS_dom_tot]
-     JS_grc_lat=IV_dom_lat[JS_dom_tot]
-     if (ZM_grc_scl.mask[JS_grc_lat,JS_grc_lon]):
-          IS_dom_msk=IS_dom_msk+1
-     else:
-          ZS_sqm=ZS_sqm+ZV_dom_sqm[JS_dom_tot]
+shb_job.weights(shb_res)
+#Sparse (feature,cell) matrix of the product of scale factors and cell areas,
+#divided by the area of each feature without NoData points. It is built once
+#and applied to all time steps. The conversions of GRACE data from cm to m
+#and back to cm cancel out and are not made.
+
+ZV_cel_msk=shb_job.ZM_grc_msk[IV_cel_lat,IV_cel_lon]
+IS_dom_msk=int(numpy.sum(ZV_cel_msk[shb_res['IV_dom_cel']]))
+ZS_sqm=numpy.sum(shb_res['ZV_fea_sqm'])
 
 print(' - The number of NoData points found is: '+str(IS_dom_msk))
 print(' - The area (m2) for the domain is: '+str(ZS_sqm))
 
 
 #*******************************************************************************
-#Compute total terrestrial water storage anomaly timeseries
+#Create shb_wsa_ncf
 #*******************************************************************************
-print('Compute total terrestrial water storage anomaly timeseries')
+print('Create shb_wsa_ncf')
+shb_prf.stage('create_netcdf')
 
-ZV_wsa=[]
-for JS_grc_time in range(IS_grc_time):
-     ZS_wsa=0
-     for JS_dom_tot in range(IS_dom_tot):
-          JS_grc_lon=IV_dom_lon[JS_dom_tot]
-          JS_grc_lat=IV_dom_lat[JS_dom_tot]
-          ZS_dom_sqm=ZV_dom_sqm[JS_dom_tot]
-          ZS_dom_avg=ZV_dom_avg[JS_dom_tot]
-          if (ZM_grc_scl.mask[JS_grc_lat,JS_grc_lon]):
-               ZS_dom_scl=0
-          else:
-               ZS_dom_scl=ZM_grc_scl[JS_grc_lat,JS_grc_lon]
-          ZS_dom_wsa=( f.variables['lwe_thickness']                            \
-                                  [JS_grc_time,JS_grc_lat,JS_grc_lon]          \
-                      -ZS_dom_avg                                    )/100     \
-                    *  ZS_dom_scl                                              \
-                    *  ZS_dom_sqm
-                    #The division by 100 is to go from cm to m in GRACE data.
-          ZS_wsa=ZS_wsa+ZS_dom_wsa
-     ZV_wsa.append(100*ZS_wsa/ZS_sqm)
+h=shb_job.create_map(shb_res,shb_wsa_ncf)
+shb_prf.output(shb_wsa_ncf)
+#The map is either global or cropped to the window covering the domain, in the
+#format and with the chunks given. In batch mode, it has the time series of the
+#features instead. The attributes of the GRACE data are copied. The map is
+#created before the anomalies are computed, so that the anomalies of each chunk
+#of time steps are written as soon as they are computed.
 
 
 #*******************************************************************************
-#Determine time strings
+#Compute total terrestrial water storage anomaly timeseries
 #*******************************************************************************
-print('Determine time strings')
-shb_dat_str=datetime.datetime.strptime('2002-01-01T00:00:00',                \
-                                         '%Y-%m-%dT%H:%M:%S')
+print('Compute total terrestrial water storage anomaly timeseries')
+shb_prf.stage('anomaly')
 
-YV_grc_time=[]
-for JS_grc_time in range(IS_grc_time):
-     shb_dat_dlt=datetime.timedelta(days=ZV_grc_time[JS_grc_time])
-     YS_grc_time=(shb_dat_str+shb_dat_dlt).strftime('%m/%d/%Y')
-     YV_grc_time.append(YS_grc_time)
+shb_job.anomalies(shb_res,0,ZM_cel_lwe,h)
+ZM_wsa=shb_res['ZM_wsa']
+#The anomalies of each chunk of time steps are written at once for all grid
+#cells, using the smallest lat/lon window covering the domain, so that GRACE
+#data is not read again for the map. Features without any valid grid cell have
+#no data (NaN).
 
 
 #*******************************************************************************
 #Write shb_wsa_csv
 #*******************************************************************************
 print('Write shb_wsa_csv')
+shb_prf.stage('write_csv')
 
-with open(shb_wsa_csv, 'wb') as csvfile:
-     #csvwriter = csv.writer(csvfile, dialect='excel', quotechar="'",           \
-     #                       quoting=csv.QUOTE_NONNUMERIC)
-     csvwriter = csv.writer(csvfile, dialect='excel')
-     for JS_grc_time in range(IS_grc_time):
-          IV_line=[YV_grc_time[JS_grc_time],ZV_wsa[JS_grc_time]] 
-          csvwriter.writerow(IV_line) 
+open(shb_wsa_csv,'wb').close()
+shb_prf.output(shb_wsa_csv)
+shb_job.write_csv(shb_res,shb_wsa_csv)
+#The file is created empty first, so that all the bytes written are counted.
+#The dates are decoded using the units and calendar of the time. In batch mode,
+#the file has one column for each feature.
 
 
 #*******************************************************************************
 #Write shb_wsa_ncf
 #*******************************************************************************
 print('Write shb_wsa_ncf')
-
-#-------------------------------------------------------------------------------
-#Create netCDF file
-#-------------------------------------------------------------------------------
-print('- Create netCDF file')
-
-h = netCDF4.Dataset(shb_wsa_ncf, 'w', format="NETCDF3_CLASSIC")
-
-time = h.createDimension("time", None)
-lat = h.createDimension("lat", IS_grc_lat)
-lon = h.createDimension("lon", IS_grc_lon)
-nv = h.createDimension("nv", 2)
-
-time = h.createVariable("time","i4",("time",))
-time_bnds = h.createVariable("time_bnds","i4",("time","nv",))
-lat = h.createVariable("lat","f4",("lat",))
-lon = h.createVariable("lon","f4",("lon",))
-lwe_thickness = h.createVariable("lwe_thickness","f4",("time","lat","lon",),   \
-                                 fill_value=ZS_grc_fil)
-crs = h.createVariable("crs","i4")
-
-#-------------------------------------------------------------------------------
-#Metadata in netCDF global attributes
-#-------------------------------------------------------------------------------
-print('- Populate global attributes')
-
-dt=datetime.datetime.utcnow()
-dt=dt.replace(microsecond=0)
-#Current UTC time without the microseconds 
-vsn=subprocess.Popen('bash ../version.sh',                                     \
-                     stdout=subprocess.PIPE,shell=True).communicate()
-vsn=vsn[0]
-vsn=vsn.rstrip()
-#Version of SHBAAM
-
-h.Conventions='CF-1.6'
-h.title=''
-h.institution=''
-h.source='SHBAAM: '+vsn+', GRACE: '+os.path.basename(shb_grc_ncf)             \
-                      +', Scale factors: '+os.path.basename(shb_fct_ncf)
-h.history='date created: '+dt.isoformat()+'+00:00'
-h.references='https://github.com/c-h-david/shbaam/'
-h.comment=''
-h.featureType='timeSeries'
-
-#-------------------------------------------------------------------------------
-#Metadata in netCDF variable attributes
-#-------------------------------------------------------------------------------
-print('- Copy existing variable attributes')
-
-if 'time' in f.variables:
-     var=f.variables['time']
-     if 'standard_name' in  var.ncattrs(): time.standard_name=var.standard_name
-     if 'long_name' in var.ncattrs(): time.long_name=var.long_name
-     if 'units' in var.ncattrs(): time.units=var.units
-     if 'axis' in var.ncattrs(): time.axis=var.axis
-     if 'calendar' in var.ncattrs(): time.calendar=var.calendar
-     if 'bounds' in var.ncattrs(): time.bounds=var.bounds
-
-if 'lat' in f.variables:
-     var=f.variables['lat']
-     if 'standard_name' in  var.ncattrs(): lat.standard_name=var.standard_name
-     if 'long_name' in  var.ncattrs(): lat.long_name=var.long_name
-     if 'units' in  var.ncattrs(): lat.units=var.units
-     if 'axis' in  var.ncattrs(): lat.axis=var.axis
-
-if 'lon' in f.variables:
-     var=f.variables['lon']
-     if 'standard_name' in  var.ncattrs(): lon.standard_name=var.standard_name
-     if 'long_name' in  var.ncattrs(): lon.long_name=var.long_name
-     if 'units' in  var.ncattrs(): lon.units=var.units
-     if 'axis' in  var.ncattrs(): lon.axis=var.axis
-
-if 'lwe_thickness' in f.variables: 
-     var=f.variables['lwe_thickness']
-     if 'standard_name' in var.ncattrs(): lwe_thickness.standard_name=var.standard_name
-     if 'long_name' in var.ncattrs(): lwe_thickness.long_name=var.long_name
-     if 'units' in var.ncattrs(): lwe_thickness.units=var.units
-     if 'units' in var.ncattrs(): lwe_thickness.coordinates=var.coordinates
-     if 'grid_mapping' in var.ncattrs(): lwe_thickness.grid_mapping=var.grid_mapping
-     if 'cell_methods' in var.ncattrs(): lwe_thickness.cell_methods=var.cell_methods
-
-if 'crs' in f.variables: 
-     var=f.variables['crs']
-     if 'grid_mapping_name' in var.ncattrs(): crs.grid_mapping_name=var.grid_mapping_name
-     if 'semi_major_axis' in var.ncattrs(): crs.semi_major_axis=var.semi_major_axis
-     if 'inverse_flattening' in var.ncattrs(): crs.inverse_flattening=var.inverse_flattening
-
-print('- Modify CRS variable attributes')
-lwe_thickness.grid_mapping='crs'
-crs.grid_mapping_name='latitude_longitude'
-crs.semi_major_axis='6378137'
-crs.inverse_flattening='298.257223563' 
-#These are for the WGS84 spheroid
-
-#-------------------------------------------------------------------------------
-#Populate static data
-#-------------------------------------------------------------------------------
-print('- Populate static data')
-
-lon[:]=ZV_grc_lon[:]
-lat[:]=ZV_grc_lat[:]
-#Coordinates
-
-#-------------------------------------------------------------------------------
-#Populate dynamic data
-#-------------------------------------------------------------------------------
-print('- Populate dynamic data')
-
-for JS_dom_tot in range(IS_dom_tot):
-     JS_grc_lon=IV_dom_lon[JS_dom_tot]
-     JS_grc_lat=IV_dom_lat[JS_dom_tot]
-     ZS_dom_avg=ZV_dom_avg[JS_dom_tot]
-     if (ZM_grc_scl.mask[JS_grc_lat,JS_grc_lon]):
-          ZS_dom_scl=0
-     else:
-          ZS_dom_scl=ZM_grc_scl[JS_grc_lat,JS_grc_lon]
-     for JS_grc_time in range(IS_grc_time):
-          lwe_thickness[JS_grc_time,JS_grc_lat,JS_grc_lon] = f.variables['lwe_thickness'][JS_grc_time,JS_grc_lat,JS_grc_lon] - ZS_dom_avg
-
-time[:]=f.variables['time'][:]
+shb_prf.stage('write_netcdf')
 
 
 #*******************************************************************************
@@ -534,9 +389,14 @@ time[:]=f.variables['time'][:]
 #*******************************************************************************
 print('Close netCDF files')
 
-f.close()
-g.close()
+print(' - The number of netCDF reads is: '                                     \
+      +str(f.IS_rd_cnt+g.IS_rd_cnt))
+print(' - The number of bytes read is: '                                       \
+      +str(f.IS_rd_byt+g.IS_rd_byt))
+shb_job.close()
 h.close()
+shb_prf.stop()
+#The values still buffered by the netCDF library are written when closing
 
 
 #*******************************************************************************
@@ -544,9 +404,23 @@ h.close()
 #*******************************************************************************
 print('Check some computations')
 
-print('- Average of time series: '+str(numpy.average(ZV_wsa)))
-print('- Maximum of time series: '+str(numpy.max(ZV_wsa)))
-print('- Minimum of time series: '+str(numpy.min(ZV_wsa)))
+IS_fea_nan=int(numpy.sum(numpy.all(numpy.isnan(ZM_wsa),axis=0)))
+if IS_fea_nan>0:
+     print('- The number of features without valid grid cells is: '           \
+           +str(IS_fea_nan))
+#The time series of these features are NaN, they are ignored below
+
+print('- Average of time series: '+str(numpy.nanmean(ZM_wsa)))
+print('- Maximum of time series: '+str(numpy.nanmax(ZM_wsa)))
+print('- Minimum of time series: '+str(numpy.nanmin(ZM_wsa)))
+
+
+#*******************************************************************************
+#Write profile (optional)
+#*******************************************************************************
+if shb_prf.enabled:
+     print('Write profile')
+     shb_prf.write()
 
 
 #*******************************************************************************
@@ -0,0 +1,339 @@
+#!/usr/bin/env python
+#*******************************************************************************
+#shbaam_vrtl.py
+#*******************************************************************************
+
+#Purpose:
+#Read many netCDF files (e.g. the monthly files of LDAS) as if they were one
+#dataset concatenated along the time dimension, without making a merged copy.
+#A small JSON sidecar index lists the member files and maps each global time
+#index to a member file and a local time index within this file. The member
+#files are opened lazily when their values are read, and at most a given
+#number of them are kept open at once, the least recently used being closed
+#first. Given a list of netCDF files and the name of an index file, this script
+#creates the index, which can then be given to shbaam_twsa.py or shbaam_brian.py
+#instead of a netCDF file.
+
+
+#*******************************************************************************
+#Import Python modules
+#*******************************************************************************
+import sys
+import os.path
+import json
+import collections
+import netCDF4
+import numpy
+import shbaam_conc
+
+
+#*******************************************************************************
+#Declaration of variables (given as command line arguments)
+#*******************************************************************************
+# 1 - shb_ncf_fil (one or more netCDF files)
+# 2 - shb_idx_fil (the index file to be created)
+
+
+#*******************************************************************************
+#Create an index
+#*******************************************************************************
+def write_index(YV_ncf_fil,shb_idx_fil):
+     """Create the index of the given netCDF files, sorted by name.
+
+     The files are checked for consistency and their time values converted to
+     the units of the first file, as done by shbaam_conc.py. The paths of the
+     files are stored relative to the directory of the index.
+     """
+     YV_ncf_fil=sorted(YV_ncf_fil)
+     ZV_tim=shbaam_conc.validate_netCDF4(YV_ncf_fil)
+     with netCDF4.Dataset(YV_ncf_fil[0],'r') as f:
+          YS_tim_unt=f.variables['time'].units
+          YS_tim_cal=getattr(f.variables['time'],'calendar','standard')
+
+     shb_idx_dir=os.path.dirname(os.path.abspath(shb_idx_fil))
+     YD_idx={}
+     YD_idx['units']=YS_tim_unt
+     YD_idx['calendar']=YS_tim_cal
+     YD_idx['files']=[os.path.relpath(os.path.abspath(shb_ncf_fil),            \
+                                      shb_idx_dir)                             \
+                      for shb_ncf_fil in YV_ncf_fil]
+     YD_idx['time']=[float(ZS_tim) for ZV_fil in ZV_tim for ZS_tim in ZV_fil]
+     YD_idx['file']=[JS_fil for JS_fil in range(len(ZV_tim))                   \
+                            for JS_loc in range(len(ZV_tim[JS_fil]))]
+     YD_idx['local']=[JS_loc for JS_fil in range(len(ZV_tim))                  \
+                             for JS_loc in range(len(ZV_tim[JS_fil]))]
+
+     with open(shb_idx_fil,'w') as shb_idx:
+          json.dump(YD_idx,shb_idx)
+
+
+#*******************************************************************************
+#Member files of an index
+#*******************************************************************************
+def member_files(shb_idx_fil):
+     """Return the paths of the member files of an index, in time order."""
+     with open(shb_idx_fil,'r') as shb_idx:
+          YD_idx=json.load(shb_idx)
+     shb_idx_dir=os.path.dirname(os.path.abspath(shb_idx_fil))
+     return [os.path.join(shb_idx_dir,shb_ncf_fil)                            \
+             for shb_ncf_fil in YD_idx['files']]
+
+
+#*******************************************************************************
+#Hash of a netCDF file or an index
+#*******************************************************************************
+def update_hash(shb_hsh,shb_ncf_fil):
+     """Add the path, size and modification time of a file to a hash.
+
+     Those of the member files of a .json index are added as well, so that
+     replacing a member file in place changes the hash. The hash is a
+     hashlib object, e.g. that of the name of a file derived from shb_ncf_fil.
+     """
+     YV_ncf_fil=[shb_ncf_fil]
+     if shb_ncf_fil.endswith('.json'):
+          YV_ncf_fil=YV_ncf_fil+member_files(shb_ncf_fil)
+     for shb_fil in YV_ncf_fil:
+          shb_fil_sta=os.stat(shb_fil)
+          for YS_val in [os.path.abspath(shb_fil),str(shb_fil_sta.st_size),    \
+                         str(shb_fil_sta.st_mtime)]:
+               shb_hsh.update((YS_val+'\n').encode('utf-8'))
+
+
+#*******************************************************************************
+#Open a netCDF file or an index
+#*******************************************************************************
+def open_dataset(shb_ncf_fil,IS_lru=16):
+     """Return a VirtualDataset for a .json index, or a netCDF4.Dataset."""
+     if shb_ncf_fil.endswith('.json'):
+          return VirtualDataset(shb_ncf_fil,IS_lru)
+     return netCDF4.Dataset(shb_ncf_fil,'r')
+
+
+#*******************************************************************************
+#Virtual dimension
+#*******************************************************************************
+class VirtualDimension(object):
+     """The time dimension of a virtual dataset."""
+
+     def __init__(self,name,IS_len):
+          self.name=name
+          self.size=IS_len
+
+     def __len__(self):
+          return self.size
+
+     def isunlimited(self):
+          return True
+
+
+#*******************************************************************************
+#Virtual variable
+#*******************************************************************************
+class VirtualVariable(object):
+     """A variable of a virtual dataset, read from the member files.
+
+     Variables that do not depend on time are read from the first member
+     file. The time variable holds the values of the index. Variables whose
+     first dimension is time are read from the member files holding the time
+     steps requested, with one read for each run of consecutive time steps
+     within a member file.
+     """
+
+     def __init__(self,shb_vrt,var):
+          self._vrt=shb_vrt
+          self._attrs=collections.OrderedDict((YS_att,var.getncattr(YS_att))  \
+                                              for YS_att in var.ncattrs())
+          self.name=var.name
+          self.dimensions=var.dimensions
+          self.dtype=var.dtype
+          self.datatype=var.datatype
+          self._tim=(var.dimensions[:1]==('time',))
+          if self._tim:
+               self.shape=(len(shb_vrt.ZV_tim),)+var.shape[1:]
+          else:
+               self.shape=var.shape
+          if self.name=='time':
+               self._attrs['units']=shb_vrt.YS_tim_unt
+               self._attrs['calendar']=shb_vrt.YS_tim_cal
+
+     def __getattr__(self,name):
+          if name.startswith('_') and name!='_FillValue':
+               raise AttributeError(name)
+          try:
+               return self._attrs[name]
+          except KeyError:
+               raise AttributeError(name)
+
+     def ncattrs(self):
+          return list(self._attrs.keys())
+
+     def getncattr(self,name):
+          return self._attrs[name]
+
+     def __len__(self):
+          return self.shape[0]
+
+     @property
+     def ndim(self):
+          return len(self.shape)
+
+     def __getitem__(self,key):
+          if not isinstance(key,tuple):
+               key=(key,)
+          if not self._tim:
+               return self._vrt.member(0).variables[self.name][key]
+          if self.name=='time':
+               return numpy.ma.masked_array(self._vrt.ZV_tim)[key]
+
+          if len(key)>0 and key[0] is Ellipsis:
+               key=(slice(None),)+(slice(None),)*(len(self.shape)-len(key))    \
+                  +key[1:]
+          YS_tim=key[0] if len(key)>0 else slice(None)
+          key_oth=key[1:]
+          IS_tim=len(self._vrt.ZV_tim)
+          if isinstance(YS_tim,slice):
+               IV_tim=numpy.arange(*YS_tim.indices(IS_tim))
+          else:
+               IV_tim=numpy.atleast_1d(numpy.asarray(YS_tim,dtype=numpy.int64))
+               IV_tim=numpy.where(IV_tim<0,IV_tim+IS_tim,IV_tim)
+               if IV_tim.size>0 and (IV_tim.min()<0 or IV_tim.max()>=IS_tim):
+                    raise IndexError('Time index out of range')
+
+          IV_fil=self._vrt.IV_fil[IV_tim]
+          IV_loc=self._vrt.IV_loc[IV_tim]
+          if numpy.ndim(YS_tim)==0 and not isinstance(YS_tim,slice):
+               var=self._vrt.member(IV_fil[0]).variables[self.name]
+               return var[(int(IV_loc[0]),)+key_oth]
+          #A single time step is read as is, as from a netCDF file
+
+          YV_blk=[]
+          JS_beg=0
+          while JS_beg<len(IV_tim):
+               JS_end=JS_beg+1
+               while JS_end<len(IV_tim) and IV_fil[JS_end]==IV_fil[JS_beg]    \
+                     and IV_loc[JS_end]==IV_loc[JS_end-1]+1:
+                    JS_end=JS_end+1
+               #Runs of consecutive time steps in the same member file
+               var=self._vrt.member(IV_fil[JS_beg]).variables[self.name]
+               YV_blk.append(numpy.ma.asarray(                                 \
+                    var[(slice(IV_loc[JS_beg],IV_loc[JS_end-1]+1),)+key_oth]))
+               JS_beg=JS_end
+
+          if len(YV_blk)==0:
+               ZM_var=self._vrt.member(0).variables[self.name][(slice(0,0),)   \
+                                                             +key_oth]
+          else:
+               ZM_var=numpy.ma.concatenate(YV_blk,axis=0)
+          return ZM_var
+
+
+#*******************************************************************************
+#Virtual dataset
+#*******************************************************************************
+class VirtualDataset(object):
+     """A read-only dataset made of member files concatenated along time.
+
+     At most IS_lru member files are kept open at once.
+     """
+
+     def __init__(self,shb_idx_fil,IS_lru=16):
+          with open(shb_idx_fil,'r') as shb_idx:
+               YD_idx=json.load(shb_idx)
+          shb_idx_dir=os.path.dirname(os.path.abspath(shb_idx_fil))
+          self.filepath=shb_idx_fil
+          self.YV_ncf_fil=[os.path.join(shb_idx_dir,shb_ncf_fil)              \
+                           for shb_ncf_fil in YD_idx['files']]
+          self.YS_tim_unt=YD_idx['units']
+          self.YS_tim_cal=YD_idx['calendar']
+          self.ZV_tim=numpy.array(YD_idx['time'],dtype=numpy.float64)
+          self.IV_fil=numpy.array(YD_idx['file'],dtype=numpy.int64)
+          self.IV_loc=numpy.array(YD_idx['local'],dtype=numpy.int64)
+          self.IS_lru=max(IS_lru,1)
+          self._handles=collections.OrderedDict()
+
+          f=self.member(0)
+          self._attrs=collections.OrderedDict((YS_att,f.getncattr(YS_att))    \
+                                              for YS_att in f.ncattrs())
+          self.dimensions=collections.OrderedDict()
+          for YS_dim in f.dimensions:
+               if YS_dim=='time':
+                    self.dimensions[YS_dim]=VirtualDimension(YS_dim,           \
+                                                             len(self.ZV_tim))
+               else:
+                    self.dimensions[YS_dim]=f.dimensions[YS_dim]
+          self.variables=collections.OrderedDict()
+          for YS_var in f.variables:
+               self.variables[YS_var]=VirtualVariable(self,f.variables[YS_var])
+
+     def member(self,JS_fil):
+          """Return the open member file JS_fil, opening it if needed."""
+          JS_fil=int(JS_fil)
+          if JS_fil in self._handles:
+               f=self._handles.pop(JS_fil)
+          else:
+               f=netCDF4.Dataset(self.YV_ncf_fil[JS_fil],'r')
+               if len(self._handles)>=self.IS_lru:
+                    self._handles.popitem(last=False)[1].close()
+          self._handles[JS_fil]=f
+          return f
+
+     def __getitem__(self,name):
+          return self.variables[name]
+
+     def __getattr__(self,name):
+          if name.startswith('_'):
+               raise AttributeError(name)
+          try:
+               return self._attrs[name]
+          except KeyError:
+               raise AttributeError(name)
+
+     def ncattrs(self):
+          return list(self._attrs.keys())
+
+     def getncattr(self,name):
+          return self._attrs[name]
+
+     def close(self):
+          while len(self._handles)>0:
+               self._handles.popitem()[1].close()
+
+     def __enter__(self):
+          return self
+
+     def __exit__(self,*args):
+          self.close()
+
+
+#*******************************************************************************
+#Main
+#*******************************************************************************
+def main():
+     IS_arg=len(sys.argv)
+     if IS_arg < 3:
+          print('ERROR - A minimum of 2 arguments must be used')
+          raise SystemExit(22)
+
+     YV_ncf_fil=sys.argv[1:-1]
+     shb_idx_fil=sys.argv[-1]
+
+     print('Command line inputs')
+     print(' - '+str(len(YV_ncf_fil))+' netCDF files')
+     print(' - '+shb_idx_fil)
+
+     if not shb_idx_fil.endswith('.json'):
+          print('ERROR - The name of the index file must end with .json')
+          raise SystemExit(22)
+
+     print('Create index')
+     write_index(YV_ncf_fil,shb_idx_fil)
+     print(' - Done')
+
+
+if __name__ == '__main__':
+     main()
+
+
+#*******************************************************************************
+#End
+#*******************************************************************************
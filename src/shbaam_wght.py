@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+#*******************************************************************************
+#shbaam_wght.py
+#*******************************************************************************
+
+#Purpose:
+#Build and apply sparse weight matrices that map grid cells to features (i.e.
+#the polygons of a shapefile). A weight matrix is stored in coordinate format
+#with three arrays of the same size: the row (feature) index, the column (grid
+#cell) index and the value of each non-zero weight, sorted by row. Applying the
+#matrix to a (time,cell) block gives a (time,feature) block in one operation for
+#all time steps, and allows computing the averages over thousands of features
+#while reading each grid cell only once.
+#The weights of an average can also be normalized when the matrix is built, so
+#that everything that does not depend on time (scale factors, NoData mask, cell
+#areas and the area of each feature) is applied once per matrix rather than at
+#each time step.
+
+
+#*******************************************************************************
+#Import Python modules
+#*******************************************************************************
+import numpy
+
+
+#*******************************************************************************
+#Build a sparse weight matrix
+#*******************************************************************************
+def weight_matrix(IV_wgt_row,IV_wgt_col,ZV_wgt_val,IS_row,IS_col):
+     """Return a sparse weight matrix (IV_row,IV_col,ZV_val) sorted by row.
+
+     Duplicate (row,col) pairs are summed and zero weights are dropped. The
+     number of rows IS_row and columns IS_col are used to validate indices.
+     """
+     IV_wgt_row=numpy.asarray(IV_wgt_row,dtype=numpy.int64)
+     IV_wgt_col=numpy.asarray(IV_wgt_col,dtype=numpy.int64)
+     ZV_wgt_val=numpy.asarray(ZV_wgt_val,dtype=numpy.float64)
+
+     if IV_wgt_row.size>0:
+          if IV_wgt_row.min()<0 or IV_wgt_row.max()>=IS_row:
+               raise ValueError('Row index out of range')
+          if IV_wgt_col.min()<0 or IV_wgt_col.max()>=IS_col:
+               raise ValueError('Column index out of range')
+
+     IV_wgt_lin=IV_wgt_row*IS_col+IV_wgt_col
+     IV_lin,IV_inv=numpy.unique(IV_wgt_lin,return_inverse=True)
+     ZV_val=numpy.bincount(IV_inv.ravel(),weights=ZV_wgt_val,                 \
+                           minlength=len(IV_lin))
+     #numpy.unique sorts by linear index, hence by row then by column
+
+     IV_row=IV_lin//IS_col
+     IV_col=IV_lin%IS_col
+     ZV_msk=(ZV_val!=0)
+     return IV_row[ZV_msk],IV_col[ZV_msk],ZV_val[ZV_msk]
+
+
+#*******************************************************************************
+#Sum of weights for each row
+#*******************************************************************************
+def weight_sum(IV_row,ZV_val,IS_row):
+     """Return the sum of the weights of each row."""
+     return numpy.bincount(IV_row,weights=ZV_val,minlength=IS_row)
+
+
+#*******************************************************************************
+#Apply a sparse weight matrix
+#*******************************************************************************
+def weight_product(ZM_cel,IV_row,IV_col,ZV_val,IS_row):
+     """Return the (time,row) product of a (time,cell) block by the matrix.
+
+     Each value of the output is the sum over the cells of a row of the cell
+     values multiplied by the associated weights. Rows with no weights are 0.
+     """
+     ZM_cel=numpy.ma.filled(ZM_cel,numpy.nan)
+     ZM_cel=numpy.atleast_2d(ZM_cel)
+     ZM_prd=numpy.zeros((ZM_cel.shape[0],IS_row),dtype=numpy.float64)
+     if len(IV_row)==0:
+          return ZM_prd
+
+     IV_ptr=numpy.searchsorted(IV_row,numpy.arange(IS_row+1))
+     ZV_row=(IV_ptr[1:]>IV_ptr[:-1])
+     #Only the rows that have at least one weight are computed
+
+     ZM_prd[:,ZV_row]=numpy.add.reduceat(ZM_cel[:,IV_col]*ZV_val,             \
+                                         IV_ptr[:-1][ZV_row],axis=1)
+     return ZM_prd
+
+
+#*******************************************************************************
+#Build a sparse matrix of normalized weights
+#*******************************************************************************
+def average_weights(IV_dom_fea,IV_dom_cel,ZV_dom_sqm,ZV_cel_scl,ZV_cel_msk,   \
+                    IS_fea_tot):
+     """Return the weight matrix of the scaled area-weighted average of cells.
+
+     IV_dom_fea and IV_dom_cel are the feature and unique cell indices of each
+     selected cell, ZV_dom_sqm its area within the feature, ZV_cel_scl the
+     scale factor of each unique cell and ZV_cel_msk its NoData mask. The
+     weight of a cell is its scale factor times its area divided by the area
+     of its feature without NoData cells, NoData cells having no weight.
+     Returns (IV_row,IV_col,ZV_val,ZV_fea_sqm) with the area of each feature.
+     """
+     ZV_dom_msk=numpy.asarray(ZV_cel_msk,dtype=bool)[IV_dom_cel]
+     ZV_dom_sqm=numpy.where(ZV_dom_msk,0,ZV_dom_sqm)
+     ZV_fea_sqm=weight_sum(IV_dom_fea,ZV_dom_sqm,IS_fea_tot)
+
+     ZV_dom_nrm=ZV_fea_sqm[IV_dom_fea]
+     ZV_dom_wgt=numpy.zeros(len(ZV_dom_sqm),dtype=numpy.float64)
+     ZV_dom_val=(ZV_dom_nrm>0)
+     ZV_dom_wgt[ZV_dom_val]=numpy.asarray(ZV_cel_scl)[IV_dom_cel][ZV_dom_val]  \
+                           *ZV_dom_sqm[ZV_dom_val]/ZV_dom_nrm[ZV_dom_val]
+
+     IV_row,IV_col,ZV_val=weight_matrix(IV_dom_fea,IV_dom_cel,ZV_dom_wgt,      \
+                                        IS_fea_tot,len(ZV_cel_msk))
+     return IV_row,IV_col,ZV_val,ZV_fea_sqm
+
+
+#*******************************************************************************
+#Apply a sparse matrix of normalized weights
+#*******************************************************************************
+def weight_average(ZM_cel,IV_row,IV_col,ZV_val,ZV_fea_sqm):
+     """Return the (time,feature) averages of a (time,cell) block.
+
+     The matrix is that of average_weights(). Features without any valid
+     grid cell (an area of zero) have no data (NaN).
+     """
+     ZM_avg=weight_product(ZM_cel,IV_row,IV_col,ZV_val,len(ZV_fea_sqm))
+     ZM_avg[:,ZV_fea_sqm==0]=numpy.nan
+     return ZM_avg
+
+
+#*******************************************************************************
+#End
+#*******************************************************************************
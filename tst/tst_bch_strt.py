@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+#*******************************************************************************
+#tst_bch_strt.py
+#*******************************************************************************
+
+#Purpose:
+#Measure the startup time of the SHBAAM tools. The unified command shbaam.py is
+#started in new Python processes for each of its subcommands, with no other
+#argument so that it stops right after checking its command line, and the
+#modules it imported are listed to make sure that none of the heavy modules
+#(netCDF4, fiona, shapely, rtree, requests) is imported before a subcommand
+#needs it. The time taken to import each tool module directly is also measured
+#for comparison. The results are saved in a JSON file, and the test fails if
+#the startup of shbaam.py is slower than the given limit or if it imports a
+#heavy module. The scripts that run their computations when imported
+#(shbaam_twsa.py, shbaam_ldas.py) are only measured through shbaam.py.
+
+
+#*******************************************************************************
+#Prerequisites
+#*******************************************************************************
+import sys
+import os.path
+import json
+import subprocess
+import timeit
+
+
+#*******************************************************************************
+#Declaration of variables (given as command line arguments)
+#*******************************************************************************
+# 1 - bch_jsn_fil
+#(2)- maximum startup time of shbaam.py in seconds (default: 1.0)
+#(3)- number of repetitions, the fastest one is kept (default: 5)
+
+
+#*******************************************************************************
+#Get command line arguments
+#*******************************************************************************
+IS_arg=len(sys.argv)
+if IS_arg < 2 or IS_arg > 4:
+     print('ERROR - A minimum of 1 and a maximum of 3 arguments can be used')
+     raise SystemExit(22)
+
+bch_jsn_fil=sys.argv[1]
+ZS_max=float(sys.argv[2]) if IS_arg > 2 else 1.0
+IS_rep=int(sys.argv[3]) if IS_arg > 3 else 5
+
+
+#*******************************************************************************
+#Print current variables
+#*******************************************************************************
+print('Measuring the startup time of SHBAAM tools')
+print('JSON file                     :'+bch_jsn_fil)
+print('Maximum startup time (s)      :'+str(ZS_max))
+print('Number of repetitions         :'+str(IS_rep))
+print('-------------------------------')
+
+
+#*******************************************************************************
+#Paths and modules
+#*******************************************************************************
+shb_src_dir=os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','src')
+shb_cmd_py=os.path.join(shb_src_dir,'shbaam.py')
+
+YV_sub=['twsa','swe','conc','ldas','cache','compare']
+YV_hvy=['netCDF4','fiona','shapely','rtree','requests']
+YV_mod=['shbaam_jobs','shbaam_brian','shbaam_conc','shbaam_cmaj']
+
+
+#*******************************************************************************
+#Time the fastest of several runs of a Python command
+#*******************************************************************************
+def time_python(YV_cmd):
+     """Return the fastest wall time (s) of IS_rep runs of python YV_cmd."""
+     ZS_min=None
+     with open(os.devnull,'w') as shb_nul:
+          for JS_rep in range(IS_rep):
+               ZS_tic=timeit.default_timer()
+               subprocess.call([sys.executable]+YV_cmd,cwd=shb_src_dir,       \
+                               stdout=shb_nul,stderr=shb_nul)
+               ZS_toc=timeit.default_timer()-ZS_tic
+               if ZS_min is None or ZS_toc<ZS_min:
+                    ZS_min=ZS_toc
+     return ZS_min
+
+
+#*******************************************************************************
+#Startup time of the unified command
+#*******************************************************************************
+print('Startup time of the unified command')
+
+YD_bch={'python': sys.version.split()[0], 'max_time': ZS_max,                 \
+        'interpreter': time_python(['-c','pass']),                             \
+        'subcommands': {}, 'modules': {}}
+print(' - Interpreter only: '+'{:.3f}'.format(YD_bch['interpreter'])+' s')
+
+IS_err=0
+for YS_sub in YV_sub:
+     ZS_tim=time_python([shb_cmd_py,YS_sub])
+     YD_bch['subcommands'][YS_sub]=ZS_tim
+     print(' - shbaam.py '+YS_sub+': '+'{:.3f}'.format(ZS_tim)+' s')
+     if ZS_tim>ZS_max:
+          print('ERROR - The startup of shbaam.py '+YS_sub+' is too slow')
+          IS_err=IS_err+1
+
+
+#*******************************************************************************
+#Heavy modules imported by the unified command
+#*******************************************************************************
+print('Heavy modules imported by the unified command')
+
+YS_chk='import sys,shbaam;print(",".join(m for m in '+repr(YV_hvy)+' '         \
+      +'if m in sys.modules))'
+YS_out=subprocess.check_output([sys.executable,'-c',YS_chk],cwd=shb_src_dir)
+YV_imp=[YS_mod for YS_mod in YS_out.decode('ascii').strip().split(',')         \
+        if YS_mod!='']
+YD_bch['heavy_imports']=YV_imp
+if len(YV_imp)>0:
+     print('ERROR - shbaam.py imports: '+', '.join(YV_imp))
+     IS_err=IS_err+1
+else:
+     print(' - None')
+
+
+#*******************************************************************************
+#Import time of the tool modules
+#*******************************************************************************
+print('Import time of the tool modules')
+
+for YS_mod in YV_mod:
+     ZS_tim=time_python(['-c','import '+YS_mod])
+     YD_bch['modules'][YS_mod]=ZS_tim
+     print(' - '+YS_mod+': '+'{:.3f}'.format(ZS_tim)+' s')
+
+
+#*******************************************************************************
+#Write results
+#*******************************************************************************
+with open(bch_jsn_fil,'w') as bch_jsn:
+     json.dump(YD_bch,bch_jsn,indent=1)
+print('Results written in '+bch_jsn_fil)
+
+if IS_err>0:
+     print('ERROR - '+str(IS_err)+' startup checks failed')
+     raise SystemExit(99)
+
+print('Success!!!')
+
+
+#*******************************************************************************
+#End
+#*******************************************************************************
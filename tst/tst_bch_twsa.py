@@ -0,0 +1,333 @@
+#!/usr/bin/env python
+#*******************************************************************************
+#tst_bch_twsa.py
+#*******************************************************************************
+
+#Purpose:
+#Benchmark the stages of the computation of Terrestrial Water Storage Anomalies
+#using synthetic data. GRACE-like netCDF files (data and scale factors) are
+#generated on global grids of the given resolutions and numbers of time steps,
+#along with polygon shapefiles of the given sizes and numbers of vertices. The
+#selection of grid cells, the long-term mean, the anomalies, the writing of the
+#CSV file and of the netCDF map, as well as the concatenation of monthly files,
+#are timed separately for each combination, and the results are saved in a
+#JSON file so that they can be compared between versions.
+
+
+#*******************************************************************************
+#Prerequisites
+#*******************************************************************************
+import sys
+import os.path
+import tempfile
+import shutil
+import json
+import csv
+import timeit
+import platform
+import datetime
+import subprocess
+import netCDF4
+import numpy
+import fiona
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),    \
+                               '..','src'))
+import shbaam_cell
+import shbaam_wght
+import shbaam_anom
+import shbaam_ncdf
+import shbaam_conc
+
+
+#*******************************************************************************
+#Declaration of variables (given as command line arguments)
+#*******************************************************************************
+# 1 - bch_jsn_fil
+#(2)- resolutions in degrees, comma-separated (default: 1,0.5,0.25)
+#(3)- numbers of time steps, comma-separated (default: 12,120)
+#(4)- polygon radii in degrees, comma-separated (default: 2,10)
+#(5)- numbers of polygon vertices, comma-separated (default: 16,1024)
+#(6)- number of monthly files used for concatenation (default: 12, 0 to skip)
+
+
+#*******************************************************************************
+#Get command line arguments
+#*******************************************************************************
+IS_arg=len(sys.argv)
+if IS_arg < 2 or IS_arg > 7:
+     print('ERROR - A minimum of 1 and a maximum of 6 arguments can be used')
+     raise SystemExit(22)
+
+bch_jsn_fil=sys.argv[1]
+ZV_res=[float(x) for x in (sys.argv[2] if IS_arg > 2 else '1,0.5,0.25')       \
+                          .split(',')]
+IV_tim=[int(x) for x in (sys.argv[3] if IS_arg > 3 else '12,120').split(',')]
+ZV_rad=[float(x) for x in (sys.argv[4] if IS_arg > 4 else '2,10').split(',')]
+IV_vtx=[int(x) for x in (sys.argv[5] if IS_arg > 5 else '16,1024').split(',')]
+IS_mon=int(sys.argv[6]) if IS_arg > 6 else 12
+
+
+#*******************************************************************************
+#Print current variables
+#*******************************************************************************
+print('Benchmarking TWSA stages with synthetic data')
+print('JSON file                     :'+bch_jsn_fil)
+print('Resolutions (degrees)         :'+str(ZV_res))
+print('Numbers of time steps         :'+str(IV_tim))
+print('Polygon radii (degrees)       :'+str(ZV_rad))
+print('Numbers of polygon vertices   :'+str(IV_vtx))
+print('Number of monthly files       :'+str(IS_mon))
+print('-------------------------------')
+
+
+#*******************************************************************************
+#Generate a synthetic GRACE-like netCDF file and scale factors
+#*******************************************************************************
+def make_grace(shb_grc_ncf,shb_fct_ncf,ZS_res,IS_time,IS_chk=12):
+     """Write a global grid of random anomalies and of scale factors.
+
+     Longitudes are in [0,360] as in GRACE, the data is written by chunks of
+     IS_chk time steps and 10% of the scale factors are masked.
+     """
+     ZV_lon=numpy.arange(ZS_res/2,360,ZS_res)
+     ZV_lat=numpy.arange(-90+ZS_res/2,90,ZS_res)
+     shb_rng=numpy.random.RandomState(0)
+
+     f=netCDF4.Dataset(shb_grc_ncf,'w',format='NETCDF3_64BIT_OFFSET')
+     f.createDimension('lon',len(ZV_lon))
+     f.createDimension('lat',len(ZV_lat))
+     f.createDimension('time',None)
+     f.createVariable('lon','f4',('lon',))[:]=ZV_lon
+     f.createVariable('lat','f4',('lat',))[:]=ZV_lat
+     time=f.createVariable('time','f4',('time',))
+     time.units='days since 2002-01-01 00:00:00 UTC'
+     lwe_thickness=f.createVariable('lwe_thickness','f4',('time','lat','lon',))
+     lwe_thickness.units='cm'
+     time[:]=15+30.4375*numpy.arange(IS_time)
+     for JS_beg,JS_end in shbaam_anom.time_chunks(IS_time,IS_chk):
+          lwe_thickness[JS_beg:JS_end,:,:]=shb_rng.standard_normal(            \
+                             (JS_end-JS_beg,len(ZV_lat),len(ZV_lon)))*10
+     f.close()
+
+     g=netCDF4.Dataset(shb_fct_ncf,'w',format='NETCDF3_64BIT_OFFSET')
+     g.createDimension('lon',len(ZV_lon))
+     g.createDimension('lat',len(ZV_lat))
+     g.createVariable('lon','f4',('lon',))[:]=ZV_lon
+     g.createVariable('lat','f4',('lat',))[:]=ZV_lat
+     scale_factor=g.createVariable('scale_factor','f4',('lat','lon',),         \
+                                   fill_value=-99999.0)
+     ZM_scl=1+shb_rng.standard_normal((len(ZV_lat),len(ZV_lon)))*0.1
+     scale_factor[:,:]=numpy.ma.masked_where(                                  \
+                       shb_rng.uniform(size=ZM_scl.shape)<0.1,ZM_scl)
+     g.close()
+
+
+#*******************************************************************************
+#Generate a synthetic polygon shapefile
+#*******************************************************************************
+def make_polygon(shb_pol_shp,ZS_rad,IS_vtx,ZS_lon=20.0,ZS_lat=10.0):
+     """Write one star-shaped polygon of radius ZS_rad with IS_vtx vertices."""
+     ZV_ang=numpy.linspace(0,2*numpy.pi,IS_vtx,endpoint=False)
+     ZV_dst=ZS_rad*(1+0.3*numpy.sin(5*ZV_ang))
+     ZV_x=ZS_lon+ZV_dst*numpy.cos(ZV_ang)
+     ZV_y=numpy.clip(ZS_lat+ZV_dst*numpy.sin(ZV_ang),-89.9,89.9)
+     YV_crd=[(float(x),float(y)) for x,y in zip(ZV_x,ZV_y)]
+     YV_crd.append(YV_crd[0])
+
+     shb_pol_sch={'geometry': 'Polygon', 'properties': {'id': 'int'}}
+     with fiona.open(shb_pol_shp,'w',driver='ESRI Shapefile',                 \
+                     crs={'init': 'epsg:4326'},schema=shb_pol_sch) as shb_lay:
+          shb_lay.write({'geometry': {'type': 'Polygon',                       \
+                                      'coordinates': [YV_crd]},                \
+                         'properties': {'id': 1}})
+
+
+#*******************************************************************************
+#Benchmark the stages for one grid and one polygon
+#*******************************************************************************
+def bench_twsa(shb_grc_ncf,shb_fct_ncf,shb_pol_shp,shb_out_dir):
+     """Return the number of cells found and the time (s) of each stage."""
+     YD_stg={}
+
+     ZS_tic=timeit.default_timer()
+     f=netCDF4.Dataset(shb_grc_ncf,'r')
+     g=netCDF4.Dataset(shb_fct_ncf,'r')
+     ZV_grc_lon=f.variables['lon'][:]
+     ZV_grc_lat=f.variables['lat'][:]
+     ZV_grc_time=f.variables['time'][:]
+     IS_grc_lon=len(ZV_grc_lon)
+     ZM_grc_scl=g.variables['scale_factor'][:,:]
+     YD_stg['open']=timeit.default_timer()-ZS_tic
+
+     ZS_tic=timeit.default_timer()
+     with fiona.open(shb_pol_shp,'r') as shb_pol_lay:
+          IV_dom_lon,IV_dom_lat,IV_dom_fea,ZV_dom_sqm=                         \
+                     shbaam_cell.find_cells(ZV_grc_lon,ZV_grc_lat,shb_pol_lay)
+     IV_cel_lin,IV_dom_cel=numpy.unique(IV_dom_lat*IS_grc_lon+IV_dom_lon,     \
+                                        return_inverse=True)
+     IV_dom_cel=IV_dom_cel.ravel()
+     IV_cel_lat=IV_cel_lin//IS_grc_lon
+     IV_cel_lon=IV_cel_lin%IS_grc_lon
+     YD_stg['selection']=timeit.default_timer()-ZS_tic
+
+     ZS_tic=timeit.default_timer()
+     ZV_cel_avg,ZM_cel_lwe=shbaam_anom.cell_mean(f.variables['lwe_thickness'],\
+                                                 IV_cel_lat,IV_cel_lon)
+     YD_stg['mean']=timeit.default_timer()-ZS_tic
+
+     ZS_tic=timeit.default_timer()
+     ZV_cel_scl=numpy.ma.filled(ZM_grc_scl[IV_cel_lat,IV_cel_lon],0)
+     ZV_cel_msk=numpy.ma.getmaskarray(ZM_grc_scl)[IV_cel_lat,IV_cel_lon]
+     ZS_sqm=numpy.sum(ZV_dom_sqm*(~ZV_cel_msk[IV_dom_cel]))
+     IV_wgt_row,IV_wgt_col,ZV_wgt_val=shbaam_wght.weight_matrix(               \
+                                      IV_dom_fea,IV_dom_cel,                   \
+                                      ZV_cel_scl[IV_dom_cel]*ZV_dom_sqm,       \
+                                      1,len(IV_cel_lin))
+     ZV_wsa=numpy.zeros(len(ZV_grc_time))
+     YV_cel_ano=[]
+     for JS_beg,JS_end,ZM_cel_ano in shbaam_anom.cell_anomalies(               \
+                                      f.variables['lwe_thickness'],            \
+                                      IV_cel_lat,IV_cel_lon,ZV_cel_avg,0,      \
+                                      ZM_cel_lwe):
+          ZV_wsa[JS_beg:JS_end]=shbaam_wght.weight_product(ZM_cel_ano/100,     \
+                                                           IV_wgt_row,         \
+                                                           IV_wgt_col,         \
+                                                           ZV_wgt_val,1)[:,0]
+          YV_cel_ano.append((JS_beg,ZM_cel_ano))
+     ZV_wsa=100*ZV_wsa/ZS_sqm
+     #The anomalies of each chunk are kept so that the whole map is written in
+     #the netcdf stage
+     YD_stg['anomaly']=timeit.default_timer()-ZS_tic
+
+     ZS_tic=timeit.default_timer()
+     shb_dat_str=datetime.datetime(2002,1,1)
+     with open(os.path.join(shb_out_dir,'timeseries.csv'),'wb') as csvfile:
+          csvwriter=csv.writer(csvfile,dialect='excel')
+          for JS_grc_time in range(len(ZV_grc_time)):
+               csvwriter.writerow([(shb_dat_str+datetime.timedelta(            \
+                                   days=float(ZV_grc_time[JS_grc_time])))      \
+                                   .strftime('%m/%d/%Y'),ZV_wsa[JS_grc_time]])
+     YD_stg['csv']=timeit.default_timer()-ZS_tic
+
+     ZS_tic=timeit.default_timer()
+     h=netCDF4.Dataset(os.path.join(shb_out_dir,'map.nc'),'w',                \
+                       format='NETCDF3_CLASSIC')
+     h.createDimension('time',None)
+     h.createDimension('lat',len(ZV_grc_lat))
+     h.createDimension('lon',len(ZV_grc_lon))
+     h.createVariable('time','i4',('time',))
+     h.createVariable('lat','f4',('lat',))[:]=ZV_grc_lat
+     h.createVariable('lon','f4',('lon',))[:]=ZV_grc_lon
+     lwe_thickness=h.createVariable('lwe_thickness','f4',                      \
+                                    ('time','lat','lon',),                     \
+                                    fill_value=netCDF4.default_fillvals['f4'])
+     for JS_beg,ZM_cel_ano in YV_cel_ano:
+          shbaam_ncdf.write_block(lwe_thickness,JS_beg,ZM_cel_ano,IV_cel_lat,  \
+                                  IV_cel_lon)
+     h.variables['time'][:]=ZV_grc_time
+     h.close()
+     YD_stg['netcdf']=timeit.default_timer()-ZS_tic
+
+     f.close()
+     g.close()
+     return len(IV_cel_lin),YD_stg
+
+
+#*******************************************************************************
+#Benchmark the concatenation of monthly files
+#*******************************************************************************
+def bench_conc(shb_grc_ncf,IS_mon,shb_out_dir):
+     """Split the first IS_mon time steps in files and time their merging."""
+     YV_mon_ncf=[]
+     with netCDF4.Dataset(shb_grc_ncf,'r') as f:
+          for JS_mon in range(IS_mon):
+               shb_mon_ncf=os.path.join(shb_out_dir,                          \
+                                        'month.A{:04d}.nc4'.format(JS_mon))
+               with netCDF4.Dataset(shb_mon_ncf,'w') as m:
+                    m.createDimension('lon',len(f.dimensions['lon']))
+                    m.createDimension('lat',len(f.dimensions['lat']))
+                    m.createDimension('time',None)
+                    m.createVariable('lon','f4',('lon',))[:]=f['lon'][:]
+                    m.createVariable('lat','f4',('lat',))[:]=f['lat'][:]
+                    time=m.createVariable('time','f4',('time',))
+                    time.units=f['time'].units
+                    time[:]=f['time'][JS_mon:JS_mon+1]
+                    m.createVariable('SWE','f4',('time','lat','lon',))[:]=     \
+                                       f['lwe_thickness'][JS_mon:JS_mon+1,:,:]
+               YV_mon_ncf.append(shb_mon_ncf)
+
+     ZS_tic=timeit.default_timer()
+     shb_cnc_ncf=os.path.join(shb_out_dir,'merged.nc4')
+     ZV_tim=shbaam_conc.validate_netCDF4(YV_mon_ncf)
+     h=shbaam_conc.create_output(YV_mon_ncf[0],shb_cnc_ncf,ZV_tim)
+     shbaam_conc.concatenate_files(YV_mon_ncf,h,ZV_tim)
+     h.close()
+     return timeit.default_timer()-ZS_tic
+
+
+#*******************************************************************************
+#Run all benchmarks
+#*******************************************************************************
+YD_bch={}
+vsn=subprocess.Popen('bash ../version.sh',stdout=subprocess.PIPE,shell=True)  \
+               .communicate()[0].rstrip()
+YD_bch['version']=vsn.decode('ascii','replace') if isinstance(vsn,bytes)       \
+                  else vsn
+YD_bch['date']=datetime.datetime.utcnow().replace(microsecond=0).isoformat()
+YD_bch['host']=platform.node()
+YD_bch['python']=platform.python_version()
+YD_bch['numpy']=numpy.__version__
+YD_bch['netCDF4']=netCDF4.__version__
+YD_bch['twsa']=[]
+YD_bch['conc']=[]
+
+shb_tmp_dir=tempfile.mkdtemp()
+try:
+     for ZS_res in ZV_res:
+          ZS_cnc=None
+          for IS_time in IV_tim:
+               print('Resolution '+str(ZS_res)+', '+str(IS_time)+' time steps')
+               shb_grc_ncf=os.path.join(shb_tmp_dir,'grace.nc')
+               shb_fct_ncf=os.path.join(shb_tmp_dir,'scale.nc')
+               make_grace(shb_grc_ncf,shb_fct_ncf,ZS_res,IS_time)
+
+               for ZS_rad in ZV_rad:
+                    for IS_vtx in IV_vtx:
+                         shb_pol_shp=os.path.join(shb_tmp_dir,'polygon.shp')
+                         make_polygon(shb_pol_shp,ZS_rad,IS_vtx)
+                         IS_cel_tot,YD_stg=bench_twsa(shb_grc_ncf,shb_fct_ncf,\
+                                                      shb_pol_shp,shb_tmp_dir)
+                         YD_bch['twsa'].append({'resolution': ZS_res,          \
+                                                'time_steps': IS_time,         \
+                                                'radius': ZS_rad,              \
+                                                'vertices': IS_vtx,            \
+                                                'cells': IS_cel_tot,           \
+                                                'stages': YD_stg})
+                         print(' - Radius '+str(ZS_rad)+', '+str(IS_vtx)       \
+                               +' vertices, '+str(IS_cel_tot)+' cells: '       \
+                               +', '.join('{} {:.3f}s'.format(k,YD_stg[k])     \
+                                          for k in sorted(YD_stg)))
+
+               if IS_mon>0 and IS_time>=IS_mon and ZS_cnc is None:
+                    ZS_cnc=bench_conc(shb_grc_ncf,IS_mon,shb_tmp_dir)
+                    YD_bch['conc'].append({'resolution': ZS_res,               \
+                                           'files': IS_mon,                    \
+                                           'time': ZS_cnc})
+                    print(' - Concatenation of '+str(IS_mon)+' files: '        \
+                          +'{:.3f}s'.format(ZS_cnc))
+                    #The concatenation only depends on the resolution
+finally:
+     shutil.rmtree(shb_tmp_dir)
+
+
+#*******************************************************************************
+#Write JSON file
+#*******************************************************************************
+with open(bch_jsn_fil,'w') as bch_jsn:
+     json.dump(YD_bch,bch_jsn,indent=1,sort_keys=True)
+print('Results written in '+bch_jsn_fil)
+
+
+#*******************************************************************************
+#End
+#*******************************************************************************
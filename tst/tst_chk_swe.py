@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+#*******************************************************************************
+#tst_chk_swe.py
+#*******************************************************************************
+
+#Purpose:
+#Check that shbaam_brian.py drops the NoData grid cells from the average of the
+#SWE anomalies over a basin. A synthetic LDAS-like netCDF file is generated with
+#its SWE masked over an 'ocean' covering the western half of the grid, along
+#with a polygon that overlaps both the land and the ocean. The SWE of all land
+#cells has the same anomalies, hence the expected time series is known
+#whichever the weights of the cells. The tool is run with the cells selected by
+#their centers and by their fraction of overlap, and the time series of its CSV
+#file must be these anomalies, without any NaN.
+
+
+#*******************************************************************************
+#Prerequisites
+#*******************************************************************************
+import sys
+import os.path
+import tempfile
+import shutil
+import csv
+import subprocess
+import netCDF4
+import numpy
+import fiona
+
+
+#*******************************************************************************
+#Declaration of variables
+#*******************************************************************************
+shb_src_dir=os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','src')
+shb_swe_py=os.path.join(shb_src_dir,'shbaam_brian.py')
+
+ZV_lon=numpy.arange(0.5,10,1.0)
+ZV_lat=numpy.arange(0.5,10,1.0)
+IS_time=3
+ZV_ano=10.0*numpy.arange(IS_time)-10.0
+#The anomalies of all land cells, the SWE being 10, 20 and 30 plus a constant
+IS_ocn=5
+#The cells of the first IS_ocn longitudes are masked (ocean)
+YV_box=[(3.2,3.2),(7.8,3.2),(7.8,6.8),(3.2,6.8),(3.2,3.2)]
+#The polygon covers the centers of two ocean longitudes and three land ones
+
+print('Checking the NoData cells of the SWE anomalies')
+print('Number of time steps          :'+str(IS_time))
+print('Expected anomalies            :'+str(list(ZV_ano)))
+print('-------------------------------')
+
+
+#*******************************************************************************
+#Generate a synthetic LDAS-like netCDF file and polygon shapefile
+#*******************************************************************************
+def make_gldas(shb_gld_ncf):
+     """Write the SWE of a small grid, masked over the ocean."""
+     f=netCDF4.Dataset(shb_gld_ncf,'w',format='NETCDF3_CLASSIC')
+     f.createDimension('lon',len(ZV_lon))
+     f.createDimension('lat',len(ZV_lat))
+     f.createDimension('time',None)
+     f.createVariable('lon','f4',('lon',))[:]=ZV_lon
+     f.createVariable('lat','f4',('lat',))[:]=ZV_lat
+     time=f.createVariable('time','f4',('time',))
+     time.units='days since 2002-01-01 00:00:00'
+     SWE=f.createVariable('SWE','f4',('time','lat','lon',),                   \
+                          fill_value=netCDF4.default_fillvals['f4'])
+     SWE.units='kg m-2'
+     time[:]=15+30.4375*numpy.arange(IS_time)
+     ZM_swe=10.0*(numpy.arange(IS_time)+1)[:,None,None]                        \
+           +numpy.arange(len(ZV_lat))[None,:,None]                             \
+           +numpy.zeros((1,1,len(ZV_lon)))
+     ZM_msk=numpy.zeros(ZM_swe.shape,dtype=bool)
+     ZM_msk[:,:,:IS_ocn]=True
+     SWE[:,:,:]=numpy.ma.masked_where(ZM_msk,ZM_swe)
+     f.close()
+
+
+def make_polygon(shb_pol_shp):
+     """Write one rectangle overlapping the land and the ocean."""
+     shb_pol_sch={'geometry': 'Polygon', 'properties': {'id': 'int'}}
+     with fiona.open(shb_pol_shp,'w',driver='ESRI Shapefile',                 \
+                     crs={'init': 'epsg:4326'},schema=shb_pol_sch) as shb_lay:
+          shb_lay.write({'geometry': {'type': 'Polygon',                       \
+                                      'coordinates': [YV_box]},                \
+                         'properties': {'id': 1}})
+
+
+#*******************************************************************************
+#Run shbaam_brian.py and check its time series
+#*******************************************************************************
+def check_mode(YS_cel_mod,shb_tmp_dir,shb_gld_ncf,shb_pol_shp):
+     """Run the tool with the given cell mode and return the errors found."""
+     shb_pnt_shp=os.path.join(shb_tmp_dir,'points.shp')                      \
+                 if YS_cel_mod=='center' else ''
+     shb_swe_csv=os.path.join(shb_tmp_dir,'swe_'+YS_cel_mod+'.csv')
+     shb_swe_ncf=os.path.join(shb_tmp_dir,'swe_'+YS_cel_mod+'.nc')
+     with open(os.devnull,'w') as shb_nul:
+          IS_ret=subprocess.call([sys.executable,shb_swe_py,shb_gld_ncf,       \
+                                  shb_pol_shp,shb_pnt_shp,shb_swe_csv,         \
+                                  shb_swe_ncf,'','','0','0','','',YS_cel_mod], \
+                                 cwd=shb_src_dir,stdout=shb_nul)
+     if IS_ret!=0:
+          return ['the tool failed with code '+str(IS_ret)]
+
+     with open(shb_swe_csv,'rb') as csvfile:
+          YV_row=list(csv.reader(csvfile))[1:]
+     ZV_swe=numpy.array([float(YV_val[1]) for YV_val in YV_row])
+     YV_err=[]
+     if len(ZV_swe)!=IS_time:
+          YV_err.append('the number of time steps is '+str(len(ZV_swe)))
+     elif numpy.any(numpy.isnan(ZV_swe)):
+          YV_err.append('the time series has NaN: '+str(list(ZV_swe)))
+     elif not numpy.allclose(ZV_swe,ZV_ano,atol=1e-4):
+          YV_err.append('the time series is '+str(list(ZV_swe)))
+     return YV_err
+
+
+#*******************************************************************************
+#Check both cell modes
+#*******************************************************************************
+shb_tmp_dir=tempfile.mkdtemp()
+IS_err=0
+try:
+     shb_gld_ncf=os.path.join(shb_tmp_dir,'gldas.nc')
+     shb_pol_shp=os.path.join(shb_tmp_dir,'polygon.shp')
+     make_gldas(shb_gld_ncf)
+     make_polygon(shb_pol_shp)
+     for YS_cel_mod in ['center','fraction']:
+          YV_err=check_mode(YS_cel_mod,shb_tmp_dir,shb_gld_ncf,shb_pol_shp)
+          if len(YV_err)>0:
+               print('ERROR - '+YS_cel_mod+': '+', '.join(YV_err))
+               IS_err=IS_err+1
+          else:
+               print(' - '+YS_cel_mod+': OK')
+finally:
+     shutil.rmtree(shb_tmp_dir)
+
+if IS_err>0:
+     print('ERROR - '+str(IS_err)+' SWE checks failed')
+     raise SystemExit(99)
+
+print('Success!!!')
+
+
+#*******************************************************************************
+#End
+#*******************************************************************************
@@ -14,7 +14,6 @@
 #*******************************************************************************
 import sys
 import netCDF4
-import math
 import numpy
 
 
@@ -25,14 +24,16 @@ import numpy
 # 2 - rrr_ncf_file2
 #(3)- relative tolerance 
 #(4)- absolute tolerance 
+#(5)- number of time steps read at once (default: 12, 0 for all)
+#(6)- 1 to stop at the first chunk of time steps beyond tolerance (default: 0)
 
 
 #*******************************************************************************
 #Get command line arguments
 #*******************************************************************************
 IS_arg=len(sys.argv)
-if IS_arg < 3 or IS_arg > 5:
-     print('ERROR - A minimum of 2 and a maximum of 4 arguments can be used')
+if IS_arg < 3 or IS_arg > 7:
+     print('ERROR - A minimum of 2 and a maximum of 6 arguments can be used')
      raise SystemExit(22) 
 
 rrr_ncf_file1=sys.argv[1]
@@ -45,6 +46,14 @@ if IS_arg > 4:
      ZS_atol=float(sys.argv[4])
 else:
      ZS_atol=float(0)
+if IS_arg > 5:
+     IS_chk=int(sys.argv[5])
+else:
+     IS_chk=12
+if IS_arg > 6:
+     IS_stp=int(sys.argv[6])
+else:
+     IS_stp=0
      
 
 #*******************************************************************************
@@ -55,6 +64,8 @@ print('1st netCDF file               :'+rrr_ncf_file1)
 print('2nd netCDF file               :'+rrr_ncf_file2)
 print('Relative tolerance            :'+str(ZS_rtol))
 print('Absolute tolerance            :'+str(ZS_atol))
+print('Time steps read at once       :'+str(IS_chk))
+print('Stop at first failure         :'+str(IS_stp))
 print('-------------------------------')
 
 
@@ -231,47 +242,76 @@ print('-------------------------------')
 #-------------------------------------------------------------------------------
 ZS_rdif_max=0
 ZS_adif_max=0
+IV_adif_loc=None
+JS_rdif_loc=None
 
-for JS_time in range(IS_time):
-#- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - 
-#initializing
-#- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - 
-     ZS_rdif=0
-     ZS_adif=0
+if IS_chk<=0 or IS_chk>IS_time:
+     IS_chk=max(IS_time,1)
+
+for JS_beg in range(0,IS_time,IS_chk):
+     JS_end=min(JS_beg+IS_chk,IS_time)
 
 #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - 
 #Reading values
 #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - 
-     ZM_Var_1=f1.variables[rrr_ncf_var][JS_time,:]
-     ZM_Var_2=f2.variables[rrr_ncf_var][JS_time,:]
+     ZM_Var_1=numpy.ma.masked_invalid(f1.variables[rrr_ncf_var][JS_beg:JS_end])
+     ZM_Var_2=numpy.ma.masked_invalid(f2.variables[rrr_ncf_var][JS_beg:JS_end])
+     #The time steps of a chunk are read at once. Values equal to _FillValue
+     #are masked by the netCDF library, and NaN values are masked here
 
 #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - 
 #Checking that the locations of NoData are the same
 #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - 
-     ZM_mask1=numpy.logical_not(numpy.ma.getmaskarray(ZM_Var_1))
-     ZM_mask2=numpy.logical_not(numpy.ma.getmaskarray(ZM_Var_2))
-     if numpy.array_equal(ZM_mask1,ZM_mask2):
-          ZM_mask=ZM_mask1
-     else:
-          print('ERROR - The locations of NoData differ')
+     ZM_mask1=numpy.ma.getmaskarray(ZM_Var_1)
+     ZM_mask2=numpy.ma.getmaskarray(ZM_Var_2)
+     if not numpy.array_equal(ZM_mask1,ZM_mask2):
+          IV_loc=numpy.unravel_index(numpy.argmax(ZM_mask1!=ZM_mask2),        \
+                                     ZM_mask1.shape)
+          print('ERROR - The locations of NoData differ, first at (time,lat,'  \
+                +'lon): '+str((JS_beg+int(IV_loc[0]),)+tuple(int(x)           \
+                                                         for x in IV_loc[1:])))
           raise SystemExit(99) 
+     ZM_mask=numpy.logical_not(ZM_mask1)
 
 #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - 
 #Comparing difference values
 #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - 
-     #Tried computations with regular Python lists but this makes is very slow.
-     #Also tried using map(operator.sub,V,W) or [x-y for x,y in zip(V,W)]
-     #But this still results in slow computations.
-     #The best performance seems to be with Numpy.
+     ZM_Var_1=numpy.ma.filled(ZM_Var_1.astype(numpy.float64),0)
+     ZM_Var_2=numpy.ma.filled(ZM_Var_2.astype(numpy.float64),0)
+     #Differences are computed in double precision with NoData set to zero, so
+     #that they do not contribute to the differences
+
      ZM_dVar_abs=numpy.absolute(ZM_Var_1-ZM_Var_2)
-     ZS_adif_max=max(numpy.max(ZM_dVar_abs),ZS_adif_max)
+     if ZM_dVar_abs.size>0:
+          JS_loc=int(numpy.argmax(ZM_dVar_abs))
+          if ZM_dVar_abs.flat[JS_loc]>ZS_adif_max or IV_adif_loc is None:
+               ZS_adif_max=float(ZM_dVar_abs.flat[JS_loc])
+               IV_loc=numpy.unravel_index(JS_loc,ZM_dVar_abs.shape)
+               IV_adif_loc=(JS_beg+int(IV_loc[0]),int(IV_loc[1]),             \
+                            int(IV_loc[2]))
+               ZS_adif_val1=float(ZM_Var_1.flat[JS_loc])
+               ZS_adif_val2=float(ZM_Var_2.flat[JS_loc])
+
+     ZV_rdif_num=numpy.sum((ZM_dVar_abs*ZM_mask)**2,axis=(1,2))
+     ZV_rdif_den=numpy.sum((ZM_Var_1*ZM_mask)**2,axis=(1,2))
+     with numpy.errstate(divide='ignore',invalid='ignore'):
+          ZV_rdif=numpy.where(ZV_rdif_den>0,                                  \
+                              numpy.sqrt(ZV_rdif_num/ZV_rdif_den),            \
+                              numpy.where(ZV_rdif_num>0,numpy.inf,0))
+     #Relative difference of each time step: the norm of the differences
+     #divided by the norm of the values of the first file
+     if ZV_rdif.size>0 and (numpy.max(ZV_rdif)>ZS_rdif_max                    \
+                            or JS_rdif_loc is None):
+          ZS_rdif_max=float(numpy.max(ZV_rdif))
+          JS_rdif_loc=JS_beg+int(numpy.argmax(ZV_rdif))
 
-     ZS_rdif=numpy.sum(numpy.multiply(ZM_dVar_abs,ZM_dVar_abs,where=ZM_mask))  \
-            /numpy.sum(numpy.multiply(ZM_Var_1,ZM_Var_1,where=ZM_mask))
-     #Using the mask helps avoid the 'overflow' warning at runtime by performing
-     #operations only for values that are not masked
-     ZS_rdif=math.sqrt(ZS_rdif)
-     ZS_rdif_max=max(ZS_rdif,ZS_rdif_max)
+#- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - 
+#Stopping at the first chunk beyond tolerance (optional)
+#- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - 
+     if IS_stp!=0 and (ZS_rdif_max > ZS_rtol or ZS_adif_max > ZS_atol):
+          print('Stopped after time steps      :'+str(JS_beg)+'-'             \
+                +str(JS_end-1))
+          break
 
 
 #*******************************************************************************
@@ -279,6 +319,12 @@ for JS_time in range(IS_time):
 #*******************************************************************************
 print('Max relative difference       :'+'{0:.2e}'.format(ZS_rdif_max))
 print('Max absolute difference       :'+'{0:.2e}'.format(ZS_adif_max))
+if JS_rdif_loc is not None:
+     print('Max rel. difference at time   :'+str(JS_rdif_loc))
+if IV_adif_loc is not None:
+     print('Max abs. difference at        :'+str(IV_adif_loc)+' (time,lat,lon)')
+     print('Values at this location       :'+str(ZS_adif_val1)+' <> '         \
+                                            +str(ZS_adif_val2))
 print('-------------------------------')
 
 if ZS_rdif_max > ZS_rtol:
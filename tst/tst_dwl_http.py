@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+#*******************************************************************************
+#tst_dwl_http.py
+#*******************************************************************************
+
+#Purpose:
+#Check the resumable downloads of shbaam_http.py against a local stand-in
+#server. The server is started in a thread on a free port of the local host and
+#serves the same bytes under several paths, each of them misbehaving in its own
+#way: an interrupted transfer, server errors (5xx) before a success, a partial
+#response that does not start where the '.part' file ends, and a missing file
+#(4xx). The test checks that each file is downloaded intact, with the expected
+#sequence of requests, and that no '.part' file is left.
+
+
+#*******************************************************************************
+#Prerequisites
+#*******************************************************************************
+import sys
+import os.path
+import shutil
+import tempfile
+import threading
+try:
+     import BaseHTTPServer as http_server
+except ImportError:
+     import http.server as http_server
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),   \
+                               '..','src'))
+import shbaam_http
+
+
+#*******************************************************************************
+#Declaration of variables
+#*******************************************************************************
+YS_dat=bytes(bytearray(range(256)))*1024
+IS_dat=len(YS_dat)
+IS_prt=IS_dat//4
+#Size of the '.part' file left by a previous attempt for the misaligned range
+IS_cut=65536
+#Size sent before the interrupted transfer is cut, one block of shbaam_http
+
+YD_req={}
+#The range header of each request received by the server, by path
+
+
+#*******************************************************************************
+#Stand-in server
+#*******************************************************************************
+class StandInHandler(http_server.BaseHTTPRequestHandler):
+     """Serve YS_dat with the misbehavior named by the path of the request."""
+
+     def log_message(self,*args):
+          pass
+
+     def do_GET(self):
+          YS_pth=self.path.split('?')[0]
+          YS_rng=self.headers.get('Range')
+          YD_req.setdefault(YS_pth,[]).append(YS_rng)
+          IS_req=len(YD_req[YS_pth])
+
+          if YS_pth=='/missing':
+               self.send_error(404)
+               return
+          if YS_pth=='/flaky' and IS_req<=2:
+               self.send_error(503)
+               return
+
+          IS_beg=0
+          if YS_rng is not None:
+               IS_beg=int(YS_rng.replace('bytes=','').split('-')[0])
+               if YS_pth=='/misaligned':
+                    IS_beg=IS_beg-10
+          #The misaligned server answers with another range than requested
+
+          YS_snt=YS_dat[IS_beg:]
+          if IS_beg>0:
+               self.send_response(206)
+               self.send_header('Content-Range','bytes '+str(IS_beg)+'-'      \
+                                +str(IS_dat-1)+'/'+str(IS_dat))
+          else:
+               self.send_response(200)
+          self.send_header('Content-Length',str(len(YS_snt)))
+          self.send_header('Content-Disposition','attachment; filename="'     \
+                           +YS_pth.strip('/')+'.bin"')
+          self.end_headers()
+
+          if YS_pth=='/interrupted' and IS_req==1:
+               self.wfile.write(YS_snt[:IS_cut])
+               return
+          #The connection is closed during the first transfer
+          self.wfile.write(YS_snt)
+
+
+shb_srv=http_server.HTTPServer(('127.0.0.1',0),StandInHandler)
+shb_thr=threading.Thread(target=shb_srv.serve_forever)
+shb_thr.daemon=True
+shb_thr.start()
+url='http://127.0.0.1:'+str(shb_srv.server_address[1])
+
+
+#*******************************************************************************
+#Print current variables
+#*******************************************************************************
+print('Checking the resumable downloads')
+print('Stand-in server               :'+url)
+print('Size of the file (bytes)      :'+str(IS_dat))
+print('-------------------------------')
+
+
+#*******************************************************************************
+#Download a file from the stand-in server
+#*******************************************************************************
+def check_download(YS_pth,YV_rng_exp,shb_out_dir,s):
+     """Download one path and return the list of errors found."""
+     YV_err=[]
+     try:
+          shb_fin=shbaam_http.download(s,url+'/'+YS_pth,{},shb_out_dir,YS_pth,\
+                                       IS_try=5,ZS_bck=0.01,ZS_tmo=10.0)
+          with open(shb_fin,'rb') as shb_fil:
+               if shb_fil.read()!=YS_dat:
+                    YV_err.append('the file downloaded differs')
+          if os.path.basename(shb_fin)!=YS_pth+'.bin':
+               YV_err.append('the file is named '+os.path.basename(shb_fin))
+     except IOError as e:
+          if YS_pth!='missing':
+               YV_err.append(str(e))
+     else:
+          if YS_pth=='missing':
+               YV_err.append('the download did not fail')
+     if YD_req.get('/'+YS_pth,[])!=YV_rng_exp:
+          YV_err.append('the requests were '+str(YD_req.get('/'+YS_pth,[])))
+     if os.path.isfile(os.path.join(shb_out_dir,YS_pth+'.part'))              \
+        and YS_pth!='missing':
+          YV_err.append('a .part file was left')
+     return YV_err
+
+
+#*******************************************************************************
+#Check each misbehavior of the server
+#*******************************************************************************
+shb_out_dir=tempfile.mkdtemp()
+s=shbaam_http.session()
+
+with open(os.path.join(shb_out_dir,'misaligned.part'),'wb') as shb_fil:
+     shb_fil.write(YS_dat[:IS_prt])
+
+YV_chk=[('interrupted',[None,'bytes='+str(IS_cut)+'-']),                      \
+        ('flaky',[None,None,None]),                                            \
+        ('misaligned',['bytes='+str(IS_prt)+'-',None]),                        \
+        ('missing',[None])]
+#The interrupted transfer is resumed where it stopped, the server errors are
+#retried, the misaligned range is discarded and the file downloaded again, and
+#the missing file is not retried
+
+IS_err=0
+try:
+     for YS_pth,YV_rng_exp in YV_chk:
+          YV_err=check_download(YS_pth,YV_rng_exp,shb_out_dir,s)
+          if len(YV_err)>0:
+               print('ERROR - '+YS_pth+': '+', '.join(YV_err))
+               IS_err=IS_err+1
+          else:
+               print(' - '+YS_pth+': OK')
+finally:
+     s.close()
+     shb_srv.shutdown()
+     shutil.rmtree(shb_out_dir)
+
+if IS_err>0:
+     print('ERROR - '+str(IS_err)+' download checks failed')
+     raise SystemExit(99)
+
+print('Success!!!')
+
+
+#*******************************************************************************
+#End
+#*******************************************************************************